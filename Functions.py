@@ -1,8 +1,17 @@
 import os
+import logging
+import threading
+
 import config
+import metrics
+import llm_fixtures
 
 from dotenv import load_dotenv
 
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
 if config.app_type == 'local_dev':
     # LOAD FROM .ENV FILES FOR LOCAL DEVELOPMENT
 
@@ -22,13 +31,155 @@ else:
     tts_key = config.tts_key
 
 
+# API version used by the portal apps unless they ask for another one
+DEFAULT_API_VERSION = "2024-02-01"
+
+# One client (and so one connection pool) per (endpoint, API version, key), shared by every session
+_clients = {}
+_client_stats = {}
+_clients_lock = threading.Lock()
+
+# Async clients for llm_fanout's event loop, keyed like _clients
+_async_clients = {}
+
+
+class ConnectionStats:
+    """Counts requests and new connections on a client, to show how often connections are reused"""
+
+    def __init__(self):
+        self.lookups = 0
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+
+    def on_request(self, request):
+        self.requests += 1
+        # httpcore reports connection setup through this trace callback
+        request.extensions["trace"] = self._trace
+
+    def _trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            self.new_connections += 1
+        elif event_name == "connection.start_tls.complete":
+            self.tls_handshakes += 1
+
+    async def on_async_request(self, request):
+        # httpx awaits the hooks (and httpcore the trace callback) of an async client
+        self.requests += 1
+        request.extensions["trace"] = self._async_trace
+
+    async def _async_trace(self, event_name, info):
+        self._trace(event_name, info)
+
+    def as_dict(self):
+        reused = max(self.requests - self.new_connections, 0)
+        return {
+            "lookups": self.lookups,
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "tls_handshakes": self.tls_handshakes,
+            "connection_reuse_ratio": reused / self.requests if self.requests else None,
+        }
+
+
+def _http_options():
+    import httpx
+
+    timeout = httpx.Timeout(config.OPENAI_READ_TIMEOUT, connect=config.OPENAI_CONNECT_TIMEOUT)
+    limits = httpx.Limits(
+        max_connections=config.OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=config.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=config.OPENAI_KEEPALIVE_EXPIRY,
+    )
+    return timeout, limits
+
+
+def get_client(api_version=DEFAULT_API_VERSION, azure_endpoint=None, azure_api_key=None):
+    """
+    Return the process-wide AzureOpenAI client for an endpoint and API version.
+
+    The client is built once with pooled keep-alive connections and the timeouts from
+    config.py, then shared by every session and rerun. azure_endpoint and azure_api_key
+    default to the portal's Azure OpenAI resource.
+    """
+    azure_endpoint = azure_endpoint or endpoint
+    azure_api_key = azure_api_key or api_key
+    key = (azure_endpoint, api_version, azure_api_key)
+
+    with _clients_lock:
+        if key not in _clients:
+            from openai import AzureOpenAI, DefaultHttpxClient
+
+            stats = ConnectionStats()
+            timeout, limits = _http_options()
+            http_client = DefaultHttpxClient(
+                limits=limits, timeout=timeout, event_hooks={"request": [stats.on_request]},
+                transport=llm_fixtures.transport(limits),
+            )
+            _clients[key] = AzureOpenAI(
+                azure_endpoint=azure_endpoint,
+                api_key=azure_api_key,
+                api_version=api_version,
+                timeout=timeout,
+                max_retries=config.OPENAI_MAX_RETRIES,
+                http_client=http_client,
+            )
+            _client_stats[key] = stats
+            logger.info(f"Created Azure OpenAI client for {azure_endpoint} (api_version {api_version})")
+
+        _client_stats[key].lookups += 1
+        return _clients[key]
+
+
+def get_async_client(client):
+    """
+    Return the process-wide AsyncAzureOpenAI client matching a shared client from get_client.
+
+    Only for use on llm_fanout's event loop: an async client's connections belong to
+    the loop that opened them.
+    """
+    with _clients_lock:
+        key = next((client_key for client_key, shared in _clients.items() if shared is client), None)
+        if key is None:
+            raise ValueError("Async clients are only available for clients created by Functions.get_client")
+
+        if key not in _async_clients:
+            from openai import AsyncAzureOpenAI, DefaultAsyncHttpxClient
+
+            azure_endpoint, api_version, azure_api_key = key
+            stats = ConnectionStats()
+            timeout, limits = _http_options()
+            http_client = DefaultAsyncHttpxClient(
+                limits=limits, timeout=timeout, event_hooks={"request": [stats.on_async_request]},
+                transport=llm_fixtures.async_transport(limits),
+            )
+            _async_clients[key] = AsyncAzureOpenAI(
+                azure_endpoint=azure_endpoint,
+                api_key=azure_api_key,
+                api_version=api_version,
+                timeout=timeout,
+                max_retries=config.OPENAI_MAX_RETRIES,
+                http_client=http_client,
+            )
+            _client_stats[(azure_endpoint, f"{api_version} async", azure_api_key)] = stats
+            logger.info(f"Created async Azure OpenAI client for {azure_endpoint} (api_version {api_version})")
+
+        _client_stats[(key[0], f"{key[1]} async", key[2])].lookups += 1
+        return _async_clients[key]
+
+
+def client_stats():
+    """Report how often each shared client and its connections have been reused"""
+    with _clients_lock:
+        return {
+            f"{client_endpoint} {api_version}": stats.as_dict()
+            for (client_endpoint, api_version, _), stats in _client_stats.items()
+        }
+
+
 def create_client():
-    from openai import AzureOpenAI
-    
-    # Create the OpenAI object
-    client = AzureOpenAI(
-        azure_endpoint=endpoint,
-        api_key=api_key,
-        api_version="2024-02-01",)
-    
-    return client
+    """Return the shared Azure OpenAI client for the portal's default endpoint"""
+    return get_client()
+
+
+metrics.register_stats("openai_client", client_stats, labels=("client",))
@@ -24,6 +24,9 @@ client = AzureOpenAI(
     api_version="2024-02-01",
 )
   
+# Tesseract runs as a separate process; one that takes longer than this on an image is killed
+OCR_TIMEOUT_SECONDS = float(os.getenv("OCR_TIMEOUT_SECONDS", "60"))
+
 # Allowed file extensions  
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'doc', 'docx', 'csv', 'jpg', 'jpeg', 'png'}  
   
@@ -73,7 +76,7 @@ def extract_text_from_file(file_bytes_io, filename):
     elif ext in ['jpg', 'jpeg', 'png']:  
         try:  
             image = Image.open(file_bytes_io)  
-            text = pytesseract.image_to_string(image)  
+            text = pytesseract.image_to_string(image, timeout=OCR_TIMEOUT_SECONDS)  
             return text  
         except Exception as e:  
             print(f"Error reading image file {filename}: {e}")  
@@ -0,0 +1,328 @@
+import time
+import logging
+import importlib
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Every portal app is declared here. The gallery, the sidebar menus and the
+# dispatcher in app.py are all built from this registry.
+#
+# entry_point   "module:function" that renders the app. The module is only
+#               imported the first time the app is launched.
+# needs_client  The entry point takes the shared Azure OpenAI client.
+# show_in_gallery  Defaults to True. Sidebar-only apps set it to False.
+# usage_id      Id that sidebar launches are logged under in ai_portal_usage. These
+#               are the ids the sidebar menus logged before the registry existed, so
+#               usage reports stay comparable. Defaults to the app id.
+
+APP_METADATA = {
+    "chatgpt_general": {
+        "name": "ChatGPT",
+        "description": "TIH ChatGPT using OpenAI Large Language Models",
+        "image_name": "chatgpt.jpg",
+        "fallback_emoji": "🤖",
+        "category": "Natural Language Processing",
+        "sidebar_value": "ChatGPT",
+        "parent_app": "ChatGPT",
+        "sub_app": "ChatGPT",
+        "usage_id": "chatgpt_chatgpt",
+        "tags": ["ChatGPT", "Openai", "LLM"],
+        "api_available": False,
+        "entry_point": "functions.chatgpt.chatgpt:chatgpt",
+        "needs_client": True
+    },
+    "chatgpt_smart_goal": {
+        "name": "Smart Goal Creator",
+        "description": "AI-powered SMART goal creator to help you structure your Workday CPE goals",
+        "image_name": "smart_goal_creator.jpg",
+        "fallback_emoji": "🎯",
+        "category": "Productivity",
+        "sidebar_value": "ChatGPT",
+        "parent_app": "ChatGPT",
+        "sub_app": "Smart Goal Creator",
+        "usage_id": "chatgpt_smart_goal_creator",
+        "tags": ["Workday", "CPEs", "SMART", "goals", "productivity"],
+        "api_available": False,
+        "entry_point": "functions.chatgpt.smart_goal_creator:smart_goal_creator",
+        "needs_client": True
+    },
+    "doc_extraction": {
+        "name": "Data Extraction",
+        "description": "Extract data in a structured format from documents using advanced AI processing",
+        "image_name": "data_extraction.png",
+        "fallback_emoji": "📄",
+        "category": "Document Analysis",
+        "sidebar_value": "Document Intelligence",
+        "parent_app": "Document Intelligence",
+        "sub_app": "Data Extraction",
+        "usage_id": "doc_data_extraction",
+        "tags": ["Data Extraction", "Text mining", "Document Intelligence"],
+        "api_available": False,
+        "entry_point": "functions.document_intelligence.data_extraction:data_extraction",
+        "needs_client": True
+    },
+    "doc_summary": {
+        "name": "Document Summarization",
+        "description": "Use AI to summarise your documents in various summarisation styles",
+        "image_name": "document_summarisation.png",
+        "fallback_emoji": "📝",
+        "category": "Document Analysis",
+        "sidebar_value": "Document Intelligence",
+        "parent_app": "Document Intelligence",
+        "sub_app": "Document Summarization",
+        "usage_id": "doc_document_summarization",
+        "tags": ["Summarise", "Document Intelligence"],
+        "api_available": True,
+        "entry_point": "functions.document_intelligence.doc_summary:doc_summary",
+        "needs_client": True
+    },
+    "ppt_creator": {
+        "name": "PPT Presentation Creator",
+        "description": "Automatically create professional starter presentations from a prompt or from your documents",
+        "image_name": "ppt_creator.png",
+        "fallback_emoji": "📊",
+        "category": "Document Analysis",
+        "sidebar_value": "Document Intelligence",
+        "parent_app": "Document Intelligence",
+        "sub_app": "PPT Presentation Creator",
+        "usage_id": "doc_ppt_presentation_creator",
+        "tags": ["Powerpoint", "Presentation", "PPT"],
+        "api_available": False,
+        "entry_point": "functions.document_intelligence.ppt_generator:ppt_app",
+        "needs_client": False
+    },
+    "audio_transcription": {
+        "name": "Audio Transcription",
+        "description": "Convert audio files into text transcriptions that you can ask questions about using advanced AI",
+        "image_name": "speech_to_text.png",
+        "fallback_emoji": "🎵",
+        "category": "Audio Processing",
+        "sidebar_value": "Audio analysis",
+        "parent_app": "Audio analysis",
+        "sub_app": "Audio Transcription",
+        "usage_id": "audio_audio_transcription",
+        "tags": ["Audio", "Transcription", "Speech to text", "Call analysis", "voice", "speaker diarization"],
+        "api_available": True,
+        "entry_point": "functions.audio_analysis.stt_app:speech_to_text",
+        "needs_client": True
+    },
+    "image_gen": {
+        "name": "Image Generation",
+        "description": "Create custom images using advanced AI models",
+        "image_name": "image_gen.png",
+        "fallback_emoji": "🎨",
+        "category": "Computer Vision",
+        "sidebar_value": "Image Generation",
+        "parent_app": "Image Generation",
+        "sub_app": None,
+        "usage_id": "image_generation",
+        "tags": ["Images", "Generation", "Dalle", "Content Creation"],
+        "api_available": True,
+        "entry_point": "functions.image_generation.image_gen:image_generation",
+        "needs_client": True
+    },
+    "test_case_generator": {
+        "name": "Test Case Generator",
+        "description": "Create detailed test scenarios using the power of AI",
+        "image_name": "test_case_generator.png",
+        "fallback_emoji": "🎵",
+        "category": "Natural Language Processing",
+        "sidebar_value": "Business Apps",
+        "parent_app": "Business Apps",
+        "sub_app": "Test Case Generator",
+        "usage_id": "business_test_case_generator",
+        "tags": ["Testing", "Automation", "Test Cases", "Scenarios"],
+        "api_available": True,
+        "entry_point": "functions.business_apps.test_case_generator:test_case_generator",
+        "needs_client": False
+    },
+    "ocr_drivers_license": {
+        "name": "OCR - Driver's License",
+        "description": "Use OCR to extract data from a driver's license card",
+        "image_name": "ocr_drivers.png",
+        "fallback_emoji": "🎵",
+        "category": "Data Extraction",
+        "sidebar_value": "OCR",
+        "parent_app": "OCR",
+        "sub_app": "Driver's License",
+        "usage_id": "ocr_drivers_license",
+        "tags": ["OCR", "Driver's License", "Data Extraction"],
+        "api_available": True,
+        "entry_point": "functions.ocr_apps.drivers_licence:ocr_drivers_license",
+        "needs_client": False
+    },
+    "ocr_smart_card_id": {
+        "name": "OCR - ID Smart Card",
+        "description": "Use OCR to extract data from a smart ID card",
+        "image_name": None,
+        "fallback_emoji": "🪪",
+        "category": "Data Extraction",
+        "sidebar_value": "OCR",
+        "parent_app": "OCR",
+        "sub_app": "ID Smart Card",
+        "usage_id": "ocr_id_smart_card",
+        "tags": ["OCR", "ID", "Smart Card", "Data Extraction"],
+        "api_available": False,
+        "entry_point": "functions.ocr_apps.smart_card_id:ocr_id_card",
+        "needs_client": False,
+        "show_in_gallery": False
+    },
+    "ocr_green_book_id": {
+        "name": "OCR - ID Green Book",
+        "description": "Use OCR to extract data from a green ID book",
+        "image_name": None,
+        "fallback_emoji": "📗",
+        "category": "Data Extraction",
+        "sidebar_value": "OCR",
+        "parent_app": "OCR",
+        "sub_app": "ID Green Book",
+        "usage_id": "ocr_id_green_book",
+        "tags": ["OCR", "ID", "Green Book", "Data Extraction"],
+        "api_available": False,
+        "entry_point": None,  # Not built yet
+        "needs_client": False,
+        "show_in_gallery": False
+    },
+    "ocr_vehicle_license": {
+        "name": "OCR - Vehicle License Disc",
+        "description": "Use OCR to extract data from a vehicle license disc",
+        "image_name": "vehicle_license_disc_ocr.png",
+        "fallback_emoji": "🎵",
+        "category": "Data Extraction",
+        "sidebar_value": "OCR",
+        "parent_app": "OCR",
+        "sub_app": "Vehicle License Disc",
+        "usage_id": "ocr_vehicle_license_disc",
+        "tags": ["OCR", "Vehicle License", "License Disc", "Data Extraction"],
+        "api_available": True,
+        "entry_point": "functions.ocr_apps.vehicle_license_disc:ocr_vehicle_license",
+        "needs_client": False
+    },
+    "claims_decisioning_chatbot": {
+        "name": "Claims Decisioning Chatbot",
+        "description": "AI Chatbot trained on claims decisioning documentation to assist with claims queries",
+        "image_name": "claims_decisioning_chatbot.png",
+        "fallback_emoji": "🎵",
+        "category": "Chatbot",
+        "sidebar_value": "Business Apps",
+        "parent_app": "Business Apps",
+        "sub_app": "Claims Decisioning Chatbot",
+        "usage_id": "business_claims_decisioning_chatbot",
+        "tags": ["Claims Decisioning", "Chatbot", "Q&A"],
+        "api_available": False,
+        "entry_point": "functions.business_apps.chatbots.claims_decisioning.cb:claims_cb",
+        "needs_client": False
+    },
+    "comp_anlaysis_chatbot": {
+        "name": "Competitor Analysis Chatbot",
+        "description": "AI Chatbot trained on competitor assessment documentation",
+        "image_name": "competitor_analysis_cb.png",
+        "fallback_emoji": "🎵",
+        "category": "Chatbot",
+        "sidebar_value": "Business Apps",
+        "parent_app": "Business Apps",
+        "sub_app": "Competitor Analysis Chatbot",
+        "usage_id": "business_competitor_analysis_chatbot",
+        "tags": ["Competitor Analysis", "Chatbot", "Comparison"],
+        "api_available": False,
+        "entry_point": "functions.business_apps.chatbots.competitor_analysis.cb:comp_analysis_cb",
+        "needs_client": False
+    },
+    "text_to_speech": {
+    "name": "Text To Speech",
+    "description": "Convert text to natural-sounding speech using advanced AI voice technology",
+    "image_name": "texttospeech.png",
+    "fallback_emoji": "🗣️",
+    "category": "Audio Processing",
+    "sidebar_value": "Text To Speech",
+    "parent_app": "Text To Speech",
+    "sub_app": None,
+    "usage_id": "text_to_speech",
+    "tags": ["Audio", "Speech", "Voice", "TTS", "Narration"],
+    "api_available": True,
+    "entry_point": "functions.tts.tts_app:text_to_speech",
+    "needs_client": True
+    }
+}
+
+# Seconds spent importing each app module on its first launch
+MODULE_LOAD_TIMES = {}
+
+# Functions called with (app_id, metadata) whenever an app is registered at runtime
+REGISTER_LISTENERS = []
+
+
+def on_register(listener):
+    """Call listener(app_id, metadata) every time register_app adds or replaces an app"""
+    REGISTER_LISTENERS.append(listener)
+
+
+def register_app(app_id, metadata):
+    """Add an app to the registry (or replace it) and update the indexes built from it"""
+    APP_METADATA[app_id] = metadata
+    for listener in REGISTER_LISTENERS:
+        try:
+            listener(app_id, metadata)
+        except Exception as e:
+            logger.error(f"Error updating registry listener for {app_id}: {str(e)}")
+
+
+def gallery_apps():
+    """Return the apps that are shown as cards in the gallery"""
+    return {
+        app_id: metadata for app_id, metadata in APP_METADATA.items()
+        if metadata.get("show_in_gallery", True)
+    }
+
+
+def sidebar_tools():
+    """Return the sidebar tool names in registry order"""
+    tools = []
+    for metadata in APP_METADATA.values():
+        if metadata["sidebar_value"] not in tools:
+            tools.append(metadata["sidebar_value"])
+    return tools
+
+
+def tool_apps(tool):
+    """Return the app ids that belong to a sidebar tool"""
+    return [app_id for app_id, metadata in APP_METADATA.items() if metadata["sidebar_value"] == tool]
+
+
+def is_standalone_tool(tool):
+    """A standalone tool has a single app and no sub-app menu"""
+    app_ids = tool_apps(tool)
+    return len(app_ids) == 1 and not APP_METADATA[app_ids[0]]["sub_app"]
+
+
+def find_sub_app(tool, sub_app):
+    """Return the app id of a tool's sub-app, or None"""
+    for app_id in tool_apps(tool):
+        if APP_METADATA[app_id]["sub_app"] == sub_app:
+            return app_id
+    return None
+
+
+def usage_id(app_id):
+    """The id a sidebar launch of an app is logged under in ai_portal_usage"""
+    return APP_METADATA[app_id].get("usage_id", app_id)
+
+
+def load_entry_point(app_id):
+    """Import an app's module (first launch only) and return its entry point function"""
+    entry_point = APP_METADATA[app_id].get("entry_point")
+    if not entry_point:
+        return None
+
+    module_name, function_name = entry_point.split(":")
+    if module_name not in MODULE_LOAD_TIMES:
+        start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        MODULE_LOAD_TIMES[module_name] = time.perf_counter() - start
+        logger.info(f"Loaded {module_name} in {MODULE_LOAD_TIMES[module_name]:.2f}s")
+    else:
+        module = importlib.import_module(module_name)
+
+    return getattr(module, function_name)
@@ -0,0 +1,205 @@
+import re
+import threading
+from collections import defaultdict
+
+import app_registry
+from app_registry import APP_METADATA
+
+# How much a query term counts for, depending on the field it was found in
+FIELD_WEIGHTS = {
+    "name": 5.0,
+    "sub_app": 4.0,
+    "tags": 3.0,
+    "parent_app": 2.0,
+    "category": 2.0,
+    "description": 1.0,
+}
+
+# Partial matches score less than exact ones
+PREFIX_FACTOR = 0.8
+INFIX_FACTOR = 0.5
+FUZZY_FACTOR = 0.6
+
+# Substrings shorter than this only match at the start of a word ("c" -> "chatgpt", not "doc")
+MIN_INFIX_LENGTH = 3
+
+# Words shorter than this are not typo-corrected ("ocr" should not match "ppt")
+MIN_FUZZY_LENGTH = 4
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Split text into lowercase alphanumeric words"""
+    return TOKEN_PATTERN.findall((text or "").lower())
+
+
+def _deletes(term):
+    """The term itself and every variant with one character removed"""
+    return {term} | {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def _within_one_edit(a, b):
+    """True if a and b differ by at most one insertion, deletion, substitution or adjacent swap"""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+
+    # Skip the common prefix and suffix, then whatever is left must be a single edit
+    start = 0
+    while start < min(len(a), len(b)) and a[start] == b[start]:
+        start += 1
+    end_a, end_b = len(a), len(b)
+    while end_a > start and end_b > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+
+    middle_a, middle_b = a[start:end_a], b[start:end_b]
+    if len(middle_a) <= 1 and len(middle_b) <= 1:
+        return True
+    return len(middle_a) == 2 and middle_a == middle_b[::-1]
+
+
+class SearchIndex:
+    """
+    Inverted index over app metadata with weighted fields, prefix/substring and typo-tolerant matching.
+
+    Every lookup is a handful of dictionary reads keyed by the query words, so the cost does
+    not grow with the number of registered apps (only with the number of apps that match).
+    """
+
+    def __init__(self):
+        # term -> {app_id: weighted score}
+        self.postings = defaultdict(dict)
+        # word fragment -> terms that start with it (or contain it, for fragments of MIN_INFIX_LENGTH+)
+        self.fragments = defaultdict(set)
+        # term with one character deleted -> terms, for one-edit typo matching
+        self.deletes = defaultdict(set)
+        # app_id -> terms indexed for it, so an app can be re-indexed
+        self.app_terms = {}
+        # app_id -> registration order, used to break ties
+        self.order = {}
+        self._lock = threading.Lock()
+
+    def add(self, app_id, metadata):
+        """Index an app, replacing any earlier entry for the same id"""
+        with self._lock:
+            self._remove(app_id)
+
+            scores = defaultdict(float)
+            for field, weight in FIELD_WEIGHTS.items():
+                value = metadata.get(field)
+                text = " ".join(value) if isinstance(value, list) else value
+                for term in set(tokenize(text)):
+                    scores[term] += weight
+
+            for term, score in scores.items():
+                if not self.postings.get(term):
+                    self._add_term(term)
+                self.postings[term][app_id] = score
+
+            self.app_terms[app_id] = set(scores)
+            self.order.setdefault(app_id, len(self.order))
+
+    def remove(self, app_id):
+        """Drop an app from the index"""
+        with self._lock:
+            self._remove(app_id)
+            self.order.pop(app_id, None)
+
+    def _remove(self, app_id):
+        for term in self.app_terms.pop(app_id, ()):
+            self.postings[term].pop(app_id, None)
+            if not self.postings[term]:
+                del self.postings[term]
+                self._discard_term(term)
+
+    def _term_fragments(self, term):
+        fragments = {term[:end] for end in range(1, len(term) + 1)}
+        for start in range(1, len(term) - MIN_INFIX_LENGTH + 1):
+            for end in range(start + MIN_INFIX_LENGTH, len(term) + 1):
+                fragments.add(term[start:end])
+        return fragments
+
+    def _add_term(self, term):
+        for fragment in self._term_fragments(term):
+            self.fragments[fragment].add(term)
+        if len(term) >= MIN_FUZZY_LENGTH:
+            for variant in _deletes(term):
+                self.deletes[variant].add(term)
+
+    def _discard_term(self, term):
+        for fragment in self._term_fragments(term):
+            self.fragments[fragment].discard(term)
+            if not self.fragments[fragment]:
+                del self.fragments[fragment]
+        if len(term) >= MIN_FUZZY_LENGTH:
+            for variant in _deletes(term):
+                self.deletes[variant].discard(term)
+                if not self.deletes[variant]:
+                    del self.deletes[variant]
+
+    def _match_word(self, word):
+        """Return {app_id: score} for a single query word"""
+        matches = defaultdict(float)
+
+        def collect(terms, factor):
+            for term in terms:
+                for app_id, score in self.postings.get(term, {}).items():
+                    matches[app_id] = max(matches[app_id], score * factor)
+
+        collect([word], 1.0)
+        for term in self.fragments.get(word, ()):
+            if term != word:
+                collect([term], PREFIX_FACTOR if term.startswith(word) else INFIX_FACTOR)
+
+        if len(word) >= MIN_FUZZY_LENGTH:
+            candidates = set()
+            for variant in _deletes(word):
+                candidates |= self.deletes.get(variant, set())
+            collect([term for term in candidates if term != word and _within_one_edit(word, term)], FUZZY_FACTOR)
+
+        return matches
+
+    def search(self, query, limit=None):
+        """
+        Return app ids that match every word of the query, best match first.
+
+        Each word can match exactly, as the start or part of an indexed word, or with one typo.
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+
+        with self._lock:
+            totals = None
+            for word in words:
+                matches = self._match_word(word)
+                if totals is None:
+                    totals = dict(matches)
+                else:
+                    totals = {app_id: totals[app_id] + score for app_id, score in matches.items() if app_id in totals}
+                if not totals:
+                    return []
+
+            ranked = sorted(totals, key=lambda app_id: (-totals[app_id], self.order.get(app_id, 0)))
+        return ranked[:limit] if limit else ranked
+
+
+def build_index(metadata=None):
+    """Build a search index from the app registry"""
+    index = SearchIndex()
+    for app_id, app_metadata in (APP_METADATA if metadata is None else metadata).items():
+        index.add(app_id, app_metadata)
+    return index
+
+
+# Built once per process and kept up to date as apps are registered
+index = build_index()
+app_registry.on_register(index.add)
+
+
+def search(query, limit=None):
+    """Search the registered apps, best match first"""
+    return index.search(query, limit)
@@ -0,0 +1,294 @@
+"""
+End-to-end benchmark of the portal apps against the local mock Azure OpenAI server.
+
+Run from the repository root, in an environment with requirements.txt installed:
+
+    python benchmarks/app_benchmark.py
+    python benchmarks/app_benchmark.py --apps chatgpt_general doc_summary --iterations 10
+    python benchmarks/app_benchmark.py --latency-ms 600 --tokens-per-second 40 --throttle-rate 0.05 --json results.json
+
+Every iteration opens the portal in a fresh headless session (Streamlit's AppTest), selects the
+app from the sidebar state the way a user would, and drives it through one request: a chat
+message, an uploaded document, a form submission. Apps that hand their work to a background
+job are polled until the job's result is shown. The time from the first interaction to the
+finished page is the request latency; the mock's counters give the model calls (429s and
+retries included) and estimated tokens each request cost.
+
+The LLM response cache is off unless --cache is given, so repeated iterations make the same
+calls. The OCR apps call a separate OCR service and the chatbots and text-to-speech need their
+own credentials and speech service, so they are not covered.
+"""
+import io
+import os
+import sys
+import json
+import time
+import wave
+import logging
+import argparse
+import tempfile
+import statistics
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(REPO_ROOT)
+
+from mock_azure_openai import MockAzureOpenAI, MockSettings  # noqa: E402
+
+DOCUMENT_PARAGRAPH = (
+    "Quarterly claims volumes rose by eight percent while the average settlement time fell to "
+    "six days. The policy number is PX-20431 and the policy holder is Jane Mokoena. Digital "
+    "channels handled most new quotes, and the compliance review found no material issues."
+)
+
+USER_STORY = "As a policy holder, I want to upload claim documents from my phone, so that my claim is processed faster"
+
+# The portal database (as read by config.py); blanked so benchmark calls and logins never reach it
+DATABASE_VARIABLES = ("SQL_SERVER", "SQL_DATABASE", "SQL_USERNAME", "SQL_PASSWORD")
+
+
+def sample_pdf(pages=3):
+    """A small text PDF to upload"""
+    import fitz
+    doc = fitz.open()
+    for page_number in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), f"Page {page_number + 1}\n\n" + "\n\n".join([DOCUMENT_PARAGRAPH] * 6))
+    return doc.tobytes()
+
+
+def sample_wav(seconds=5):
+    """Silent 16 kHz mono audio to upload"""
+    output = io.BytesIO()
+    with wave.open(output, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        wav.writeframes(b"\x00\x00" * 16000 * seconds)
+    return output.getvalue()
+
+
+def by_label(widgets, label):
+    for widget in widgets:
+        if widget.label.startswith(label):
+            return widget
+    raise LookupError(f"No widget labelled {label!r}")
+
+
+def wait_until(app_test, done, timeout):
+    """Rerun the page (as a polling fragment would) until done(app_test) or the timeout"""
+    deadline = time.time() + timeout
+    while not done(app_test):
+        if time.time() > deadline:
+            raise TimeoutError("The app did not finish in time")
+        time.sleep(0.2)
+        app_test.run()
+
+
+def drive_chatgpt(app_test, timeout):
+    app_test.chat_input[0].set_value("Summarise the quarterly claims results in three bullet points").run()
+
+
+def drive_smart_goal(app_test, timeout):
+    by_label(app_test.text_input, "Department").set_value("Claims")
+    by_label(app_test.text_input, "What is your goal?").set_value("Reduce claim settlement time")
+    by_label(app_test.text_input, "When do you want").set_value("within 6 months")
+    by_label(app_test.button, "Generate SMART Goal").click().run()
+
+
+def drive_doc_extraction(app_test, timeout):
+    app_test.file_uploader[0].set_value(("claim.pdf", sample_pdf(), "application/pdf"))
+    app_test.text_input(key="field_0").set_value("Policy number").run()
+
+
+def drive_doc_summary(app_test, timeout):
+    app_test.file_uploader[0].set_value(("report.pdf", sample_pdf(), "application/pdf")).run()
+    by_label(app_test.button, "Summarize").click().run()
+    wait_until(app_test, lambda at: "current_summary" in at.session_state and not at.session_state["summary_job"]
+               if "summary_job" in at.session_state else "current_summary" in at.session_state, timeout)
+
+
+def drive_ppt(app_test, timeout):
+    by_label(app_test.button, "Create from Text Prompt").click().run()
+    by_label(app_test.text_area, "Presentation Prompt").set_value(
+        "A five slide update on how digital channels changed claims handling this quarter"
+    ).run()
+    by_label(app_test.button, "Generate Presentation").click().run()
+    wait_until(app_test, lambda at: at.session_state["current_step"] == "create_presentation", timeout)
+
+
+def drive_transcription(app_test, timeout):
+    app_test.file_uploader[0].set_value(("call.wav", sample_wav(), "audio/wav")).run()
+    by_label(app_test.button, "Transcribe").click().run()
+    wait_until(app_test, lambda at: at.session_state["raw_transcript"] is not None, timeout)
+
+
+def drive_image_gen(app_test, timeout):
+    by_label(app_test.text_area, "Enter your prompt").set_value("A modern insurance office at sunrise")
+    by_label(app_test.button, "Generate Image").click().run()
+
+
+def drive_test_cases(app_test, timeout):
+    by_label(app_test.text_area, "Enter User Story").set_value(USER_STORY)
+    by_label(app_test.button, "Generate Test Scenarios").click().run()
+    wait_until(app_test, lambda at: "scenarios" in at.session_state, timeout)
+
+
+# app_id -> function driving one request once the app is open
+SCENARIOS = {
+    "chatgpt_general": drive_chatgpt,
+    "chatgpt_smart_goal": drive_smart_goal,
+    "doc_extraction": drive_doc_extraction,
+    "doc_summary": drive_doc_summary,
+    "ppt_creator": drive_ppt,
+    "audio_transcription": drive_transcription,
+    "image_gen": drive_image_gen,
+    "test_case_generator": drive_test_cases,
+}
+
+
+def open_app(app_id, timeout):
+    """A fresh signed-in session with an app selected and rendered"""
+    from streamlit.testing.v1 import AppTest
+    from app_registry import APP_METADATA
+
+    metadata = APP_METADATA[app_id]
+    app_test = AppTest.from_file(os.path.join(REPO_ROOT, "app.py"), default_timeout=timeout)
+    app_test.session_state["authenticated"] = True
+    app_test.session_state["display_name"] = "Benchmark"
+    app_test.session_state["user_email"] = "benchmark@example.com"
+    app_test.session_state["selected_tool"] = metadata["sidebar_value"]
+    app_test.session_state["selected_sub_app"] = metadata["sub_app"] or "None"
+    app_test.run()
+    problems = [element.message for element in app_test.exception] + [element.value for element in app_test.error]
+    if problems:
+        raise RuntimeError(f"{app_id} failed to open: {problems[0]}")
+    return app_test
+
+
+def usage_delta(before, after):
+    """Calls, 429s and tokens between two snapshots of the mock's counters"""
+    totals = {"calls": 0, "throttled": 0, "prompt_tokens": 0, "completion_tokens": 0, "by_endpoint": {}}
+    for key, counters in after.items():
+        previous = before.get(key, {})
+        delta = {name: value - previous.get(name, 0) for name, value in counters.items()}
+        if not any(delta.values()):
+            continue
+        totals["by_endpoint"][key] = delta.get("requests", 0)
+        totals["calls"] += delta.get("requests", 0)
+        totals["throttled"] += delta.get("throttled", 0)
+        totals["prompt_tokens"] += delta.get("prompt_tokens", 0)
+        totals["completion_tokens"] += delta.get("completion_tokens", 0)
+    return totals
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def benchmark_app(server, app_id, iterations, timeout):
+    latencies, usages, errors = [], [], []
+    for _ in range(iterations):
+        try:
+            app_test = open_app(app_id, timeout)
+            before = server.stats()
+            start = time.perf_counter()
+            SCENARIOS[app_id](app_test, timeout)
+            elapsed = time.perf_counter() - start
+            if app_test.exception:
+                raise RuntimeError(app_test.exception[0].message)
+            errors_shown = [element.value for element in app_test.error]
+            if errors_shown:
+                raise RuntimeError(errors_shown[0])
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+            continue
+        latencies.append(elapsed)
+        usages.append(usage_delta(before, server.stats()))
+
+    if not latencies:
+        return {"runs": 0, "errors": errors}
+    return {
+        "runs": len(latencies),
+        "errors": errors,
+        "p50_s": statistics.median(latencies),
+        "p95_s": percentile(latencies, 0.95),
+        "calls_per_request": statistics.mean(usage["calls"] for usage in usages),
+        "throttled_per_request": statistics.mean(usage["throttled"] for usage in usages),
+        "prompt_tokens_per_request": statistics.mean(usage["prompt_tokens"] for usage in usages),
+        "completion_tokens_per_request": statistics.mean(usage["completion_tokens"] for usage in usages),
+        "calls_by_endpoint": usages[-1]["by_endpoint"],
+    }
+
+
+def configure_environment(server, cache, scratch):
+    """Point config.py at the mock and keep the benchmark's files out of the working tree"""
+    os.environ.update(server.environment())
+    os.environ["LLM_CACHE_ENABLED"] = "true" if cache else "false"
+    os.environ["LLM_CACHE_DIR"] = os.path.join(scratch, "llm_cache")
+    os.environ["JOBS_DB_PATH"] = os.path.join(scratch, "jobs.db")
+    os.environ["SESSION_BLOB_DIR"] = os.path.join(scratch, "session_blobs")
+    os.environ["SESSION_STORE_BACKEND"] = ""
+    for name in DATABASE_VARIABLES:
+        os.environ[name] = ""
+
+    # Some apps use an API version older than JSON-schema output, so they ask for JSON mode and
+    # describe the structure in the prompt. The mock cannot read prompts, so it is always given
+    # the schema; the calls made are otherwise the same.
+    import llm_structured
+    llm_structured.supports_json_schema = lambda client: True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apps", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--iterations", type=int, default=5, help="Requests per app")
+    parser.add_argument("--timeout", type=float, default=180, help="Seconds one request may take")
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--tokens-per-second", type=float, default=80)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of model calls answered with a 429")
+    parser.add_argument("--tpm-limit", type=int, default=0, help="Tokens per minute per deployment before 429s")
+    parser.add_argument("--cache", action="store_true", help="Leave the LLM response cache on")
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show the apps' log output")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    settings = MockSettings(
+        latency_ms=args.latency_ms,
+        tokens_per_second=args.tokens_per_second,
+        throttle_rate=args.throttle_rate,
+        tpm_limit=args.tpm_limit,
+    )
+    server = MockAzureOpenAI(settings=settings).start()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="portal-benchmark-") as scratch:
+        configure_environment(server, args.cache, scratch)
+        for app_id in args.apps:
+            print(f"Benchmarking {app_id}...", flush=True)
+            results[app_id] = benchmark_app(server, app_id, args.iterations, args.timeout)
+
+    print()
+    print(f"{'app':<22} {'runs':>4} {'p50 s':>7} {'p95 s':>7} {'calls':>6} {'429s':>5} {'prompt tok':>10} {'compl tok':>10}")
+    for app_id, result in results.items():
+        if not result["runs"]:
+            print(f"{app_id:<22} {0:>4}  failed: {result['errors'][0] if result['errors'] else 'no runs'}")
+            continue
+        print(f"{app_id:<22} {result['runs']:>4} {result['p50_s']:>7.2f} {result['p95_s']:>7.2f} "
+              f"{result['calls_per_request']:>6.1f} {result['throttled_per_request']:>5.1f} "
+              f"{result['prompt_tokens_per_request']:>10.0f} {result['completion_tokens_per_request']:>10.0f}")
+        for error in result["errors"][:3]:
+            print(f"{'':<22} error: {error}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Replay recorded model calls offline and check the apps for performance regressions.
+
+Episodes are recorded in production with LLM_FIXTURES_MODE=record (see llm_fixtures.py): each
+run of summarize_text, extract_data, cleanup_long_transcription, get_content_sections and the
+chatbots' answer_question is saved with its scrubbed arguments, requests, responses and
+timing. Copy the episodes worth keeping into benchmarks/fixtures/<label>/ and run, from the
+repository root:
+
+    python benchmarks/fixture_replay.py                    # replay every episode and report
+    python benchmarks/fixture_replay.py --update-baseline  # accept the current numbers
+    python benchmarks/fixture_replay.py --check            # exit 1 on a regression (CI)
+    python benchmarks/fixture_replay.py --speed 0          # no recorded delays: the code's own overhead
+
+Each episode calls its function again with the recorded arguments and session state. Nothing
+goes over the network: every model request is answered with the recorded response, after the
+recorded time to first byte and with its chunks spaced as they arrived. Requests that changed
+(different chunking or prompts) get the closest recorded call of the same kind, unless --strict
+is given, so a change to chunking, concurrency or caching shows up as a change in wall time and
+call count.
+
+--check fails when a function's median wall time grows by more than --latency-tolerance, or its
+calls per episode by more than --calls-tolerance, over benchmarks/fixtures/baseline.json, when
+an episode no longer replays without errors, when a replayed label has no baseline, or when
+there are no episodes to replay.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import importlib
+import statistics
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.chdir(REPO_ROOT)
+
+DEFAULT_FIXTURES = os.path.join(REPO_ROOT, "benchmarks", "fixtures")
+
+# Credentials config.py needs to build clients; replayed clients never use them
+PLACEHOLDER_ENVIRONMENT = {
+    "AZURE_OPENAI_KEY": "fixture-replay",
+    "AZURE_OPENAI_ENDPOINT": "https://fixture-replay.invalid/",
+    "AZURE_OPENAI_EMBEDDING_ENDPOINT": "https://fixture-replay.invalid/",
+    "CDCB_AZURE_OPENAI_KEY": "fixture-replay",
+    "CDCB_AZURE_OPENAI_ENDPOINT": "https://fixture-replay.invalid/",
+    "CDCB_AZURE_OPENAI_EMBEDDING_ENDPOINT": "https://fixture-replay.invalid/",
+    "CACB_AZURE_OPENAI_KEY": "fixture-replay",
+    "CACB_AZURE_OPENAI_ENDPOINT": "https://fixture-replay.invalid/",
+    "CACB_AZURE_OPENAI_EMBEDDING_ENDPOINT": "https://fixture-replay.invalid/",
+}
+
+
+def configure_environment(args, scratch):
+    for name, value in PLACEHOLDER_ENVIRONMENT.items():
+        os.environ.setdefault(name, value)
+    os.environ["LLM_FIXTURES_MODE"] = "replay"
+    os.environ["LLM_FIXTURES_DIR"] = args.fixtures
+    os.environ["LLM_FIXTURES_SPEED"] = str(args.speed)
+    os.environ["LLM_FIXTURES_STRICT"] = "true" if args.strict else "false"
+    os.environ["LLM_CACHE_ENABLED"] = "true" if args.cache else "false"
+    os.environ["LLM_CACHE_DIR"] = os.path.join(scratch, "llm_cache")
+    os.environ["JOBS_DB_PATH"] = os.path.join(scratch, "jobs.db")
+    os.environ["SESSION_BLOB_DIR"] = os.path.join(scratch, "session_blobs")
+
+
+def resolve(entry):
+    """The function an episode was recorded from, e.g. "functions.document_intelligence.doc_summary:summarize_text" """
+    module_name, qualname = entry.split(":")
+    target = importlib.import_module(module_name)
+    for part in qualname.split("."):
+        target = getattr(target, part)
+    return target
+
+
+def rebuild_args(recorded):
+    """The recorded arguments with clients and Streamlit containers put back"""
+    import Functions
+
+    kwargs = {}
+    for name, value in recorded.items():
+        if isinstance(value, dict) and "__client__" in value:
+            value = Functions.get_client(value["__client__"])
+        elif isinstance(value, dict) and "__container__" in value:
+            import streamlit as st
+            value = st.container()
+        kwargs[name] = value
+    return kwargs
+
+
+def replay_episode(episode):
+    import llm_fixtures
+
+    result = {"file": episode["file"], "label": episode["label"], "error": None}
+    if episode.get("session_state"):
+        import streamlit as st
+        for key, value in episode["session_state"].items():
+            st.session_state[key] = value
+
+    with llm_fixtures.replaying(episode) as replay:
+        start = time.perf_counter()
+        try:
+            resolve(episode["entry"])(**rebuild_args(episode["args"]))
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["ms"] = (time.perf_counter() - start) * 1000
+    result.update(
+        recorded_ms=episode["duration_ms"],
+        calls=replay.stats["calls"],
+        recorded_calls=len(episode["calls"]),
+        fallback=replay.stats["fallback"],
+        misses=replay.stats["misses"],
+    )
+    return result
+
+
+def summarise(results):
+    """Per-label figures compared against the baseline"""
+    labels = {}
+    for result in results:
+        labels.setdefault(result["label"], []).append(result)
+
+    summary = {}
+    for label, runs in labels.items():
+        timings = sorted(run["ms"] for run in runs)
+        summary[label] = {
+            "episodes": len(runs),
+            "errors": sum(1 for run in runs if run["error"]),
+            "median_ms": statistics.median(timings),
+            "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+            "recorded_median_ms": statistics.median(run["recorded_ms"] for run in runs),
+            "calls_per_episode": statistics.mean(run["calls"] for run in runs),
+            "recorded_calls_per_episode": statistics.mean(run["recorded_calls"] for run in runs),
+            "fallback_calls": sum(run["fallback"] for run in runs),
+            "missed_calls": sum(run["misses"] for run in runs),
+        }
+    return summary
+
+
+def regressions(summary, baseline, latency_tolerance, calls_tolerance):
+    found = []
+    for label, current in summary.items():
+        if current["errors"]:
+            found.append(f"{label}: {current['errors']} episode(s) failed to replay")
+        expected = baseline.get(label)
+        if not expected:
+            # Without figures to compare against, nothing about this label would be checked
+            found.append(f"{label}: no baseline, run with --update-baseline --labels {label}")
+            continue
+        if current["median_ms"] > expected["median_ms"] * (1 + latency_tolerance):
+            found.append(f"{label}: median {current['median_ms']:.0f} ms, baseline {expected['median_ms']:.0f} ms")
+        if current["calls_per_episode"] > expected["calls_per_episode"] * (1 + calls_tolerance) + 1e-9:
+            found.append(
+                f"{label}: {current['calls_per_episode']:.1f} calls per episode, baseline {expected['calls_per_episode']:.1f}"
+            )
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES, help="Directory of recorded episodes, one sub-directory per label")
+    parser.add_argument("--labels", nargs="+", help="Only replay these labels")
+    parser.add_argument("--baseline", help="Baseline file (default: baseline.json in the fixtures directory)")
+    parser.add_argument("--check", action="store_true", help="Exit 1 if anything regressed against the baseline")
+    parser.add_argument("--update-baseline", action="store_true", help="Write the current figures as the new baseline")
+    parser.add_argument("--latency-tolerance", type=float, default=0.2, help="Allowed growth of the median wall time")
+    parser.add_argument("--calls-tolerance", type=float, default=0.0, help="Allowed growth of the calls per episode")
+    parser.add_argument("--speed", type=float, default=1.0, help="Multiplier of the recorded timing (0 for none)")
+    parser.add_argument("--strict", action="store_true", help="Only answer requests identical to recorded ones")
+    parser.add_argument("--cache", action="store_true", help="Leave the LLM response cache on")
+    parser.add_argument("--json", help="Also write the per-episode results to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show the apps' log output")
+    args = parser.parse_args()
+
+    args.fixtures = os.path.abspath(args.fixtures)
+    baseline_path = args.baseline or os.path.join(args.fixtures, "baseline.json")
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory(prefix="fixture-replay-") as scratch:
+        configure_environment(args, scratch)
+        import llm_fixtures
+
+        episodes = llm_fixtures.load_episodes(args.fixtures, args.labels)
+        if not episodes:
+            # An empty fixtures directory would otherwise pass every check
+            print(f"No recorded episodes under {args.fixtures}; nothing to replay.")
+            return 1 if args.check else 0
+
+        # One untimed pass without delays, so imports and first-use setup are not counted
+        import config
+        speed, config.LLM_FIXTURES_SPEED = config.LLM_FIXTURES_SPEED, 0
+        for episode in episodes:
+            replay_episode(episode)
+        config.LLM_FIXTURES_SPEED = speed
+
+        results = []
+        for episode in episodes:
+            result = replay_episode(episode)
+            results.append(result)
+            status = f"error: {result['error']}" if result["error"] else f"{result['ms']:.0f} ms"
+            print(f"{episode['file']:<60} {result['calls']:>3} calls  {status}", flush=True)
+
+    summary = summarise(results)
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+
+    print()
+    print(f"{'label':<30} {'runs':>4} {'median ms':>10} {'baseline':>9} {'recorded':>9} {'calls':>6} {'baseline':>9} {'fallback':>8} {'missed':>6}")
+    for label, current in summary.items():
+        expected = baseline.get(label, {})
+        print(f"{label:<30} {current['episodes']:>4} {current['median_ms']:>10.0f} "
+              f"{expected.get('median_ms', float('nan')):>9.0f} {current['recorded_median_ms']:>9.0f} "
+              f"{current['calls_per_episode']:>6.1f} {expected.get('calls_per_episode', float('nan')):>9.1f} "
+              f"{current['fallback_calls']:>8} {current['missed_calls']:>6}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"summary": summary, "episodes": results}, f, indent=2)
+
+    if args.update_baseline:
+        # Labels that were not replayed (--labels) keep their figures
+        baseline.update({
+            label: {name: current[name] for name in ("episodes", "median_ms", "p95_ms", "calls_per_episode")}
+            for label, current in summary.items()
+        })
+        with open(baseline_path, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\nBaseline written to {baseline_path}")
+
+    found = regressions(summary, baseline, args.latency_tolerance, args.calls_tolerance)
+    if found:
+        print("\nRegressions:")
+        for regression in found:
+            print(f"  {regression}")
+    return 1 if args.check and found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,651 @@
+"""
+Load test of the portal with many users at once, over Streamlit's own websocket protocol.
+
+Run from the repository root, in an environment with requirements.txt and websockets installed:
+
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --users 1 10 25 50 --duration 120
+    python benchmarks/load_test.py --journeys gallery_search chatgpt --latency-ms 600 --json load.json
+    LOAD_TEST_TOKEN=... python benchmarks/load_test.py --url http://portal-staging:8000 --server-pid 4242
+
+Unless --url is given, the portal is started with `streamlit run app.py` against the local mock
+Azure OpenAI server, with a one-off LOAD_TEST_TOKEN so that simulated users skip Microsoft
+sign-in. For each user count, that many simulated browser sessions connect to /_stcore/stream,
+each repeating scripted journeys with a think time between steps:
+
+  gallery_search  open the gallery and search it
+  chatgpt         launch ChatGPT and send chat messages
+  chatbot         launch a document chatbot, log in to it and ask questions
+  doc_summary     launch Document Summarization, upload a PDF, summarize it and ask about it
+
+A rerun's latency is the time from the browser's message (a click, a chat message, an upload)
+to the script run finishing, including runs the script chains with st.rerun() and, for long
+documents, the background job's progress polls. Each user count reports journeys and reruns
+per second, the rerun latency distribution and, when the server's process is local (or given
+with --server-pid), its CPU and resident memory, worker processes included.
+
+Users start over --ramp-seconds and are measured for --duration seconds after that. One load
+generator process drives a few hundred users; run several for more.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import secrets
+import tempfile
+import subprocess
+import statistics
+from collections import defaultdict
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(REPO_ROOT)
+
+from mock_azure_openai import MockAzureOpenAI, MockSettings  # noqa: E402
+from app_benchmark import DATABASE_VARIABLES, sample_pdf, usage_delta, percentile  # noqa: E402
+
+SEARCH_QUERIES = ["chat", "document", "summary", "ocr", "image", "presentation", "test cases"]
+
+CHAT_MESSAGES = [
+    "Summarise the quarterly claims results in three bullet points",
+    "Draft a short email to the claims team about the new settlement process",
+    "What are the main risks of moving policy servicing to digital channels?",
+]
+
+CHATBOT_QUESTIONS = [
+    "What documents are needed to decide a motor claim?",
+    "How do the competitors price comprehensive cover for young drivers?",
+    "When should a claim be escalated for fraud review?",
+]
+
+DOCUMENT_QUESTIONS = ["What is the policy number?", "What happened to the settlement time?"]
+
+# Chatbot app id -> the environment variables holding its login (as read by config.py)
+CHATBOT_LOGINS = {
+    "claims_decisioning_chatbot": ("CLAIMS_CHATBOT_USERNAME", "CLAIMS_CHATBOT_PASSWORD"),
+    "comp_anlaysis_chatbot": ("CACB_USERNAME", "CACB_PASSWORD"),
+}
+
+XSRF_COOKIE = "_streamlit_xsrf"
+
+
+class JourneyError(Exception):
+    """The page showed an error or an exception, or did not finish in time"""
+
+
+class BrowserSession:
+    """
+    One browser tab on the portal: a websocket to /_stcore/stream that sends the widget
+    changes a user makes as BackMsgs and reads the page back from the ForwardMsgs.
+
+    Widgets are found by their key or label in the last script run. Values typed into text
+    inputs and uploaded files are sent again on every later rerun, as the browser does.
+    """
+
+    def __init__(self, base_url, user, token, timeout, think_seconds, recorder):
+        self.base_url = base_url.rstrip("/")
+        self.query_string = f"load_test_token={token}&load_test_user={user}"
+        self.timeout = timeout
+        self.think_seconds = think_seconds
+        self.recorder = recorder
+        self.session_id = None
+        self.xsrf = None
+        self.widgets = {}
+        self.values = {}
+        self.problems = []
+        self.fragments = {}
+        self._ws = None
+        self._reader = None
+        self._run_done = None
+        self._file_urls = {}
+        self._next_request = 0
+
+    async def open(self):
+        """Connect and load the portal, signing in with the load test token"""
+        import requests
+        import websockets
+
+        # Like the browser, ask for the health check first: it sets the XSRF cookie uploads need
+        response = await asyncio.to_thread(requests.get, f"{self.base_url}/_stcore/health", timeout=self.timeout)
+        response.raise_for_status()
+        self.xsrf = response.cookies.get(XSRF_COOKIE)
+
+        ws_url = self.base_url.replace("http", "ws", 1) + "/_stcore/stream"
+        subprotocols = ["streamlit", self.xsrf] if self.xsrf else ["streamlit"]
+        headers = {"Cookie": f"{XSRF_COOKIE}={self.xsrf}"} if self.xsrf else {}
+        self._ws = await websockets.connect(ws_url, subprotocols=subprotocols, additional_headers=headers, max_size=None)
+        self._reader = asyncio.create_task(self._read())
+        await self.rerun("open")
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        if self._ws is not None:
+            await self._ws.close()
+
+    async def _read(self):
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        async for raw in self._ws:
+            msg = ForwardMsg()
+            msg.ParseFromString(raw)
+            kind = msg.WhichOneof("type")
+            if kind == "new_session":
+                self.session_id = msg.new_session.initialize.session_id
+                if not msg.new_session.fragment_ids_this_run:
+                    self.widgets = {}
+                    self.fragments = {}
+            elif kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                self._read_element(msg.delta.new_element)
+            elif kind == "script_finished":
+                # A run ended early by st.rerun() is followed by the run it asked for
+                if msg.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN and self._run_done is not None:
+                    self._run_done.set()
+            elif kind == "auto_rerun":
+                self.fragments[msg.auto_rerun.fragment_id] = msg.auto_rerun.interval
+            elif kind == "file_urls_response":
+                future = self._file_urls.pop(msg.file_urls_response.response_id, None)
+                if future is not None and not future.done():
+                    future.set_result(msg.file_urls_response)
+
+    def _read_element(self, element):
+        from streamlit.proto.Alert_pb2 import Alert
+
+        kind = element.WhichOneof("type")
+        if kind == "exception":
+            self.problems.append(f"{element.exception.type}: {element.exception.message}")
+        elif kind == "alert" and element.alert.format == Alert.ERROR:
+            self.problems.append(element.alert.body)
+        else:
+            widget = getattr(element, kind)
+            widget_id = getattr(widget, "id", "")
+            if widget_id.startswith("$$ID-"):
+                self.widgets[widget_id] = (kind, getattr(widget, "label", "") or getattr(widget, "placeholder", ""))
+
+    def find(self, kind, label=None, key=None):
+        """Id of a widget in the last run, by key or by the start of its label"""
+        for widget_id, (widget_kind, widget_label) in self.widgets.items():
+            if widget_kind != kind:
+                continue
+            if (key is not None and widget_id.endswith(f"-{key}")) or (label is not None and widget_label.startswith(label)):
+                return widget_id
+        raise JourneyError(f"No {kind} {key or label!r} on the page")
+
+    def has(self, kind, key_prefix):
+        return any(widget_kind == kind and f"-{key_prefix}" in widget_id for widget_id, (widget_kind, _) in self.widgets.items())
+
+    async def rerun(self, step, trigger=None, fragment_id=None):
+        """Send the widget states (plus a one-off trigger) and wait for the script run to finish"""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+
+        msg = BackMsg()
+        msg.rerun_script.query_string = self.query_string
+        msg.rerun_script.widget_states.SetInParent()
+        for state in self.values.values():
+            msg.rerun_script.widget_states.widgets.append(state)
+        if trigger is not None:
+            msg.rerun_script.widget_states.widgets.append(trigger)
+        if fragment_id:
+            msg.rerun_script.fragment_id = fragment_id
+            msg.rerun_script.is_auto_rerun = True
+
+        self.problems = []
+        self._run_done = asyncio.Event()
+        start = time.perf_counter()
+        await self._ws.send(msg.SerializeToString())
+        try:
+            await asyncio.wait_for(self._run_done.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            raise JourneyError(f"{step} did not finish within {self.timeout:.0f}s")
+        self.recorder.rerun(step, start, time.perf_counter() - start)
+
+        if not fragment_id:
+            # The browser forgets the values of widgets that are no longer on the page
+            self.values = {widget_id: state for widget_id, state in self.values.items() if widget_id in self.widgets}
+        if self.problems:
+            raise JourneyError(f"{step}: {self.problems[0]}")
+
+    async def think(self):
+        await asyncio.sleep(self.think_seconds * random.uniform(0.5, 1.5))
+
+    async def click(self, step, label=None, key=None):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        await self.rerun(step, WidgetState(id=self.find("button", label, key), trigger_value=True))
+
+    async def type_text(self, step, text, label=None, key=None, rerun=True):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        widget_id = self.find("text_input", label, key)
+        self.values[widget_id] = WidgetState(id=widget_id, string_value=text)
+        if rerun:
+            await self.rerun(step)
+
+    async def chat(self, step, text, placeholder):
+        from streamlit.proto.Common_pb2 import ChatInputValue
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        widget_id = self.find("chat_input", placeholder)
+        await self.rerun(step, WidgetState(id=widget_id, chat_input_value=ChatInputValue(data=text)))
+
+    async def upload(self, step, label, file_name, data, mime_type):
+        """Upload a file the way the browser does: ask for an upload URL, PUT the file, then rerun"""
+        import requests
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.Common_pb2 import FileUploaderState, UploadedFileInfo
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        widget_id = self.find("file_uploader", label)
+        start = time.perf_counter()
+
+        self._next_request += 1
+        request_id = str(self._next_request)
+        future = self._file_urls[request_id] = asyncio.get_running_loop().create_future()
+        msg = BackMsg()
+        msg.file_urls_request.request_id = request_id
+        msg.file_urls_request.session_id = self.session_id
+        msg.file_urls_request.file_names.append(file_name)
+        await self._ws.send(msg.SerializeToString())
+        response = await asyncio.wait_for(future, self.timeout)
+        if response.error_msg:
+            raise JourneyError(f"{step}: {response.error_msg}")
+        file_urls = response.file_urls[0]
+
+        headers = {"X-Xsrftoken": self.xsrf} if self.xsrf else {}
+        cookies = {XSRF_COOKIE: self.xsrf} if self.xsrf else {}
+        upload_url = self.base_url + "/" + file_urls.upload_url.lstrip("/")
+        put = await asyncio.to_thread(
+            requests.put, upload_url, files={"file": (file_name, data, mime_type)},
+            headers=headers, cookies=cookies, timeout=self.timeout,
+        )
+        if put.status_code >= 400:
+            raise JourneyError(f"{step}: upload failed with HTTP {put.status_code}")
+        self.recorder.rerun(f"{step} (transfer)", start, time.perf_counter() - start)
+
+        info = UploadedFileInfo(name=file_name, size=len(data), file_id=file_urls.file_id, file_urls=file_urls)
+        self.values[widget_id] = WidgetState(id=widget_id, file_uploader_state_value=FileUploaderState(uploaded_file_info=[info]))
+        await self.rerun(step)
+
+    async def poll_fragments(self, step, done):
+        """Rerun the page's auto-refreshing fragments (e.g. a job's progress) every poll until done()"""
+        deadline = time.time() + self.timeout
+        while not done():
+            if time.time() > deadline:
+                raise JourneyError(f"{step} did not finish within {self.timeout:.0f}s")
+            if not self.fragments:
+                raise JourneyError(f"{step}: nothing on the page refreshes itself")
+            fragment_id, interval = next(iter(self.fragments.items()))
+            await asyncio.sleep(interval)
+            await self.rerun(step, fragment_id=fragment_id)
+
+
+async def launch(session, app_id):
+    await session.click(f"launch {app_id}", key=f"btn_{app_id}")
+
+
+async def journey_gallery_search(session, user):
+    for query in random.sample(SEARCH_QUERIES, 2):
+        await session.think()
+        await session.type_text("gallery search", query, key="search_bar")
+    await session.think()
+    await session.type_text("gallery search", "", key="search_bar")
+
+
+async def journey_chatgpt(session, user, messages):
+    await session.think()
+    await launch(session, "chatgpt_general")
+    for message in random.sample(CHAT_MESSAGES, min(messages, len(CHAT_MESSAGES))):
+        await session.think()
+        await session.chat("chatgpt message", message, "How can I assist you today?")
+
+
+async def journey_chatbot(session, user, messages):
+    app_id = sorted(CHATBOT_LOGINS)[user % len(CHATBOT_LOGINS)]
+    username_variable, password_variable = CHATBOT_LOGINS[app_id]
+    await session.think()
+    await launch(session, app_id)
+    await session.think()
+    await session.type_text("chatbot login", os.environ.get(username_variable, ""), label="Username", rerun=False)
+    await session.type_text("chatbot login", os.environ.get(password_variable, ""), label="Password", rerun=False)
+    await session.click("chatbot login", label="Login")
+    for question in random.sample(CHATBOT_QUESTIONS, min(messages, len(CHATBOT_QUESTIONS))):
+        await session.think()
+        await session.chat("chatbot question", question, "Ask me something...")
+
+
+async def journey_doc_summary(session, user, document):
+    await session.think()
+    await launch(session, "doc_summary")
+    await session.think()
+    await session.upload("document upload", "Choose a file", "report.pdf", document, "application/pdf")
+    await session.think()
+    await session.click("summarize", label="Summarize")
+    # Long documents are summarized by a background job whose progress the page polls
+    await session.poll_fragments("summary job poll", lambda: not session.has("button", "cancel_job_"))
+    await session.think()
+    await session.chat("document question", random.choice(DOCUMENT_QUESTIONS), "Ask a question about your document")
+
+
+class Recorder:
+    """Rerun and journey timings of one user count, kept only inside the measurement window"""
+
+    def __init__(self):
+        self.window = (float("inf"), float("inf"))
+        self.reruns = defaultdict(list)
+        self.journeys = defaultdict(list)
+        self.failures = defaultdict(int)
+
+    def in_window(self, start, end):
+        return self.window[0] <= start and end <= self.window[1]
+
+    def rerun(self, step, start, seconds):
+        if self.in_window(start, start + seconds):
+            self.reruns[step].append(seconds)
+
+    def journey(self, name, start, seconds, error=None):
+        # Journeys count towards the user count whose window they finish in
+        end = start + seconds
+        if not self.in_window(end, end):
+            return
+        if error is None:
+            self.journeys[name].append(seconds)
+        else:
+            self.failures[f"{name}: {error}"[:200]] += 1
+
+
+def run_journey(name, session, user, args, document):
+    if name == "gallery_search":
+        return journey_gallery_search(session, user)
+    if name == "chatgpt":
+        return journey_chatgpt(session, user, args.messages)
+    if name == "chatbot":
+        return journey_chatbot(session, user, args.messages)
+    return journey_doc_summary(session, user, document)
+
+
+async def simulate_user(user, args, base_url, token, recorder, deadline, document):
+    """Repeat the journeys in a fresh tab each time, starting at a different one per user"""
+    journeys = args.journeys[user % len(args.journeys):] + args.journeys[:user % len(args.journeys)]
+    index = 0
+    while time.perf_counter() < deadline:
+        name = journeys[index % len(journeys)]
+        index += 1
+        session = BrowserSession(base_url, user, token, args.timeout, args.think_seconds, recorder)
+        start = time.perf_counter()
+        try:
+            await session.open()
+            await run_journey(name, session, user, args, document)
+        except Exception as e:
+            recorder.journey(name, start, time.perf_counter() - start, error=f"{type(e).__name__}: {e}")
+            await asyncio.sleep(args.think_seconds)
+        else:
+            recorder.journey(name, start, time.perf_counter() - start)
+        finally:
+            try:
+                await session.close()
+            except Exception:
+                pass
+
+
+class ResourceSampler:
+    """CPU and resident memory of a process and its children (e.g. the CPU pool's workers), from /proc"""
+
+    def __init__(self, pid, interval=1.0):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._ticks_per_second = os.sysconf("SC_CLK_TCK")
+        self._page_size = os.sysconf("SC_PAGE_SIZE")
+
+    def _process_tree(self):
+        parents = {}
+        for name in os.listdir("/proc"):
+            if name.isdigit():
+                try:
+                    with open(f"/proc/{name}/stat") as f:
+                        parents[int(name)] = int(f.read().rsplit(")", 1)[1].split()[1])
+                except (OSError, IndexError, ValueError):
+                    continue
+        tree, frontier = {self.pid}, [self.pid]
+        while frontier:
+            parent = frontier.pop()
+            children = [pid for pid, ppid in parents.items() if ppid == parent and pid not in tree]
+            tree.update(children)
+            frontier.extend(children)
+        return tree
+
+    def _usage(self):
+        cpu_seconds, rss_bytes = 0.0, 0
+        for pid in self._process_tree():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                with open(f"/proc/{pid}/statm") as f:
+                    resident_pages = int(f.read().split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            # utime and stime, fields 14 and 15 of /proc/<pid>/stat (counted after the command name)
+            cpu_seconds += (int(fields[11]) + int(fields[12])) / self._ticks_per_second
+            rss_bytes += resident_pages * self._page_size
+        return cpu_seconds, rss_bytes
+
+    async def run(self):
+        previous_time = time.perf_counter()
+        previous_cpu, _ = self._usage()
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            cpu, rss = await asyncio.to_thread(self._usage)
+            self.samples.append({"time": now, "cpu_percent": 100 * (cpu - previous_cpu) / (now - previous_time), "rss_mb": rss / 1e6})
+            previous_time, previous_cpu = now, cpu
+
+    def summary(self, window):
+        samples = [sample for sample in self.samples if window[0] <= sample["time"] <= window[1]]
+        if not samples:
+            return {}
+        return {
+            "cpu_avg_percent": statistics.mean(sample["cpu_percent"] for sample in samples),
+            "cpu_peak_percent": max(sample["cpu_percent"] for sample in samples),
+            "rss_peak_mb": max(sample["rss_mb"] for sample in samples),
+            "rss_end_mb": samples[-1]["rss_mb"],
+        }
+
+
+def distribution(values):
+    if not values:
+        return {}
+    return {
+        "count": len(values),
+        "p50_s": statistics.median(values),
+        "p95_s": percentile(values, 0.95),
+        "p99_s": percentile(values, 0.99),
+        "max_s": max(values),
+    }
+
+
+async def run_level(users, args, base_url, token, server_pid, mock, document):
+    recorder = Recorder()
+    sampler = ResourceSampler(server_pid) if server_pid else None
+    sampler_task = asyncio.create_task(sampler.run()) if sampler else None
+    before = mock.stats() if mock else None
+
+    start = time.perf_counter()
+    recorder.window = (start + args.ramp_seconds, start + args.ramp_seconds + args.duration)
+    deadline = recorder.window[1]
+
+    async def start_user(user):
+        await asyncio.sleep(args.ramp_seconds * user / users)
+        await simulate_user(user, args, base_url, token, recorder, deadline, document)
+
+    tasks = [asyncio.create_task(start_user(user)) for user in range(users)]
+    # Journeys still running at the end are not counted; give them a moment to close their tabs
+    await asyncio.wait(tasks, timeout=args.ramp_seconds + args.duration + args.timeout)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if sampler_task:
+        sampler_task.cancel()
+
+    all_reruns = [seconds for step_seconds in recorder.reruns.values() for seconds in step_seconds]
+    completed = sum(len(seconds) for seconds in recorder.journeys.values())
+    result = {
+        "users": users,
+        "journeys": completed,
+        "journeys_per_second": completed / args.duration,
+        "failed_journeys": sum(recorder.failures.values()),
+        "failures": dict(sorted(recorder.failures.items(), key=lambda item: -item[1])[:10]),
+        "reruns": len(all_reruns),
+        "reruns_per_second": len(all_reruns) / args.duration,
+        "rerun_latency": distribution(all_reruns),
+        "rerun_latency_by_step": {step: distribution(seconds) for step, seconds in sorted(recorder.reruns.items())},
+        "journey_latency": {name: distribution(seconds) for name, seconds in sorted(recorder.journeys.items())},
+        "server": sampler.summary(recorder.window) if sampler else {},
+    }
+    if mock:
+        usage = usage_delta(before, mock.stats())
+        result["model_calls"] = usage["calls"]
+        result["throttled"] = usage["throttled"]
+    return result
+
+
+def launch_portal(port, env, log_path, timeout=90):
+    """Start `streamlit run app.py` and wait until it answers its health check"""
+    import requests
+
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", "app.py", "--server.port", str(port),
+             "--server.headless", "true", "--browser.gatherUsageStats", "false"],
+            env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The portal exited with code {process.returncode}, see {log_path}")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/_stcore/health", timeout=2).ok:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"The portal did not start within {timeout}s, see {log_path}")
+
+
+def portal_environment(mock, token, cache, scratch):
+    """The portal's environment: the mock's endpoints, the load test token, scratch storage and no database"""
+    env = dict(os.environ)
+    env.update(mock.environment())
+    env["LOAD_TEST_TOKEN"] = token
+    env["LLM_CACHE_ENABLED"] = "true" if cache else "false"
+    env["LLM_CACHE_DIR"] = os.path.join(scratch, "llm_cache")
+    env["JOBS_DB_PATH"] = os.path.join(scratch, "jobs.db")
+    env["SESSION_BLOB_DIR"] = os.path.join(scratch, "session_blobs")
+    env["SESSION_STORE_BACKEND"] = ""
+    for name in DATABASE_VARIABLES:
+        env[name] = ""
+    chatbot_password = secrets.token_urlsafe(12)
+    for username_variable, password_variable in CHATBOT_LOGINS.values():
+        env[username_variable] = "loadtest"
+        env[password_variable] = chatbot_password
+    return env
+
+
+def print_results(results):
+    print()
+    print(f"{'users':>5} {'journeys/s':>10} {'reruns/s':>8} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'max s':>7} "
+          f"{'failed':>6} {'cpu %':>6} {'peak %':>6} {'rss MB':>7} {'calls':>6} {'429s':>5}")
+    for result in results:
+        latency, server = result["rerun_latency"], result["server"]
+        print(f"{result['users']:>5} {result['journeys_per_second']:>10.2f} {result['reruns_per_second']:>8.2f} "
+              f"{latency.get('p50_s', 0):>7.2f} {latency.get('p95_s', 0):>7.2f} {latency.get('p99_s', 0):>7.2f} "
+              f"{latency.get('max_s', 0):>7.2f} {result['failed_journeys']:>6} "
+              f"{server.get('cpu_avg_percent', 0):>6.0f} {server.get('cpu_peak_percent', 0):>6.0f} "
+              f"{server.get('rss_peak_mb', 0):>7.0f} {result.get('model_calls', 0):>6} {result.get('throttled', 0):>5}")
+
+    print()
+    print(f"{'users':>5} {'step':<34} {'reruns':>6} {'p50 s':>7} {'p95 s':>7}")
+    for result in results:
+        for step, latency in result["rerun_latency_by_step"].items():
+            print(f"{result['users']:>5} {step:<34} {latency['count']:>6} {latency['p50_s']:>7.2f} {latency['p95_s']:>7.2f}")
+        for failure, count in list(result["failures"].items())[:3]:
+            print(f"{result['users']:>5} failed x{count}: {failure}")
+
+
+async def run_levels(args, base_url, token, server_pid, mock):
+    document = sample_pdf(args.pages)
+    results = []
+    for users in args.users:
+        print(f"Running {users} users for {args.duration:.0f}s (after a {args.ramp_seconds:.0f}s ramp)...", flush=True)
+        results.append(await run_level(users, args, base_url, token, server_pid, mock, document))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 5, 10, 20], help="Concurrent users, one run per count")
+    parser.add_argument("--journeys", nargs="+", choices=["gallery_search", "chatgpt", "chatbot", "doc_summary"],
+                        default=["gallery_search", "chatgpt", "chatbot", "doc_summary"])
+    parser.add_argument("--duration", type=float, default=60, help="Seconds measured per user count")
+    parser.add_argument("--ramp-seconds", type=float, default=10, help="Seconds over which the users start")
+    parser.add_argument("--think-seconds", type=float, default=2, help="Average pause between a user's actions")
+    parser.add_argument("--messages", type=int, default=2, help="Chat messages per chat journey")
+    parser.add_argument("--pages", type=int, default=3, help="Pages of the uploaded PDF")
+    parser.add_argument("--timeout", type=float, default=180, help="Seconds one rerun may take")
+    parser.add_argument("--url", help="Load an already running portal (with LOAD_TEST_TOKEN set) instead of starting one")
+    parser.add_argument("--token", default=os.environ.get("LOAD_TEST_TOKEN"), help="The --url portal's LOAD_TEST_TOKEN")
+    parser.add_argument("--server-pid", type=int, help="Process to sample CPU and memory of, for a --url portal on this host")
+    parser.add_argument("--port", type=int, default=8650, help="Port of the portal started by the load test")
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--tokens-per-second", type=float, default=80)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of model calls answered with a 429")
+    parser.add_argument("--tpm-limit", type=int, default=0, help="Tokens per minute per deployment before 429s")
+    parser.add_argument("--cache", action="store_true", help="Leave the LLM response cache on")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    try:
+        import websockets  # noqa: F401
+    except ImportError:
+        parser.error("the load test needs the websockets package: pip install websockets")
+
+    if args.url:
+        if not args.token:
+            parser.error("--url needs the portal's LOAD_TEST_TOKEN, with --token or the environment")
+        results = asyncio.run(run_levels(args, args.url, args.token, args.server_pid, None))
+    else:
+        settings = MockSettings(
+            latency_ms=args.latency_ms,
+            tokens_per_second=args.tokens_per_second,
+            throttle_rate=args.throttle_rate,
+            tpm_limit=args.tpm_limit,
+            # The chatbots' stored FAISS indexes hold text-embedding-3-large vectors
+            embedding_dimensions=3072,
+        )
+        mock = MockAzureOpenAI(settings=settings).start()
+        token = secrets.token_urlsafe(24)
+        with tempfile.TemporaryDirectory(prefix="portal-load-test-") as scratch:
+            log_path = os.path.join(scratch, "portal.log")
+            env = portal_environment(mock, token, args.cache, scratch)
+            # The simulated users log in to the chatbots with the credentials the portal was given
+            os.environ.update({name: env[name] for names in CHATBOT_LOGINS.values() for name in names})
+            portal = launch_portal(args.port, env, log_path)
+            try:
+                results = asyncio.run(run_levels(args, f"http://127.0.0.1:{args.port}", token, portal.pid, mock))
+            finally:
+                portal.terminate()
+                portal.wait(timeout=30)
+
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,516 @@
+"""
+Local stand-in for the Azure OpenAI and Azure Speech endpoints the portal calls, for
+performance testing without spending Azure quota.
+
+Run from the repository root:
+
+    python benchmarks/mock_azure_openai.py --port 8900
+    python benchmarks/mock_azure_openai.py --latency-ms 400 --tokens-per-second 40 --throttle-rate 0.05
+    python benchmarks/mock_azure_openai.py --deployment gpt4o:latency_ms=900,tpm_limit=30000
+
+then point the portal at it:
+
+    AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8900 AZURE_OPENAI_KEY=mock \\
+    AZURE_STT_ENDPOINT=http://127.0.0.1:8900/speechtotext/transcriptions:transcribe AZURE_STT_KEY=mock \\
+    streamlit run app.py
+
+Served:
+  POST /openai/deployments/<d>/chat/completions      streamed (SSE) and not; JSON mode and JSON-schema
+                                                     replies are generated from the schema
+  POST /openai/deployments/<d>/embeddings            deterministic vectors, float or base64
+  POST /openai/deployments/<d>/images/generations    URLs of PNGs served by the mock itself
+  POST /openai/deployments/<d>/audio/transcriptions  Whisper-style {"text": ...}
+  POST .../transcriptions:transcribe                 Azure Speech fast transcription
+  GET  /mock/stats, POST /mock/reset                 per-deployment request, 429 and token counts
+
+Latency is a time to first byte (latency_ms plus up to latency_jitter_ms) followed by the reply
+being generated at tokens_per_second. Requests over a deployment's tpm_limit or rpm_limit in
+the last minute, and a throttle_rate share of all requests, get a 429 with retry-after headers.
+Token counts are estimates (about 4 characters a token), not a tokenizer's.
+"""
+import re
+import sys
+import json
+import time
+import zlib
+import base64
+import random
+import struct
+import hashlib
+import argparse
+import threading
+from collections import defaultdict, deque
+from dataclasses import asdict, dataclass, field, fields, replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+WORDS = (
+    "the portal team reviewed quarterly results and agreed next steps for claims policy pricing "
+    "customer service digital channels risk and compliance with clear owners and dates"
+).split()
+
+# Items generated for a JSON-schema array without a minItems
+ARRAY_ITEMS = 3
+
+
+@dataclass
+class MockSettings:
+    latency_ms: float = 200.0
+    latency_jitter_ms: float = 50.0
+    tokens_per_second: float = 80.0
+    # Completion tokens when the request does not ask for fewer with max_tokens
+    reply_tokens: int = 150
+    # Share of requests answered with a 429 regardless of load
+    throttle_rate: float = 0.0
+    # Tokens and requests per minute a deployment accepts before answering 429 (0 is unlimited)
+    tpm_limit: int = 0
+    rpm_limit: int = 0
+    retry_after_seconds: float = 1.0
+    embedding_dimensions: int = 1536
+    image_size: int = 1024
+    # Seconds of processing per MB of uploaded audio
+    stt_seconds_per_mb: float = 0.5
+    # Per-deployment overrides of the fields above
+    deployments: dict = field(default_factory=dict)
+
+    def for_deployment(self, deployment):
+        overrides = self.deployments.get(deployment)
+        return replace(self, **overrides) if overrides else self
+
+
+def estimate_tokens(value):
+    """About 4 characters a token, counting the text anywhere in a request body"""
+    if isinstance(value, str):
+        return max(1, len(value) // 4) if value else 0
+    if isinstance(value, dict):
+        return sum(estimate_tokens(item) for key, item in value.items() if key != "image_url") + (
+            85 if "image_url" in value else 0
+        )
+    if isinstance(value, list):
+        if value and all(isinstance(item, int) for item in value):
+            return len(value)  # already tokens
+        return sum(estimate_tokens(item) for item in value)
+    return 0
+
+
+def reply_text(tokens, seed):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(max(1, tokens))).capitalize() + "."
+
+
+def sample_from_schema(schema, root=None, depth=0):
+    """A value that validates against a JSON schema, as pydantic generates them"""
+    root = root or schema
+    if "$ref" in schema:
+        target = root
+        for part in schema["$ref"].lstrip("#/").split("/"):
+            target = target[part]
+        return sample_from_schema(target, root, depth + 1)
+    for combinator in ("anyOf", "oneOf", "allOf"):
+        if combinator in schema:
+            options = [option for option in schema[combinator] if option.get("type") != "null"] or schema[combinator]
+            return sample_from_schema(options[0], root, depth + 1)
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "const" in schema:
+        return schema["const"]
+
+    schema_type = schema.get("type")
+    if isinstance(schema_type, list):
+        schema_type = next((item for item in schema_type if item != "null"), "null")
+    if schema_type == "object" or "properties" in schema:
+        if depth > 12:
+            return {}
+        return {name: sample_from_schema(prop, root, depth + 1) for name, prop in schema.get("properties", {}).items()}
+    if schema_type == "array":
+        count = max(schema.get("minItems", 0), min(ARRAY_ITEMS, schema.get("maxItems", ARRAY_ITEMS)))
+        return [sample_from_schema(schema.get("items", {}), root, depth + 1) for _ in range(count)]
+    if schema_type == "integer":
+        return max(1, schema.get("minimum", 1))
+    if schema_type == "number":
+        return float(max(1, schema.get("minimum", 1)))
+    if schema_type == "boolean":
+        return True
+    if schema_type == "null":
+        return None
+    text = " ".join(WORDS[: max(3, (schema.get("minLength") or 0) // 5 + 1)])
+    return text[: schema["maxLength"]] if schema.get("maxLength") else text
+
+
+def _schema_in_messages(messages):
+    """The JSON schema quoted in a repair request, if there is one"""
+    for message in reversed(messages or []):
+        content = message.get("content")
+        if isinstance(content, str) and "JSON schema:" in content:
+            try:
+                return json.loads(content.split("JSON schema:", 1)[1].strip())
+            except ValueError:
+                return None
+    return None
+
+
+def png_bytes(size, seed):
+    """A solid-colour size x size PNG"""
+    rng = random.Random(seed)
+    pixel = bytes(rng.randrange(256) for _ in range(3))
+    raw = b"".join(b"\x00" + pixel * size for _ in range(size))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 9)) + chunk(b"IEND", b"")
+
+
+class MockState:
+    """Settings, per-deployment load windows and counters shared by the request threads"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.lock = threading.Lock()
+        # deployment -> deque of (time, tokens) in the last minute
+        self.windows = defaultdict(deque)
+        self.counters = defaultdict(lambda: defaultdict(int))
+        self.images = {}
+
+    def admit(self, deployment, tokens):
+        """None if a request may run, or the seconds the client should wait before retrying"""
+        settings = self.settings.for_deployment(deployment)
+        now = time.time()
+        with self.lock:
+            window = self.windows[deployment]
+            while window and window[0][0] < now - 60:
+                window.popleft()
+            over_tpm = settings.tpm_limit and sum(used for _, used in window) + tokens > settings.tpm_limit
+            over_rpm = settings.rpm_limit and len(window) + 1 > settings.rpm_limit
+            if over_tpm or over_rpm:
+                return max(settings.retry_after_seconds, 60 - (now - window[0][0]) if window else 0)
+            if settings.throttle_rate and random.random() < settings.throttle_rate:
+                return settings.retry_after_seconds
+            window.append((now, tokens))
+            return None
+
+    def count(self, kind, deployment, **counts):
+        with self.lock:
+            counters = self.counters[f"{kind}:{deployment}"]
+            for name, value in counts.items():
+                counters[name] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {key: dict(counters) for key, counters in self.counters.items()}
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.windows.clear()
+
+
+DEPLOYMENT_PATH = re.compile(r"^/openai/deployments/([^/]+)/(chat/completions|embeddings|images/generations|audio/transcriptions)$")
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockAzureOpenAI/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            sys.stderr.write(f"{self.address_string()} {format % args}\n")
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _throttled(self, kind, deployment, retry_after):
+        self.state.count(kind, deployment, requests=1, throttled=1)
+        self._send_json(
+            {"error": {"code": "429", "message": "Requests to the deployment have exceeded the rate limit of the mock."}},
+            status=429,
+            headers={"retry-after": str(int(max(1, retry_after))), "retry-after-ms": str(int(retry_after * 1000))},
+        )
+
+    def _wait_first_byte(self, settings):
+        time.sleep((settings.latency_ms + random.uniform(0, settings.latency_jitter_ms)) / 1000)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/mock/stats":
+            return self._send_json(self.state.snapshot())
+        if path.startswith("/mock-images/"):
+            image = self.state.images.get(path.rsplit("/", 1)[-1])
+            if image is None:
+                return self._send_json({"error": "not found"}, status=404)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(image)))
+            self.end_headers()
+            self.wfile.write(image)
+            return
+        self._send_json({"error": {"code": "404", "message": f"No mock for GET {path}"}}, status=404)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self._body()
+        if path == "/mock/reset":
+            self.state.reset()
+            return self._send_json({"ok": True})
+        if path.endswith("transcriptions:transcribe") or "/speechtotext/" in path:
+            return self._speech_transcription(body)
+
+        match = DEPLOYMENT_PATH.match(path)
+        if not match:
+            return self._send_json({"error": {"code": "404", "message": f"No mock for POST {path}"}}, status=404)
+        deployment, operation = match.groups()
+        if operation == "audio/transcriptions":
+            return self._whisper_transcription(deployment, body)
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            return self._send_json({"error": {"code": "400", "message": "Body is not JSON"}}, status=400)
+        if operation == "chat/completions":
+            return self._chat(deployment, request)
+        if operation == "embeddings":
+            return self._embeddings(deployment, request)
+        return self._image(deployment, request)
+
+    def _chat(self, deployment, request):
+        settings = self.state.settings.for_deployment(deployment)
+        messages = request.get("messages") or []
+        prompt_tokens = estimate_tokens(messages)
+        completion_tokens = min(request.get("max_tokens") or request.get("max_completion_tokens") or settings.reply_tokens, settings.reply_tokens)
+
+        retry_after = self.state.admit(deployment, prompt_tokens + completion_tokens)
+        if retry_after is not None:
+            return self._throttled("chat", deployment, retry_after)
+
+        response_format = request.get("response_format") or {}
+        schema = None
+        if response_format.get("type") == "json_schema":
+            schema = response_format["json_schema"]["schema"]
+        elif response_format.get("type") == "json_object":
+            schema = _schema_in_messages(messages) or {"type": "object", "properties": {}}
+        seed = hashlib.sha256(json.dumps(messages, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        if schema is not None:
+            content = json.dumps(sample_from_schema(schema))
+            completion_tokens = estimate_tokens(content)
+        else:
+            content = reply_text(completion_tokens, seed)
+
+        self._wait_first_byte(settings)
+        self.state.count("chat", deployment, requests=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                         streamed=1 if request.get("stream") else 0)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+        base = {"id": f"chatcmpl-mock-{seed[:12]}", "created": int(time.time()), "model": deployment, "system_fingerprint": "mock"}
+
+        if not request.get("stream"):
+            time.sleep(completion_tokens / settings.tokens_per_second)
+            return self._send_json({
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+                "usage": usage,
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(payload):
+            data = b"data: " + (payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")) + b"\n\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        chunk = {**base, "object": "chat.completion.chunk"}
+        # Azure sends the prompt's content filter results in a first chunk without choices
+        event({**chunk, "choices": [], "prompt_filter_results": [{"prompt_index": 0, "content_filter_results": {}}]})
+        event({**chunk, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]})
+        pieces = re.findall(r"\S+\s*", content) or [content]
+        pieces_per_event = max(1, len(pieces) // 50)
+        for start in range(0, len(pieces), pieces_per_event):
+            group = pieces[start:start + pieces_per_event]
+            time.sleep(len(group) * completion_tokens / max(1, len(pieces)) / settings.tokens_per_second)
+            event({**chunk, "choices": [{"index": 0, "delta": {"content": "".join(group)}, "finish_reason": None}]})
+        event({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (request.get("stream_options") or {}).get("include_usage"):
+            event({**chunk, "choices": [], "usage": usage})
+        event(b"[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _embeddings(self, deployment, request):
+        settings = self.state.settings.for_deployment(deployment)
+        inputs = request.get("input")
+        if isinstance(inputs, str) or (isinstance(inputs, list) and inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        tokens = estimate_tokens(inputs)
+        retry_after = self.state.admit(deployment, tokens)
+        if retry_after is not None:
+            return self._throttled("embeddings", deployment, retry_after)
+        self._wait_first_byte(settings)
+
+        dimensions = request.get("dimensions") or settings.embedding_dimensions
+        data = []
+        for index, item in enumerate(inputs or []):
+            rng = random.Random(hashlib.sha256(json.dumps(item).encode("utf-8")).digest())
+            vector = [rng.gauss(0, 1) for _ in range(dimensions)]
+            norm = sum(value * value for value in vector) ** 0.5 or 1.0
+            vector = [value / norm for value in vector]
+            if request.get("encoding_format") == "base64":
+                vector = base64.b64encode(struct.pack(f"<{dimensions}f", *vector)).decode("ascii")
+            data.append({"object": "embedding", "index": index, "embedding": vector})
+        self.state.count("embeddings", deployment, requests=1, prompt_tokens=tokens, inputs=len(data))
+        self._send_json({"object": "list", "data": data, "model": deployment, "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+    def _image(self, deployment, request):
+        settings = self.state.settings.for_deployment(deployment)
+        retry_after = self.state.admit(deployment, 0)
+        if retry_after is not None:
+            return self._throttled("images", deployment, retry_after)
+        self._wait_first_byte(settings)
+        # Image models take seconds; charge the generation time of a long reply
+        time.sleep(settings.reply_tokens / settings.tokens_per_second)
+
+        images = []
+        for _ in range(request.get("n") or 1):
+            image_id = f"{hashlib.sha256(f'{time.time()}{random.random()}'.encode()).hexdigest()[:16]}.png"
+            with self.state.lock:
+                self.state.images[image_id] = png_bytes(settings.image_size, image_id)
+                # Keep the most recent images only
+                while len(self.state.images) > 64:
+                    self.state.images.pop(next(iter(self.state.images)))
+            host = self.headers.get("Host") or f"127.0.0.1:{self.server.server_address[1]}"
+            images.append({"url": f"http://{host}/mock-images/{image_id}", "revised_prompt": request.get("prompt")})
+        self.state.count("images", deployment, requests=1, images=len(images))
+        self._send_json({"created": int(time.time()), "data": images})
+
+    def _processing_time(self, settings, body):
+        return settings.stt_seconds_per_mb * len(body) / (1024 * 1024)
+
+    def _whisper_transcription(self, deployment, body):
+        settings = self.state.settings.for_deployment(deployment)
+        retry_after = self.state.admit(deployment, 0)
+        if retry_after is not None:
+            return self._throttled("transcriptions", deployment, retry_after)
+        self._wait_first_byte(settings)
+        time.sleep(self._processing_time(settings, body))
+        text = reply_text(settings.reply_tokens, len(body))
+        self.state.count("transcriptions", deployment, requests=1, audio_bytes=len(body), completion_tokens=estimate_tokens(text))
+        self._send_json({"text": text})
+
+    def _speech_transcription(self, body):
+        settings = self.state.settings.for_deployment("speech-to-text")
+        retry_after = self.state.admit("speech-to-text", 0)
+        if retry_after is not None:
+            return self._throttled("transcriptions", "speech-to-text", retry_after)
+        self._wait_first_byte(settings)
+        time.sleep(self._processing_time(settings, body))
+        text = reply_text(settings.reply_tokens, len(body))
+        duration_ms = int(len(body) / 32)  # 16 kHz 16-bit mono
+        self.state.count("transcriptions", "speech-to-text", requests=1, audio_bytes=len(body), completion_tokens=estimate_tokens(text))
+        self._send_json({
+            "durationMilliseconds": duration_ms,
+            "combinedPhrases": [{"text": text}],
+            "phrases": [{"offsetMilliseconds": 0, "durationMilliseconds": duration_ms, "text": text, "locale": "en-US", "confidence": 0.9}],
+        })
+
+
+class MockAzureOpenAI(ThreadingHTTPServer):
+    """The mock server; start() serves it from a daemon thread, for use inside a benchmark"""
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, settings=None, verbose=False):
+        super().__init__((host, port), MockHandler)
+        self.state = MockState(settings or MockSettings())
+        self.verbose = verbose
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def environment(self):
+        """Environment variables that point the portal's config.py at this server"""
+        return {
+            "AZURE_OPENAI_ENDPOINT": self.url,
+            "AZURE_OPENAI_KEY": "mock",
+            "AZURE_OPENAI_EMBEDDING_ENDPOINT": self.url,
+            "CDCB_AZURE_OPENAI_ENDPOINT": self.url,
+            "CDCB_AZURE_OPENAI_KEY": "mock",
+            "CDCB_AZURE_OPENAI_EMBEDDING_ENDPOINT": self.url,
+            "CACB_AZURE_OPENAI_ENDPOINT": self.url,
+            "CACB_AZURE_OPENAI_KEY": "mock",
+            "CACB_AZURE_OPENAI_EMBEDDING_ENDPOINT": self.url,
+            "AZURE_STT_ENDPOINT": f"{self.url}/speechtotext/transcriptions:transcribe?api-version=2024-11-15",
+            "AZURE_STT_KEY": "mock",
+        }
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="mock-azure-openai", daemon=True).start()
+        return self
+
+    def stats(self):
+        return self.state.snapshot()
+
+    def reset(self):
+        self.state.reset()
+
+
+def parse_deployment_override(text):
+    """"gpt4o:latency_ms=900,tpm_limit=30000" -> ("gpt4o", {"latency_ms": 900.0, "tpm_limit": 30000})"""
+    deployment, _, assignments = text.partition(":")
+    defaults = MockSettings()
+    overrides = {}
+    for assignment in filter(None, assignments.split(",")):
+        name, _, value = assignment.partition("=")
+        if name == "deployments" or not hasattr(defaults, name):
+            raise argparse.ArgumentTypeError(f"Unknown setting {name}")
+        overrides[name] = type(getattr(defaults, name))(value)
+    return deployment, overrides
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    defaults = MockSettings()
+    for item in fields(MockSettings):
+        if item.name != "deployments":
+            parser.add_argument(f"--{item.name.replace('_', '-')}", type=type(getattr(defaults, item.name)),
+                                default=getattr(defaults, item.name))
+    parser.add_argument("--deployment", action="append", type=parse_deployment_override, default=[],
+                        help="Per-deployment overrides, e.g. gpt4o:latency_ms=900,tpm_limit=30000")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    settings = MockSettings(
+        **{item.name: getattr(args, item.name) for item in fields(MockSettings) if item.name != "deployments"},
+        deployments=dict(args.deployment),
+    )
+    server = MockAzureOpenAI(args.host, args.port, settings, verbose=args.verbose)
+    print(f"Mock Azure OpenAI on {server.url} with {json.dumps(asdict(settings))}")
+    print("Point the portal at it with:")
+    for name, value in server.environment().items():
+        print(f"  export {name}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Bytes sent to the browser per Streamlit rerun, with static assets inlined versus referenced by URL.
+
+Run from the repository root, in an environment with requirements.txt installed:
+
+    python benchmarks/rerun_payload_benchmark.py
+    python benchmarks/rerun_payload_benchmark.py --reruns 20 --json results.json
+
+"inline" reproduces the old behaviour, where the background GIF and the logos were
+base64-encoded into the page markup on every rerun. "url" is the current behaviour,
+where the markup only references content-hashed URLs under app/static/ and the
+browser downloads each asset once.
+
+The byte counts are the serialized ForwardMsg deltas the script produces for one
+rerun, i.e. what Streamlit has to build, hash and hand to the websocket. Newer
+Streamlit releases can replace a repeated large message with a hash reference on
+the wire, but the server still reads, encodes and hashes the full payload each time.
+"""
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import mimetypes
+import statistics
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.chdir(REPO_ROOT)
+
+
+def inline_asset_url(name):
+    """The old behaviour: embed the file as a data URI"""
+    import static_assets
+
+    path = os.path.join(static_assets.STATIC_DIR, name)
+    mime_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    with open(path, "rb") as f:
+        return f"data:{mime_type};base64,{base64.b64encode(f.read()).decode()}"
+
+
+def measure_gallery(reruns, inline):
+    """Render the gallery headlessly and return (bytes, seconds) for every rerun"""
+    from streamlit import config as st_config
+    from streamlit.testing.v1 import AppTest
+    from streamlit.testing.v1 import local_script_runner
+    import static_assets
+
+    payload_sizes = []
+    parse_tree = local_script_runner.parse_tree_from_messages
+
+    def measuring_parse_tree(messages):
+        payload_sizes.append(sum(msg.ByteSize() for msg in messages))
+        return parse_tree(messages)
+
+    local_script_runner.parse_tree_from_messages = measuring_parse_tree
+    original_asset_url = static_assets.asset_url
+    if inline:
+        # Card images were never inlined (they went through st.image), so only inline the page assets
+        static_assets.asset_url = lambda name: (
+            original_asset_url(name) if name.startswith("images/") else inline_asset_url(name)
+        )
+    st_config.set_option("server.enableStaticServing", True)
+
+    try:
+        app_test = AppTest.from_file(os.path.join(REPO_ROOT, "app.py"), default_timeout=120)
+        app_test.session_state["authenticated"] = True
+        app_test.session_state["display_name"] = "Benchmark"
+        app_test.session_state["user_email"] = "benchmark@example.com"
+
+        timings = []
+        for _ in range(reruns + 1):
+            start = time.perf_counter()
+            app_test.run()
+            timings.append(time.perf_counter() - start)
+
+        if app_test.exception:
+            raise RuntimeError(f"Gallery render failed: {app_test.exception[0].message}")
+    finally:
+        local_script_runner.parse_tree_from_messages = parse_tree
+        static_assets.asset_url = original_asset_url
+
+    # The first run pays for imports and the asset build, so only reruns are compared
+    return payload_sizes[1:], timings[1:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reruns", type=int, default=10, help="Gallery reruns to measure")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in ("inline", "url"):
+        sizes, timings = measure_gallery(args.reruns, inline=(mode == "inline"))
+        results[mode] = {
+            "bytes_per_rerun": statistics.median(sizes),
+            "rerun_median_s": statistics.median(timings),
+        }
+
+    print("Gallery payload per rerun (ForwardMsg bytes)")
+    for mode, label in (("inline", "inline (before)"), ("url", "url    (now)   ")):
+        print(f"  {label}: {results[mode]['bytes_per_rerun'] / 1024:,.1f} KiB, "
+              f"median rerun {results[mode]['rerun_median_s']:.3f}s")
+    saved = results["inline"]["bytes_per_rerun"] - results["url"]["bytes_per_rerun"]
+    print(f"  saved per rerun: {saved / 1024:,.1f} KiB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
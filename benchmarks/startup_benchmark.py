@@ -0,0 +1,165 @@
+"""
+Cold start, gallery render and app first-launch benchmark for the AI Portal.
+
+Run from the repository root, in an environment with requirements.txt installed:
+
+    python benchmarks/startup_benchmark.py
+    python benchmarks/startup_benchmark.py --repeat 10 --reruns 20 --json results.json
+
+Import times are measured in fresh interpreters so every run starts with a cold
+module cache. "eager" is the set of modules app.py imported at the top of the
+script before apps were loaded from the registry, "lazy" is what it imports now.
+Gallery render times come from Streamlit's headless AppTest runner.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# Modules app.py imported at module level before apps were loaded lazily
+EAGER_IMPORTS = [
+    "streamlit", "requests", "PIL.Image", "login_ui", "db_utils", "Functions", "config",
+    "langchain_community.vectorstores", "langchain_core.prompts", "langchain_community.callbacks.manager",
+    "langchain.chains.question_answering", "langchain.chains.combine_documents", "langchain_core.runnables",
+    "langchain_openai", "langchain.text_splitter", "langchain.prompts",
+]
+
+# Modules app.py imports before the first app is launched
+LAZY_IMPORTS = ["streamlit", "login_ui", "db_utils", "Functions", "config", "app_registry"]
+
+IMPORT_SNIPPET = """
+import importlib, json, sys, time
+start = time.perf_counter()
+failed = []
+for name in sys.argv[1:]:
+    try:
+        importlib.import_module(name)
+    except Exception as e:
+        failed.append(f"{name}: {type(e).__name__}")
+print(json.dumps({"seconds": time.perf_counter() - start, "failed": failed}))
+"""
+
+
+def time_fresh_imports(modules, repeat):
+    """Import a list of modules in fresh interpreters and return the wall times"""
+    timings = []
+    failed = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET, *modules],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        )
+        output = json.loads(result.stdout.strip().splitlines()[-1])
+        timings.append(output["seconds"])
+        failed = output["failed"]
+    return timings, failed
+
+
+def time_gallery_render(reruns):
+    """Render the gallery headlessly and return the cold run and rerun times"""
+    from streamlit.testing.v1 import AppTest
+
+    app_test = AppTest.from_file(os.path.join(REPO_ROOT, "app.py"), default_timeout=120)
+    app_test.session_state["authenticated"] = True
+    app_test.session_state["display_name"] = "Benchmark"
+    app_test.session_state["user_email"] = "benchmark@example.com"
+
+    timings = []
+    for _ in range(reruns + 1):
+        start = time.perf_counter()
+        app_test.run()
+        timings.append(time.perf_counter() - start)
+
+    if app_test.exception:
+        raise RuntimeError(f"Gallery render failed: {app_test.exception[0].message}")
+
+    # The render times the app records itself (gallery.timed_render), excluding Streamlit's own overhead
+    import gallery
+    return timings[0], timings[1:], gallery.render_stats()
+
+
+def time_app_first_launch(repeat):
+    """Time the first-launch import of every registered app module"""
+    import app_registry
+
+    results = {}
+    seen = set()
+    for app_id, metadata in app_registry.APP_METADATA.items():
+        if not metadata.get("entry_point"):
+            continue
+        module_name = metadata["entry_point"].split(":")[0]
+        if module_name in seen:
+            continue
+        seen.add(module_name)
+        timings, failed = time_fresh_imports([module_name], repeat)
+        results[app_id] = {
+            "module": module_name,
+            "median_s": statistics.median(timings),
+            "failed": failed,
+        }
+    return results
+
+
+def summarise(timings):
+    ordered = sorted(timings)
+    return {
+        "median_s": statistics.median(ordered),
+        "p95_s": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "min_s": ordered[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per import measurement")
+    parser.add_argument("--reruns", type=int, default=10, help="Gallery reruns after the cold run")
+    parser.add_argument("--skip-gallery", action="store_true", help="Only measure import times")
+    parser.add_argument("--skip-apps", action="store_true", help="Skip the per-app first-launch measurement")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+
+    eager, eager_failed = time_fresh_imports(EAGER_IMPORTS, args.repeat)
+    lazy, lazy_failed = time_fresh_imports(LAZY_IMPORTS, args.repeat)
+    results["cold_start_imports"] = {
+        "eager": {**summarise(eager), "failed": eager_failed},
+        "lazy": {**summarise(lazy), "failed": lazy_failed},
+    }
+
+    print("Cold start imports (fresh interpreter)")
+    print(f"  eager (before): median {results['cold_start_imports']['eager']['median_s']:.3f}s")
+    print(f"  lazy  (now):    median {results['cold_start_imports']['lazy']['median_s']:.3f}s")
+    for name in eager_failed + lazy_failed:
+        print(f"  ! could not import {name}")
+
+    if not args.skip_gallery:
+        cold, reruns, instrumented = time_gallery_render(args.reruns)
+        results["gallery_render"] = {"cold_s": cold, "reruns": summarise(reruns), "instrumented": instrumented}
+        print("Gallery render (AppTest)")
+        print(f"  cold run: {cold:.3f}s")
+        print(f"  reruns:   median {results['gallery_render']['reruns']['median_s']:.3f}s, "
+              f"p95 {results['gallery_render']['reruns']['p95_s']:.3f}s")
+        if instrumented["renders"]:
+            print(f"  render_app_gallery: median {instrumented['median_ms']:.1f}ms, p95 {instrumented['p95_ms']:.1f}ms")
+
+    if not args.skip_apps:
+        results["app_first_launch"] = time_app_first_launch(args.repeat)
+        print("App first launch (module import, paid once per process)")
+        for app_id, app_result in results["app_first_launch"].items():
+            note = f"  ! {', '.join(app_result['failed'])}" if app_result["failed"] else ""
+            print(f"  {app_id:<30} {app_result['median_s']:.3f}s{note}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
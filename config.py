@@ -1,4 +1,5 @@
 import os
+import json
 
 app_type = 'dev' # 'prod' 'webapp_prod' 'local_dev'
 
@@ -32,9 +33,154 @@ AAD_CLIENT_ID = os.environ.get("AAD_CLIENT_ID")
 AAD_CLIENT_SECRET = os.environ.get("AAD_CLIENT_SECRET")
 AAD_TENANT_ID = os.environ.get("AAD_TENANT_ID")
 REDIRECT_URI = os.environ.get("REDIRECT_URI")
+# Signed-in users (comma-separated emails) allowed to use the admin tools, e.g. page profiling
+PORTAL_ADMIN_EMAILS = {email.strip().lower() for email in os.environ.get("PORTAL_ADMIN_EMAILS", "").split(",") if email.strip()}
+# Sessions opening the portal with ?load_test_token=<this> are signed in as load test users without
+# Microsoft sign-in (see benchmarks/load_test.py); empty, the default, disables it. Never set it in production
+LOAD_TEST_TOKEN = os.environ.get("LOAD_TEST_TOKEN", "")
 
 # SQL SERVER DETAILS
 SQL_SERVER = os.environ.get("SQL_SERVER")
 SQL_DATABASE = os.environ.get("SQL_DATABASE")
 SQL_USERNAME = os.environ.get("SQL_USERNAME")
 SQL_PASSWORD = os.environ.get("SQL_PASSWORD")
+
+# USAGE RETENTION
+USAGE_RETENTION_MONTHS = int(os.environ.get("USAGE_RETENTION_MONTHS", "6"))
+USAGE_ARCHIVE_DIR = os.environ.get("USAGE_ARCHIVE_DIR", os.path.join(os.getcwd(), "archive"))
+
+# STATIC ASSETS
+# Base URL the browser loads hashed assets from (e.g. a CDN or ingress path); empty uses Streamlit's app/static route
+STATIC_ASSET_BASE_URL = os.environ.get("STATIC_ASSET_BASE_URL", "")
+# Port for the built-in static asset server (long-lived cache headers, gzip); empty disables it
+STATIC_ASSET_PORT = os.environ.get("STATIC_ASSET_PORT", "")
+
+# GALLERY
+# A gallery render slower than this is logged as a warning
+GALLERY_RENDER_BUDGET_MS = int(os.environ.get("GALLERY_RENDER_BUDGET_MS", "250"))
+
+# AZURE OPENAI HTTP POOL (shared by every client built through Functions.get_client)
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+# Idle connections are kept this long (seconds); well under the ~4 minute Azure load balancer idle timeout
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", "120"))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_READ_TIMEOUT = float(os.environ.get("OPENAI_READ_TIMEOUT", "120"))
+OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", "2"))
+
+# LLM GATEWAY
+# Per-deployment quota overrides as JSON, e.g. {"gpt4o": {"tpm": 150000, "rpm": 900, "concurrency": 10}}
+LLM_DEPLOYMENT_LIMITS = json.loads(os.environ.get("LLM_DEPLOYMENT_LIMITS", "{}"))
+# Total time a call may spend waiting for admission, retrying and running
+LLM_DEFAULT_DEADLINE_SECONDS = float(os.environ.get("LLM_DEFAULT_DEADLINE_SECONDS", "120"))
+LLM_MAX_ATTEMPTS = int(os.environ.get("LLM_MAX_ATTEMPTS", "4"))
+
+# LLM FAN-OUT (parallel independent calls, see llm_fanout.py)
+LLM_FANOUT_CONCURRENCY = int(os.environ.get("LLM_FANOUT_CONCURRENCY", "8"))
+LLM_FANOUT_RETRIES = int(os.environ.get("LLM_FANOUT_RETRIES", "2"))
+
+# LLM ROUTING
+# Per-deployment overrides of the router's context size, cost and latency figures as JSON,
+# e.g. {"gpt4o": {"context_tokens": 128000, "ms_per_output_token": 15}}
+LLM_ROUTING_PROFILES = json.loads(os.environ.get("LLM_ROUTING_PROFILES", "{}"))
+# Per-app (or "app_id:task") routing policy overrides as JSON,
+# e.g. {"doc_summary": {"candidates": ["gpt4omini", "gpt4o"], "latency_target_ms": 30000, "max_cost_usd": 0.2}}
+LLM_ROUTING_POLICIES = json.loads(os.environ.get("LLM_ROUTING_POLICIES", "{}"))
+
+# LLM TOKEN BUDGETS
+# Per-app overrides of how documents are fitted into prompts as JSON,
+# e.g. {"doc_summary": {"strategy": "map_reduce", "max_input_tokens": 40000, "chunk_tokens": 8000}}
+LLM_BUDGETS = json.loads(os.environ.get("LLM_BUDGETS", "{}"))
+
+# BACKGROUND JOBS (long app tasks run by a worker pool, see jobs.py)
+JOBS_DB_PATH = os.environ.get("JOBS_DB_PATH", os.path.join(os.getcwd(), "jobs.db"))
+JOBS_WORKERS = int(os.environ.get("JOBS_WORKERS", "4"))
+# Most jobs one user may have running at once; the rest wait in the queue
+JOBS_PER_USER_LIMIT = int(os.environ.get("JOBS_PER_USER_LIMIT", "2"))
+# Per-job-type limits of running jobs as JSON, e.g. {"ppt_images": 2, "transcription": 3}
+JOBS_TYPE_LIMITS = json.loads(os.environ.get("JOBS_TYPE_LIMITS", "{}"))
+# Finished jobs and their results are kept this long
+JOBS_RETENTION_HOURS = float(os.environ.get("JOBS_RETENTION_HOURS", "24"))
+# How often a page showing a running job refreshes its status
+JOBS_POLL_SECONDS = float(os.environ.get("JOBS_POLL_SECONDS", "1"))
+
+# CPU POOL (document parsing, image work and file building off the script thread, see cpu_pool.py)
+# 0 runs the tasks in the calling thread
+CPU_POOL_WORKERS = int(os.environ.get("CPU_POOL_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+CPU_TASK_TIMEOUT_SECONDS = float(os.environ.get("CPU_TASK_TIMEOUT_SECONDS", "120"))
+# Memory a task may allocate on top of what its worker process already uses
+CPU_TASK_MEMORY_MB = int(os.environ.get("CPU_TASK_MEMORY_MB", "1024"))
+
+# LLM RESPONSE CACHE (opt-in per call site with llm_gateway.chat_completion(..., cache=True))
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_DIR = os.environ.get("LLM_CACHE_DIR", os.path.join(os.getcwd(), "llm_cache"))
+LLM_CACHE_TTL_SECONDS = int(os.environ.get("LLM_CACHE_TTL_SECONDS", str(24 * 3600)))
+LLM_CACHE_MEMORY_ENTRIES = int(os.environ.get("LLM_CACHE_MEMORY_ENTRIES", "512"))
+LLM_CACHE_MEMORY_MB = int(os.environ.get("LLM_CACHE_MEMORY_MB", "64"))
+LLM_CACHE_DISK_MB = int(os.environ.get("LLM_CACHE_DISK_MB", "512"))
+
+# SESSION MEMORY (per-session accounting and caps for Streamlit session state, see session_memory.py)
+SESSION_MEMORY_ENABLED = os.environ.get("SESSION_MEMORY_ENABLED", "true").lower() == "true"
+# A single session-state key over this is trimmed (histories) or reported
+SESSION_KEY_CAP_MB = int(os.environ.get("SESSION_KEY_CAP_MB", "32"))
+# Everything one session keeps in memory
+SESSION_CAP_MB = int(os.environ.get("SESSION_CAP_MB", "128"))
+# Most entries kept in a chat or generation history
+SESSION_HISTORY_MAX_ITEMS = int(os.environ.get("SESSION_HISTORY_MAX_ITEMS", "200"))
+# Uploaded files and generated images larger than this are kept on disk and referenced by handle
+SESSION_SPILL_KB = int(os.environ.get("SESSION_SPILL_KB", "256"))
+SESSION_BLOB_DIR = os.environ.get("SESSION_BLOB_DIR", os.path.join(os.getcwd(), "session_blobs"))
+# Spilled blobs of a session not seen for this long are deleted
+SESSION_IDLE_MINUTES = int(os.environ.get("SESSION_IDLE_MINUTES", "60"))
+
+# SESSION STORE (session state kept outside the process so any replica can continue a session, see session_store.py)
+# "sqlite" (a directory, shared between replicas on a shared volume), "redis", or empty to keep state in memory only
+SESSION_STORE_BACKEND = os.environ.get("SESSION_STORE_BACKEND", "").lower()
+SESSION_STORE_PATH = os.environ.get("SESSION_STORE_PATH", os.path.join(os.getcwd(), "session_store"))
+SESSION_STORE_REDIS_URL = os.environ.get("SESSION_STORE_REDIS_URL", "redis://localhost:6379/0")
+# Stored sessions not saved for this long are dropped
+SESSION_STORE_TTL_HOURS = int(os.environ.get("SESSION_STORE_TTL_HOURS", "24"))
+# A new browser tab only takes over the user's latest stored session once it has been idle this long;
+# a tab reconnecting with its own ?session= id (e.g. to another replica) takes it over at once
+SESSION_STORE_TAKEOVER_IDLE_MINUTES = int(os.environ.get("SESSION_STORE_TAKEOVER_IDLE_MINUTES", "30"))
+# Key stored values are signed with (HMAC-SHA256) and checked against before they are unpickled; set the same
+# value on every replica. Required for the redis backend, which is not started without it
+SESSION_STORE_SECRET = os.environ.get("SESSION_STORE_SECRET", "")
+
+# LLM FIXTURES (record scrubbed model calls in production and replay them offline, see llm_fixtures.py)
+# "record", "replay", or empty for neither
+LLM_FIXTURES_MODE = os.environ.get("LLM_FIXTURES_MODE", "").lower()
+LLM_FIXTURES_DIR = os.environ.get("LLM_FIXTURES_DIR", os.path.join(os.getcwd(), "llm_fixtures"))
+# Share of recorded functions' runs written as episodes, and how many are kept per function
+LLM_FIXTURES_SAMPLE_RATE = float(os.environ.get("LLM_FIXTURES_SAMPLE_RATE", "1.0"))
+LLM_FIXTURES_MAX_EPISODES = int(os.environ.get("LLM_FIXTURES_MAX_EPISODES", "20"))
+# Replayed responses take their recorded time multiplied by this (0 answers at once)
+LLM_FIXTURES_SPEED = float(os.environ.get("LLM_FIXTURES_SPEED", "1.0"))
+# Only answer requests identical to a recorded one, instead of the closest call of the same kind
+LLM_FIXTURES_STRICT = os.environ.get("LLM_FIXTURES_STRICT", "false").lower() == "true"
+
+# PROFILING (admins add ?profile=1, or ?profile=sampling, to the portal URL, see profiler.py)
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(os.getcwd(), "profiles"))
+# Hot functions listed in the sidebar after a profiled run
+PROFILE_TOP_N = int(os.environ.get("PROFILE_TOP_N", "15"))
+# How often the sampling profiler looks at the script thread's stack
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+# Profiles older than this are deleted
+PROFILE_RETENTION_DAYS = int(os.environ.get("PROFILE_RETENTION_DAYS", "7"))
+
+# METRICS (Prometheus text format, see metrics.py)
+# Port of the side server answering /metrics; empty disables it
+METRICS_PORT = os.environ.get("METRICS_PORT", "")
+# File the metrics are also written to (e.g. for node_exporter's textfile collector); empty disables it
+METRICS_FILE = os.environ.get("METRICS_FILE", "")
+METRICS_FILE_INTERVAL_SECONDS = int(os.environ.get("METRICS_FILE_INTERVAL_SECONDS", "15"))
+
+# MEMORY DIAGNOSTICS (admins take tracemalloc snapshots from the sidebar, see memory_snapshots.py)
+# Trace allocations from startup, so snapshots attribute everything the process allocates (costs memory and CPU)
+MEMORY_TRACE_AT_STARTUP = os.environ.get("MEMORY_TRACE_AT_STARTUP", "false").lower() == "true"
+# Stack frames kept per traced allocation; more frames find the portal code behind library allocations
+MEMORY_TRACE_FRAMES = int(os.environ.get("MEMORY_TRACE_FRAMES", "10"))
+# Minutes between memory reports written to the log (RSS trend, caches, sessions, growing sites); 0 disables them
+MEMORY_REPORT_INTERVAL_MINUTES = int(os.environ.get("MEMORY_REPORT_INTERVAL_MINUTES", "0"))
+# Allocation sites and sessions listed per report
+MEMORY_REPORT_TOP_N = int(os.environ.get("MEMORY_REPORT_TOP_N", "10"))
@@ -0,0 +1,261 @@
+import os
+import time
+import signal
+import logging
+import threading
+import statistics
+import multiprocessing
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import config
+import metrics
+
+try:
+    import resource
+except ImportError:  # not available on Windows; tasks then run without a memory limit
+    resource = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# A task that ignores its own timeout (stuck in C code) gets this much longer before its
+# worker process is killed
+KILL_GRACE_SECONDS = 5
+
+# How often a caller checks whether its queued task has been picked up by a worker
+DISPATCH_POLL_SECONDS = 0.1
+
+TASK_SECONDS = metrics.histogram(
+    "portal_cpu_task_seconds", "CPU pool tasks (file text extraction, image previews, PPTX builds) including queueing"
+)
+
+
+class CPUTaskError(RuntimeError):
+    """A task could not finish in the pool: its worker died or was killed"""
+
+
+class CPUTaskTimeout(CPUTaskError):
+    """A task ran longer than its timeout"""
+
+
+class CPUTaskMemoryError(CPUTaskError):
+    """A task tried to allocate more than its memory limit"""
+
+
+class _Alarm(Exception):
+    pass
+
+
+def _raise_alarm(signum, frame):
+    raise _Alarm()
+
+
+def _address_space_bytes():
+    """Virtual memory the worker is already using, so a task's limit comes on top of it"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def _execute(fn, args, kwargs, timeout, memory_mb):
+    """Run a task in a worker process under its time and memory limits; returns the value and timings"""
+    name = getattr(fn, "__name__", str(fn))
+    started_at = time.time()
+
+    previous_limit = None
+    if resource is not None and memory_mb:
+        previous_limit = resource.getrlimit(resource.RLIMIT_AS)
+        limit = _address_space_bytes() + memory_mb * 1024 * 1024
+        if previous_limit[1] != resource.RLIM_INFINITY:
+            limit = min(limit, previous_limit[1])
+        resource.setrlimit(resource.RLIMIT_AS, (limit, previous_limit[1]))
+
+    use_alarm = timeout and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        value = fn(*args, **kwargs)
+    except _Alarm:
+        raise CPUTaskTimeout(f"{name} did not finish within {timeout}s")
+    except MemoryError:
+        raise CPUTaskMemoryError(f"{name} exceeded its {memory_mb} MB memory limit")
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        if previous_limit is not None:
+            resource.setrlimit(resource.RLIMIT_AS, previous_limit)
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource is not None else 0.0
+    return value, started_at, time.time(), peak_rss_mb
+
+
+class CPUPool:
+    """
+    Process pool for CPU-heavy helpers (document parsing, image work, building files), so one
+    user's large upload does not hold the GIL of the Streamlit server that every session shares.
+
+    Tasks run in spawned worker processes. Each gets a timeout and a memory limit; a task that
+    overruns its timeout by KILL_GRACE_SECONDS has its workers killed and the pool restarted.
+    """
+
+    def __init__(self, workers, timeout_seconds, memory_mb):
+        self.workers = workers
+        self.timeout_seconds = timeout_seconds
+        self.memory_mb = memory_mb
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._max_queue_depth = 0
+        self._restarts = 0
+        self._tasks = defaultdict(lambda: {
+            "calls": 0, "errors": 0, "timeouts": 0,
+            "durations_ms": deque(maxlen=500), "waits_ms": deque(maxlen=500), "peak_rss_mb": 0.0,
+        })
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def _restart(self, executor, reason):
+        """Kill the workers of a pool that has a stuck or dead worker and start afresh on the next task"""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            self._restarts += 1
+        logger.warning(f"Restarting CPU pool: {reason}")
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            try:
+                process.kill()
+            except Exception:
+                pass
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _wait(self, future, executor, name, timeout):
+        # The timeout only starts once a worker has picked the task up
+        while not future.running() and not future.done():
+            wait([future], timeout=DISPATCH_POLL_SECONDS, return_when=FIRST_COMPLETED)
+        done, _ = wait([future], timeout=timeout + KILL_GRACE_SECONDS)
+        if not done:
+            self._restart(executor, f"{name} is still running {timeout + KILL_GRACE_SECONDS}s after it started")
+            raise CPUTaskTimeout(f"{name} did not finish within {timeout}s")
+        return future.result()
+
+    def run(self, fn, *args, timeout=None, memory_mb=None, **kwargs):
+        """
+        Run fn(*args, **kwargs) in a worker process and return its result.
+
+        fn must be a module-level function and its arguments and result picklable. Raises
+        CPUTaskTimeout or CPUTaskMemoryError when the task goes over its limits, and whatever
+        fn raised otherwise. With no workers configured fn runs in the calling thread.
+        """
+        name = f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+        timeout = timeout or self.timeout_seconds
+        memory_mb = memory_mb or self.memory_mb
+        stats = self._tasks[name]
+
+        if self.workers <= 0:
+            started_at = time.time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    stats["calls"] += 1
+                    stats["durations_ms"].append((time.time() - started_at) * 1000)
+
+        submitted_at = time.time()
+        with self._lock:
+            self._in_flight += 1
+            self._max_queue_depth = max(self._max_queue_depth, self._in_flight - self.workers)
+        try:
+            for attempt in (1, 2):
+                executor = self._get_executor()
+                try:
+                    future = executor.submit(_execute, fn, args, kwargs, timeout, memory_mb)
+                    value, started_at, finished_at, peak_rss_mb = self._wait(future, executor, name, timeout)
+                except BrokenProcessPool:
+                    self._restart(executor, f"a worker died while running {name}")
+                    # The pool may have been broken by another task's worker being killed
+                    if attempt == 1:
+                        continue
+                    self._count(name, "errors")
+                    raise CPUTaskError(f"{name} crashed its worker process")
+                except CPUTaskTimeout:
+                    self._count(name, "timeouts")
+                    raise
+                except Exception as e:
+                    logger.error(f"Error running {name} in the CPU pool: {str(e)}")
+                    self._count(name, "errors")
+                    raise
+
+                with self._lock:
+                    stats["calls"] += 1
+                    stats["waits_ms"].append(max(0.0, started_at - submitted_at) * 1000)
+                    stats["durations_ms"].append((finished_at - started_at) * 1000)
+                    stats["peak_rss_mb"] = max(stats["peak_rss_mb"], peak_rss_mb)
+                return value
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _count(self, name, counter):
+        with self._lock:
+            self._tasks[name]["calls"] += 1
+            self._tasks[name][counter] += 1
+
+    def stats(self):
+        """Queue depth, restarts, and per-task call counts, failures, waits and durations"""
+        with self._lock:
+            tasks = {}
+            for name, counts in self._tasks.items():
+                durations = sorted(counts["durations_ms"])
+                waits = counts["waits_ms"]
+                tasks[name] = {
+                    "calls": counts["calls"],
+                    "errors": counts["errors"],
+                    "timeouts": counts["timeouts"],
+                    "median_ms": statistics.median(durations) if durations else 0.0,
+                    "p95_ms": durations[int(len(durations) * 0.95)] if durations else 0.0,
+                    "max_ms": durations[-1] if durations else 0.0,
+                    "avg_wait_ms": sum(waits) / len(waits) if waits else 0.0,
+                    "worker_peak_rss_mb": counts["peak_rss_mb"],
+                }
+            return {
+                "workers": self.workers,
+                "in_flight": self._in_flight,
+                "queue_depth": max(0, self._in_flight - self.workers),
+                "max_queue_depth": self._max_queue_depth,
+                "restarts": self._restarts,
+                "tasks": tasks,
+            }
+
+
+pool = CPUPool(
+    workers=config.CPU_POOL_WORKERS,
+    timeout_seconds=config.CPU_TASK_TIMEOUT_SECONDS,
+    memory_mb=config.CPU_TASK_MEMORY_MB,
+)
+
+
+def run(fn, *args, **kwargs):
+    """Run a CPU-heavy function in the shared pool (see CPUPool.run)"""
+    with TASK_SECONDS.time(task=fn.__name__):
+        return pool.run(fn, *args, **kwargs)
+
+
+def stats():
+    return pool.stats()
+
+
+metrics.register_stats("cpu_pool", lambda: {name: value for name, value in stats().items() if name != "tasks"})
+metrics.register_stats("cpu_pool_task", lambda: stats()["tasks"], labels=("task",))
@@ -0,0 +1,48 @@
+import io
+
+# CPU-heavy helpers run in cpu_pool's worker processes. They take and return plain bytes and
+# strings so they pickle cheaply, and import their libraries lazily so a worker only loads
+# what the tasks it runs need.
+
+
+def pdf_text(data, separator="\n"):
+    """Text of every page of a PDF"""
+    import fitz
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        return separator.join(page.get_text() for page in doc)
+
+
+def docx_text(data):
+    """Text of every paragraph of a Word document"""
+    import docx
+    doc = docx.Document(io.BytesIO(data))
+    return "\n".join(paragraph.text for paragraph in doc.paragraphs)
+
+
+def pptx_text(data):
+    """Text of every shape on every slide of a PowerPoint file"""
+    from pptx import Presentation
+    presentation = Presentation(io.BytesIO(data))
+    text_content = []
+    for slide in presentation.slides:
+        for shape in slide.shapes:
+            if hasattr(shape, "text"):
+                text_content.append(shape.text)
+    return "\n".join(text_content)
+
+
+def excel_text(data):
+    """First sheet of an Excel workbook as a text table"""
+    import pandas as pd
+    return pd.read_excel(io.BytesIO(data)).to_string(index=False)
+
+
+def image_preview(data, max_size=1024):
+    """A JPEG no larger than max_size pixels a side, for showing an uploaded photo or scan"""
+    from PIL import Image, ImageOps
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_size, max_size))
+        output = io.BytesIO()
+        image.convert("RGB").save(output, format="JPEG", quality=85)
+        return output.getvalue()
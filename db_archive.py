@@ -0,0 +1,238 @@
+import os
+import argparse
+import logging
+from datetime import datetime
+
+import config
+import db_utils
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Raw event tables that are partitioned by reporting_period (YYYYMM)
+ARCHIVED_TABLES = ["ai_portal_usage", "ai_portal_logins"]
+
+# Rows are deleted in batches so a large period does not escalate to a table lock
+DELETE_BATCH_SIZE = 5000
+
+
+def get_cutoff_period(retention_months, now=None):
+    """Return the oldest reporting_period (YYYYMM) that is kept in SQL Server"""
+    now = now or datetime.now()
+    month_index = now.year * 12 + (now.month - 1) - retention_months
+    return f"{month_index // 12:04d}{month_index % 12 + 1:02d}"
+
+
+def get_archive_path(table, reporting_period):
+    """Return the Parquet file path for an archived table partition"""
+    return os.path.join(
+        config.USAGE_ARCHIVE_DIR,
+        table,
+        f"reporting_period={reporting_period}",
+        "part-0.parquet"
+    )
+
+
+def list_archived_periods(table):
+    """List the reporting periods that have been archived for a table"""
+    table_dir = os.path.join(config.USAGE_ARCHIVE_DIR, table)
+    if not os.path.isdir(table_dir):
+        return []
+
+    periods = []
+    for name in os.listdir(table_dir):
+        if name.startswith("reporting_period=") and os.path.exists(os.path.join(table_dir, name, "part-0.parquet")):
+            periods.append(name.split("=", 1)[1])
+    return sorted(periods)
+
+
+def get_expired_periods(conn, table, cutoff_period):
+    """Return the closed reporting periods in a table that are older than the cutoff"""
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT DISTINCT reporting_period FROM {table} WHERE reporting_period < ? ORDER BY reporting_period",
+        (cutoff_period,)
+    )
+    return [row[0] for row in cursor.fetchall() if row[0]]
+
+
+def export_period(conn, table, reporting_period):
+    """
+    Write one reporting period of a table to a zstd-compressed Parquet file and return the
+    number of rows exported from SQL Server.
+
+    If the period was archived before (e.g. by a run that died while deleting it), the rows
+    still in SQL Server are merged into the existing file, so rows already deleted are kept.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT * FROM {table} WHERE reporting_period = ? ORDER BY id", (reporting_period,))
+    columns = [column[0] for column in cursor.description]
+    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    exported = len(rows)
+
+    archive_path = get_archive_path(table, reporting_period)
+    os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+
+    if os.path.exists(archive_path):
+        archived_rows = pq.read_table(archive_path).to_pylist()
+        archived_ids = {row["id"] for row in archived_rows}
+        rows = archived_rows + [row for row in rows if row["id"] not in archived_ids]
+        rows.sort(key=lambda row: row["id"])
+        logger.info(f"Merging {table} {reporting_period} into its existing archive of {len(archived_rows)} rows")
+
+    arrow_table = pa.table({
+        column: [row.get(column) for row in rows]
+        for column in columns
+    })
+
+    # Write to a temporary file first so a crash never leaves a half-written partition behind
+    temp_path = archive_path + ".tmp"
+    pq.write_table(arrow_table, temp_path, compression="zstd")
+
+    # Verify the file before it replaces anything
+    written_rows = pq.ParquetFile(temp_path).metadata.num_rows
+    if written_rows != len(rows):
+        os.remove(temp_path)
+        raise ValueError(f"Archive verification failed for {table} {reporting_period}: expected {len(rows)} rows, wrote {written_rows}")
+
+    os.replace(temp_path, archive_path)
+    return exported
+
+
+def delete_period(conn, table, reporting_period):
+    """Delete an archived reporting period from SQL Server in batches"""
+    cursor = conn.cursor()
+    deleted = 0
+    while True:
+        cursor.execute(
+            f"DELETE TOP ({DELETE_BATCH_SIZE}) FROM {table} WHERE reporting_period = ?",
+            (reporting_period,)
+        )
+        batch = cursor.rowcount
+        conn.commit()
+        deleted += max(batch, 0)
+        if batch < DELETE_BATCH_SIZE:
+            break
+    return deleted
+
+
+def run_retention(retention_months=None, dry_run=False):
+    """Move closed reporting periods older than the retention window from SQL Server to Parquet files"""
+    retention_months = config.USAGE_RETENTION_MONTHS if retention_months is None else retention_months
+    if retention_months < 1:
+        raise ValueError("retention_months must be at least 1 so the open reporting period is never archived")
+
+    cutoff_period = get_cutoff_period(retention_months)
+    summary = {}
+
+    conn = db_utils.get_db_connection()
+    if not conn:
+        logger.error("Failed to connect to database")
+        return summary
+
+    try:
+        for table in ARCHIVED_TABLES:
+            summary[table] = {}
+            for reporting_period in get_expired_periods(conn, table, cutoff_period):
+                if dry_run:
+                    logger.info(f"[dry run] Would archive {table} {reporting_period}")
+                    summary[table][reporting_period] = 0
+                    continue
+
+                exported = export_period(conn, table, reporting_period)
+                deleted = delete_period(conn, table, reporting_period)
+                summary[table][reporting_period] = exported
+
+                logger.info(f"Archived {table} {reporting_period}: {exported} rows exported, {deleted} rows deleted")
+    except Exception as e:
+        logger.error(f"Error running usage retention: {str(e)}")
+    finally:
+        conn.close()
+
+    return summary
+
+
+def load_archived_period(table, reporting_period, columns=None):
+    """Load an archived reporting period as a DataFrame, or None if it was never archived"""
+    import pandas as pd
+
+    archive_path = get_archive_path(table, reporting_period)
+    if not os.path.exists(archive_path):
+        return None
+    return pd.read_parquet(archive_path, columns=columns)
+
+
+def load_period(table, reporting_period, columns=None):
+    """Load a reporting period from the archive if present, otherwise from SQL Server"""
+    import pandas as pd
+
+    archived = load_archived_period(table, reporting_period, columns)
+    if archived is not None:
+        return archived
+
+    conn = db_utils.get_db_connection()
+    if not conn:
+        logger.error("Failed to connect to database")
+        return pd.DataFrame(columns=columns or [])
+
+    try:
+        select_list = ", ".join(columns) if columns else "*"
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {select_list} FROM {table} WHERE reporting_period = ?", (reporting_period,))
+        names = [column[0] for column in cursor.description]
+        return pd.DataFrame.from_records([tuple(row) for row in cursor.fetchall()], columns=names)
+    finally:
+        conn.close()
+
+
+def app_usage_report(reporting_period):
+    """Equivalent of sp_app_usage_report that also works for archived reporting periods"""
+    usage = load_period(
+        "ai_portal_usage",
+        reporting_period,
+        columns=["app_name", "app_category", "email", "usage_time"]
+    )
+    if usage.empty:
+        return usage
+
+    report = usage.groupby(["app_name", "app_category"]).agg(
+        total_interactions=("email", "size"),
+        unique_users=("email", "nunique"),
+        first_usage=("usage_time", "min"),
+        last_usage=("usage_time", "max"),
+    ).reset_index()
+    report["avg_interactions_per_user"] = report["total_interactions"] / report["unique_users"]
+    return report.sort_values("total_interactions", ascending=False)
+
+
+def user_stats_report(reporting_period):
+    """Equivalent of vw_user_stats for a single, possibly archived, reporting period"""
+    logins = load_period(
+        "ai_portal_logins",
+        reporting_period,
+        columns=["email", "display_name", "department", "login_time", "session_id"]
+    )
+    if logins.empty:
+        return logins
+
+    logins["login_date"] = logins["login_time"].dt.date
+    return logins.groupby(["email", "display_name"]).agg(
+        department=("department", "max"),
+        login_days=("login_date", "nunique"),
+        session_count=("session_id", "nunique"),
+        first_login=("login_time", "min"),
+        last_login=("login_time", "max"),
+    ).reset_index()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive old AI Portal usage and login periods to Parquet")
+    parser.add_argument("--months", type=int, default=None, help="Number of months to keep in SQL Server")
+    parser.add_argument("--dry-run", action="store_true", help="List the periods that would be archived")
+    args = parser.parse_args()
+
+    run_retention(args.months, dry_run=args.dry_run)
@@ -5,6 +5,8 @@ from datetime import datetime
 import logging
 import uuid
 
+import metrics
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -84,6 +86,7 @@ def ensure_tables_exist():
         logger.error(f"Error ensuring tables exist: {str(e)}")
         return False
 
+@metrics.timed("portal_db_write_seconds", "Writes to the portal database", table="ai_portal_logins")
 def log_user_login(user_data):
     """Log user login information to the 'ai_portal_logins' table"""
     try:
@@ -143,6 +146,7 @@ def log_user_login(user_data):
         logger.error(f"Error logging user login: {str(e)}")
         return False
 
+@metrics.timed("portal_db_write_seconds", "Writes to the portal database", table="ai_portal_usage")
 def log_app_usage(app_id, app_metadata=None):
     """Log application usage information to the 'ai_portal_usage' table"""
     try:
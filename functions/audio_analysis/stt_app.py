@@ -2,6 +2,13 @@ import requests
 import json 
 import streamlit as st
 import Functions
+import jobs
+import llm_fanout
+import llm_fixtures
+import llm_gateway
+import llm_router
+import llm_streaming
+import llm_telemetry
 
 def split_text(text, max_chunk_size=12000):
     """Split text into chunks of roughly equal size while preserving sentence boundaries"""
@@ -24,20 +31,18 @@ def split_text(text, max_chunk_size=12000):
     
     return chunks
 
-def cleanup_long_transcription(client, deployment, transcript):
+@llm_fixtures.recorded("cleanup_long_transcription")
+def cleanup_long_transcription(client, transcript, on_progress=None, on_warning=st.warning):
     """Handle long transcripts by processing them in chunks"""
     # Split transcript into manageable chunks
     chunks = split_text(transcript)
-    cleaned_chunks = []
     
-    # Process each chunk
-    for i, chunk in enumerate(chunks):
+    async def clean_chunk(i):
         context = ""
         if i > 0:  # Add overlap context from previous chunk
             context = f"Previous context: {chunks[i-1][-200:]}\n\n"
         
-        response = client.chat.completions.create(
-            model=deployment,
+        response = await llm_fanout.chat_completion(client, "audio_transcription", task="cleanup",
             messages=[
                 {"role": "system",
                  "content": """You are tasked with refining a chunk of transcription from an audio conversation. 
@@ -46,41 +51,47 @@ def cleanup_long_transcription(client, deployment, transcript):
                              Remove filler words and correct grammatical errors. Do not remove any important context or information when cleaning the transcript.
                              If this is a continuation chunk, ensure smooth connection with the context provided."""},
                 {"role": "user",
-                 "content": f"{context}Please clean up this transcript chunk:\n\n{chunk}"}
+                 "content": f"{context}Please clean up this transcript chunk:\n\n{chunks[i]}"}
             ],
             temperature=0.7
         )
-        cleaned_chunks.append(response.choices[0].message.content)
+        return response.choices[0].message.content
     
-    # Combine cleaned chunks
+    # The chunks only depend on the raw transcript, so they are cleaned in parallel
+    results = llm_fanout.run(range(len(chunks)), clean_chunk, on_progress=on_progress)
+    
+    # Combine cleaned chunks, keeping the raw text of any chunk that could not be cleaned
+    cleaned_chunks = []
+    for result, chunk in zip(results, chunks):
+        if not result.ok:
+            on_warning(f"Part {result.index + 1} of the transcript could not be cleaned up and is shown as transcribed.")
+        cleaned_chunks.append(result.value if result.ok else chunk)
     return "\n".join(cleaned_chunks)
 
-def process_prompt_with_transcript(client, deployment, cleaned_transcript, user_prompt):
-    """Process user prompt against the entire transcript"""
+def process_prompt_with_transcript(client, cleaned_transcript, user_prompt, on_progress=None, container=None):
+    """Process user prompt against the entire transcript, streaming the answer into container if one is given"""
     # Split transcript into chunks if needed
     chunks = split_text(cleaned_transcript)
     
     if len(chunks) == 1:
         # If transcript fits in one chunk, process directly
-        response = client.chat.completions.create(
-            model=deployment,
+        response = llm_router.chat_completion(client, "audio_transcription", task="analysis",
             messages=[
                 {"role": "system",
                  "content": "You are an AI assistant analyzing a transcript. Provide accurate responses based on the entire transcript content."},
                 {"role": "user",
                  "content": f"Here is the transcript:\n\n{cleaned_transcript}\n\nBased on this transcript, please address the following:\n{user_prompt}"}
             ],
-            temperature=0.7
+            temperature=0.7,
+            stream=container is not None
         )
+        if container is not None:
+            return llm_streaming.render(response, container)
         return response.choices[0].message.content
     else:
-        # For long transcripts, process in chunks and combine insights
-        all_insights = []
-        
-        # Process each chunk
-        for chunk in chunks:
-            response = client.chat.completions.create(
-                model=deployment,
+        # For long transcripts, process the chunks in parallel and combine insights
+        async def extract_insights(chunk):
+            response = await llm_fanout.chat_completion(client, "audio_transcription", task="analysis",
                 messages=[
                     {"role": "system",
                      "content": "You are an AI assistant analyzing a portion of a transcript. Extract relevant information related to the user's prompt."},
@@ -89,20 +100,29 @@ def process_prompt_with_transcript(client, deployment, cleaned_transcript, user_
                 ],
                 temperature=0.7
             )
-            all_insights.append(response.choices[0].message.content)
+            return response.choices[0].message.content
+        
+        results = llm_fanout.run(chunks, extract_insights, on_progress=on_progress)
+        all_insights = [result.value for result in results if result.ok]
+        if not all_insights:
+            raise results[0].error
+        if len(all_insights) < len(chunks):
+            st.warning(f"{len(chunks) - len(all_insights)} of {len(chunks)} parts of the transcript could not be analyzed; the result is based on the rest.")
         
         # Combine and summarize all insights
         combined_insights = "\n\n".join(all_insights)
-        final_response = client.chat.completions.create(
-            model=deployment,
+        final_response = llm_router.chat_completion(client, "audio_transcription", task="analysis",
             messages=[
                 {"role": "system",
                  "content": "You are an AI assistant combining and summarizing insights from multiple transcript analyses. Provide a coherent, complete response to the user's prompt."},
                 {"role": "user",
                  "content": f"Based on these collected insights:\n\n{combined_insights}\n\nProvide a comprehensive response to:\n{user_prompt}"}
             ],
-            temperature=0.7
+            temperature=0.7,
+            stream=container is not None
         )
+        if container is not None:
+            return llm_streaming.render(final_response, container)
         return final_response.choices[0].message.content
 
 
@@ -125,8 +145,9 @@ def transcribe_audio(audio_file):
     }
 
     try:
-        response = requests.post(Functions.stt_endpoint, headers=headers, files=files)
-        response.raise_for_status()  # Raise an exception for bad status codes
+        with llm_telemetry.track_call("audio_transcription", "speech-to-text", "stt"):
+            response = requests.post(Functions.stt_endpoint, headers=headers, files=files)
+            response.raise_for_status()  # Raise an exception for bad status codes
         
         # Try to parse JSON, but have a fallback for non-JSON responses
         try:
@@ -145,9 +166,27 @@ def transcribe_audio(audio_file):
             "status_code": getattr(e.response, 'status_code', None)
         }
 
+def transcription_job(job, client, audio_file):
+    """Background job: transcribe an audio file and clean up the transcript; returns (raw, cleaned)"""
+    job.progress(0.0, "Transcribing...")
+    result = transcribe_audio(audio_file)
+    if "combinedPhrases" not in result:
+        raise ValueError(f"Transcription failed: {result.get('error', 'no transcript returned')}")
+    raw_transcript = result["combinedPhrases"][0]["text"]
+
+    job.progress(0.2, "Cleaning up transcript...")
+    cleaned_transcript = cleanup_long_transcription(
+        client,
+        raw_transcript,
+        on_progress=job.progress_callback("Cleaned {done} of {total} parts", start=0.2),
+        on_warning=job.warn
+    )
+    return raw_transcript, cleaned_transcript.replace("\nSpeaker", "\n\nSpeaker")
+
+
 def cleanup_transcription(client, deployment, transcript):  
 
-    response = client.chat.completions.create(  
+    response = llm_gateway.chat_completion(client, "audio_transcription",  
         model=deployment,  
         messages=[  
             {"role": "system",
@@ -219,43 +258,49 @@ def speech_to_text(client):
             st.audio(uploaded_file, format="audio/wav")
             
             if st.button("Transcribe"):
-                with st.spinner("Transcribing..."):
-                    result = transcribe_audio(uploaded_file)
-                    raw_transcript = result["combinedPhrases"][0]["text"]
+                # Runs in the background, so using the page meanwhile does not restart it
+                st.session_state.transcription_job = jobs.submit(
+                    "transcription", transcription_job, client, (uploaded_file.name, uploaded_file.getvalue())
+                )
 
-                    # Clean up the transcription
-                    cleaned_transcript = cleanup_long_transcription(client, "gpt4omini", raw_transcript)
-                    
-                    cleaned_transcript = cleaned_transcript.replace("\nSpeaker", "\n\nSpeaker")
-                    
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        st.markdown("### <span style='color:orange'>Raw Transcription</span>", unsafe_allow_html=True)
-                        st.write(raw_transcript)
-                    
-                    with col2:
-                        st.markdown("### <span style='color:orange'>Cleaned Transcription</span>", unsafe_allow_html=True)
-                        st.write(cleaned_transcript)
+        if st.session_state.get("transcription_job"):
+            job = jobs.show_progress(st.session_state.transcription_job, "Transcribing...")
+            if job is not None:
+                del st.session_state.transcription_job
+                if job.succeeded:
+                    st.session_state.raw_transcript, st.session_state.cleaned_transcript = jobs.result(job.id)
+                    jobs.show_warnings(job)
+                else:
+                    st.error(f"Transcription {job.status}{': ' + job.error if job.error else ''}")
 
-                    # Store transcripts in session state for later use
-                    st.session_state.raw_transcript = raw_transcript
-                    st.session_state.cleaned_transcript = cleaned_transcript
+        if st.session_state.raw_transcript is not None:
+            raw_transcript = st.session_state.raw_transcript
+            cleaned_transcript = st.session_state.cleaned_transcript
 
-                    # Provide download button
-                    combined_transcript = (
-                        "### Raw Transcription ###\n\n"
-                        + raw_transcript
-                        + "\n\n### Cleaned Transcription ###\n\n"
-                        + cleaned_transcript
-                    )
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                st.markdown("### <span style='color:orange'>Raw Transcription</span>", unsafe_allow_html=True)
+                st.write(raw_transcript)
+            
+            with col2:
+                st.markdown("### <span style='color:orange'>Cleaned Transcription</span>", unsafe_allow_html=True)
+                st.write(cleaned_transcript)
 
-                    st.download_button(
-                        label="Download Transcript Results",
-                        data=combined_transcript,
-                        file_name="transcript.txt",
-                        mime="text/plain"
-                    )
+            # Provide download button
+            combined_transcript = (
+                "### Raw Transcription ###\n\n"
+                + raw_transcript
+                + "\n\n### Cleaned Transcription ###\n\n"
+                + cleaned_transcript
+            )
+
+            st.download_button(
+                label="Download Transcript Results",
+                data=combined_transcript,
+                file_name="transcript.txt",
+                mime="text/plain"
+            )
 
         # Add prompt analysis section if transcript exists
         if st.session_state.cleaned_transcript is not None:
@@ -275,15 +320,17 @@ def speech_to_text(client):
             
             if user_prompt and st.button("Analyze"):
                 with st.spinner("Analyzing transcript..."):
+                    st.markdown("### <span style='color:orange'>Analysis Result</span>", unsafe_allow_html=True)
+                    analysis_progress = st.progress(0.0, text="Analyzing transcript...")
+                    # The answer appears as it is written
                     analysis_result = process_prompt_with_transcript(
                         client, 
-                        "gpt4o", # Use a a larger model for answering questions about the transcript
                         st.session_state.cleaned_transcript,
-                        user_prompt
+                        user_prompt,
+                        on_progress=llm_fanout.progress_bar(analysis_progress, "Analyzed {done} of {total} parts"),
+                        container=st.container()
                     )
-                    
-                    st.markdown("### <span style='color:orange'>Analysis Result</span>", unsafe_allow_html=True)
-                    st.write(analysis_result)
+                    analysis_progress.empty()
                     
                     # Add download button for analysis
                     st.download_button(
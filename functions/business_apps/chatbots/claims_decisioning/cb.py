@@ -8,9 +8,17 @@ from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
 from langchain_core.prompts import MessagesPlaceholder
 from langchain_community.vectorstores import FAISS
 import re
+from functools import lru_cache
+
+import llm_fixtures
+import metrics
+import llm_gateway
+import llm_router
+import llm_telemetry
 
 # Resource api credentials in the RG:DNA-AI, Resource:claims-cdcb
 from config import CDCB_AZURE_OPENAI_KEY, CDCB_AZURE_OPENAI_ENDPOINT, CDCB_AZURE_OPENAI_EMBEDDING_ENDPOINT, VALID_USERNAME, VALID_PASSWORD
@@ -28,14 +36,21 @@ api_key = CDCB_AZURE_OPENAI_KEY
 endpoint =  CDCB_AZURE_OPENAI_ENDPOINT
 embedding_endpoint = CDCB_AZURE_OPENAI_EMBEDDING_ENDPOINT
 
-# Initialize LLM
-llm = AzureChatOpenAI(
-    openai_api_version="2024-08-01-preview",
-    azure_deployment="gpt-4o-mini",
-    azure_endpoint=endpoint,
-    api_key=api_key,
-    temperature=0.7,
-)
+# Initialize LLM (llm_router picks the deployment per question, this one unless a policy adds others)
+deployment = "gpt-4o-mini"
+
+
+@lru_cache(maxsize=None)
+def get_llm(deployment):
+    """One LangChain chat model per deployment on this resource"""
+    return AzureChatOpenAI(
+        openai_api_version="2024-08-01-preview",
+        azure_deployment=deployment,
+        azure_endpoint=endpoint,
+        api_key=api_key,
+        temperature=0.7,
+        http_client=llm_fixtures.http_client(),
+    )
 
 # Define the base directory and folder name for vectorstore
 base_directory = os.getcwd()
@@ -82,6 +97,87 @@ def format_source_documents(source_documents):
             
     return formatted_sources
 
+def get_vectorstore():
+    """The FAISS index of the chatbot's documents, loaded once per process; None if it has not been built"""
+    # Checked on every call so that an index built after startup is picked up
+    if not os.path.exists(vectorstore_path):
+        return None
+    return load_vectorstore()
+
+@lru_cache(maxsize=None)
+@metrics.timed("portal_vectorstore_load_seconds", "Loading or building a vectorstore", app="claims_decisioning_chatbot")
+def load_vectorstore():
+    """Load the FAISS index from disk"""
+    embeddings = AzureOpenAIEmbeddings(
+        azure_deployment='text-embedding-3-large',
+        api_key=api_key,
+        azure_endpoint=embedding_endpoint,
+        chunk_size=3000,
+        http_client=llm_fixtures.http_client()
+    )
+    return FAISS.load_local(
+        vectorstore_path,
+        embeddings,
+        allow_dangerous_deserialization=True
+    )
+
+# Define the prompt template
+chat_prompt = ChatPromptTemplate.from_messages([
+    ("system", """You are an AI assistant specifically trained on Claims Decisioning documentation. Your primary function is to provide accurate and helpful information about the claims decisioning process that you were trained on. Adhere to the following guidelines strictly:
+
+                1. Scope of Knowledge:
+                - Only provide information related to a claims decisioning process.
+                - Do not answer questions that are not insurance related or related to the context base.
+                - If asked about competitors, respond with: "I'm sorry, but I don't have information about other insurance companies."
+
+                2. Response Format:
+                - Always respond in English.
+                - If a question is unclear, ask for clarification before attempting to answer.
+
+                3. Information Accuracy:
+                - Only use information from the provided context or your training data.
+                - If you don't have enough information to answer a question accurately, say: "I don't have enough information to answer that question accurately. Could you please provide more details or ask about the claims decisioning process?"
+
+                Keep your answers short and to the point and do not be suggestive.
+                Do not provide context summaries unless it is requested.
+                """),
+    MessagesPlaceholder(variable_name="chat_history"),
+    ("human", "{input}"),
+    ("human", "Here's some context that might be helpful: {context}"),
+])
+
+@llm_fixtures.recorded("claims_decisioning_chatbot")
+def answer_question(prompt, messages):
+    """Answer a question from the indexed documents. messages is the conversation so far, ending with the question."""
+    chat_history = [
+        HumanMessage(content=m["content"]) if m["role"] == "user" else AIMessage(content=m["content"])
+        for m in messages[:-1]
+    ]
+
+    # Pick a deployment for this question and the conversation so far
+    route = llm_router.route("claims_decisioning_chatbot", messages, default=deployment)
+    document_chain = create_stuff_documents_chain(get_llm(route.deployment), chat_prompt)
+    retriever = get_vectorstore().as_retriever(search_kwargs={"k": 3})
+    retrieve = metrics.timed("portal_retrieval_seconds", "Vectorstore searches", app="claims_decisioning_chatbot")(
+        lambda inputs: retriever.invoke(inputs["input"])
+    )
+    retrieval_chain = create_retrieval_chain(RunnableLambda(retrieve), document_chain)
+
+    with get_openai_callback() as cb:
+        with llm_gateway.limit("claims_decisioning_chatbot", route.deployment), llm_telemetry.track_langchain("claims_decisioning_chatbot", route.deployment, cb):
+            result = retrieval_chain.invoke({
+                "input": preprocess_query(prompt),
+                "chat_history": chat_history
+            })
+
+    full_response = result["answer"]
+
+    # Add source documents
+    source_docs = result.get("context", [])
+    if source_docs:
+        full_response += format_source_documents(source_docs)
+    return full_response
+
 def check_credentials(username, password):
     """Verify the provided credentials against environment variables."""
     return username == VALID_USERNAME and password == VALID_PASSWORD
@@ -115,142 +211,79 @@ def main_app():
     user_name = st.session_state.username
     assistant_name = 'Claims Decisioning Chatbot'
     
-    with get_openai_callback() as cb:
-        try:
-            # Header section
-            col1_im, col2_im, col3_im, col4_im, col5_im = st.columns(5)
-            with col1_im:
-                st.write(' ')
-            with col2_im:
-                st.write(' ')
-            with col3_im:
-                st.image(os.path.join(base_directory, 'static', "Telesure-logo.png"), width=150 )
-            with col4_im:
-                st.write(' ')
-            with col5_im:
-                st.write(' ')
-                
-            st.markdown("<h2 style='text-align: center; color: white;'>TIH Claims Decisioning Chatbot</h2>", unsafe_allow_html=True)
+    try:
+        # Header section
+        col1_im, col2_im, col3_im, col4_im, col5_im = st.columns(5)
+        with col1_im:
+            st.write(' ')
+        with col2_im:
+            st.write(' ')
+        with col3_im:
+            st.image(os.path.join(base_directory, 'static', "Telesure-logo.png"), width=150 )
+        with col4_im:
+            st.write(' ')
+        with col5_im:
             st.write(' ')
-            st.markdown("<p style='text-align: center;'>I am your helpful AI Claims Decisioning Chatbot. Ask me any questions about Telesure products or policies.</p>", unsafe_allow_html=True)
-            
-            st.sidebar.markdown("""
-            Please note that the AI can make mistakes when responding.
             
-            If you encounter any challenges, please contact the TIH AI Center of Excellence.
-            """)
+        st.markdown("<h2 style='text-align: center; color: white;'>TIH Claims Decisioning Chatbot</h2>", unsafe_allow_html=True)
+        st.write(' ')
+        st.markdown("<p style='text-align: center;'>I am your helpful AI Claims Decisioning Chatbot. Ask me any questions about Telesure products or policies.</p>", unsafe_allow_html=True)
+        
+        st.sidebar.markdown("""
+        Please note that the AI can make mistakes when responding.
+        
+        If you encounter any challenges, please contact the TIH AI Center of Excellence.
+        """)
+        
+        # Add logout button
+        if st.sidebar.button("Logout"):
+            logout()
+        
+        # Footer for sidebar
+        st.sidebar.markdown('<div style="position: fixed; bottom: 0; width: 100%; padding-bottom: 20px;">', unsafe_allow_html=True)
+        st.sidebar.image(os.path.join(base_directory, 'static', 'Telesure-logo.png'), width=100)
+        st.sidebar.markdown('Powered by the TIH AI Center of Excellence')
+        st.sidebar.markdown('</div>', unsafe_allow_html=True)
+        
+        # Load the FAISS index
+        vectorstore = get_vectorstore()
+        if vectorstore is None:
+            st.error(f"No vectorstore found at {vectorstore_path}. Please ensure the FAISS index has been created and saved.")
+            return
+        
+        # Initialize chat history
+        if "messages" not in st.session_state:
+            st.session_state.messages = []
             
-            # Add logout button
-            if st.sidebar.button("Logout"):
-                logout()
+        # Display chat history
+        for message in st.session_state.messages:
+            with st.chat_message(message["role"], avatar=(os.path.join(base_directory, 'static', 'user.png') if message["role"] == "user" else os.path.join(base_directory, 'static', 'chatbot.png'))):
+                if message["role"] == "user":
+                    st.markdown(f"<div class='user-name' style='color: lightblue;'>{user_name}</div>", unsafe_allow_html=True)
+                else:
+                    st.markdown(f"<div class='user-name' style='color: orange;'>{assistant_name}</div>", unsafe_allow_html=True)
+                st.write(' ')
+                st.markdown(message["content"])
+                
+        # Handle new messages
+        if prompt := st.chat_input("Ask me something..."):
+            st.session_state.messages.append({"role": "user", "content": prompt})
+            with st.chat_message("user", avatar=os.path.join(base_directory, 'static', 'user.png')):
+                st.markdown(prompt)
             
-            # Footer for sidebar
-            st.sidebar.markdown('<div style="position: fixed; bottom: 0; width: 100%; padding-bottom: 20px;">', unsafe_allow_html=True)
-            st.sidebar.image(os.path.join(base_directory, 'static', 'Telesure-logo.png'), width=100)
-            st.sidebar.markdown('Powered by the TIH AI Center of Excellence')
-            st.sidebar.markdown('</div>', unsafe_allow_html=True)
+            # Generate response
+            full_response = answer_question(prompt, st.session_state.messages)
             
-            # Load FAISS vectorstore
-            load_path = vectorstore_path
-            embeddings = AzureOpenAIEmbeddings(
-                azure_deployment='text-embedding-3-large',
-                api_key=api_key,
-                azure_endpoint=embedding_endpoint,
-                chunk_size=3000
-            )
+            # Display response
+            with st.chat_message("assistant", avatar=os.path.join(base_directory, 'static', "chatbot.png")):
+                message_placeholder = st.empty()
+                message_placeholder.markdown(full_response)
             
-            # Load the FAISS index
-            if os.path.exists(load_path):
-                vectorstore = FAISS.load_local(
-                    load_path,
-                    embeddings,
-                    allow_dangerous_deserialization=True
-                )
-            else:
-                st.error(f"No vectorstore found at {load_path}. Please ensure the FAISS index has been created and saved.")
-                return
+            st.session_state.messages.append({"role": "assistant", "content": full_response})
             
-            # Define the prompt template
-            prompt = ChatPromptTemplate.from_messages([
-                ("system", """You are an AI assistant specifically trained on Claims Decisioning documentation. Your primary function is to provide accurate and helpful information about the claims decisioning process that you were trained on. Adhere to the following guidelines strictly:
-
-                1. Scope of Knowledge:
-                - Only provide information related to a claims decisioning process.
-                - Do not answer questions that are not insurance related or related to the context base.
-                - If asked about competitors, respond with: "I'm sorry, but I don't have information about other insurance companies."
-
-                2. Response Format:
-                - Always respond in English.
-                - If a question is unclear, ask for clarification before attempting to answer.
-
-                3. Information Accuracy:
-                - Only use information from the provided context or your training data.
-                - If you don't have enough information to answer a question accurately, say: "I don't have enough information to answer that question accurately. Could you please provide more details or ask about the claims decisioning process?"
-
-                Keep your answers short and to the point and do not be suggestive.
-                Do not provide context summaries unless it is requested.
-                """),
-                MessagesPlaceholder(variable_name="chat_history"),
-                ("human", "{input}"),
-                ("human", "Here's some context that might be helpful: {context}"),
-            ])
-        
-            # Set up the retriever and chains
-            retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
-            document_chain = create_stuff_documents_chain(llm, prompt)
-            retrieval_chain = create_retrieval_chain(retriever, document_chain)
-            
-            # Initialize chat history
-            if "messages" not in st.session_state:
-                st.session_state.messages = []
-                
-            # Display chat history
-            for message in st.session_state.messages:
-                with st.chat_message(message["role"], avatar=(os.path.join(base_directory, 'static', 'user.png') if message["role"] == "user" else os.path.join(base_directory, 'static', 'chatbot.png'))):
-                    if message["role"] == "user":
-                        st.markdown(f"<div class='user-name' style='color: lightblue;'>{user_name}</div>", unsafe_allow_html=True)
-                    else:
-                        st.markdown(f"<div class='user-name' style='color: orange;'>{assistant_name}</div>", unsafe_allow_html=True)
-                    st.write(' ')
-                    st.markdown(message["content"])
-                    
-            # Handle new messages
-            if prompt := st.chat_input("Ask me something..."):
-                processed_prompt = preprocess_query(prompt)
-                
-                st.session_state.messages.append({"role": "user", "content": prompt})
-                with st.chat_message("user", avatar=os.path.join(base_directory, 'static', 'user.png')):
-                    st.markdown(prompt)
-                
-                chat_history = [
-                    HumanMessage(content=m["content"]) if m["role"] == "user" else AIMessage(content=m["content"])
-                    for m in st.session_state.messages[:-1]
-                ]
-                
-                # Generate response
-                result = retrieval_chain.invoke({
-                    "input": processed_prompt,
-                    "chat_history": chat_history
-                })
-                
-                full_response = result["answer"]
-                
-                # Add source documents
-                source_docs = result.get("context", [])
-                if source_docs:
-                    formatted_sources = format_source_documents(source_docs)
-                    full_response += formatted_sources
-                
-                # Display response
-                with st.chat_message("assistant", avatar=os.path.join(base_directory, 'static', "chatbot.png")):
-                    message_placeholder = st.empty()
-                    message_placeholder.markdown(full_response)
-                
-                st.session_state.messages.append({"role": "assistant", "content": full_response})
-                
-        except Exception as e:
-            logger.error(f"Error in main: {str(e)}")
-            st.error("An error occurred. Please try again later.")
+    except Exception as e:
+        logger.error(f"Error in main: {str(e)}")
+        st.error("An error occurred. Please try again later.")
 
 def claims_cb():
     """Main function to handle authentication and app flow."""
@@ -1,17 +1,21 @@
 import streamlit as st
 import os
-import openai
 import pandas as pd
 import json
 from datetime import datetime
 import io
 import uuid
 from typing import Dict, List, Optional
+from pydantic import BaseModel, ConfigDict
 from dataclasses import dataclass
 import sqlite3
 from pathlib import Path
 import logging
 
+import Functions
+import jobs
+import llm_structured
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -24,12 +28,11 @@ class AzureOpenAIConfig:
         self.api_version = "2024-02-15-preview"
         
     def initialize_client(self):
-        client = openai.AzureOpenAI(
-            api_key=self.api_key,
+        return Functions.get_client(
             api_version=self.api_version,
-            azure_endpoint=self.api_base
+            azure_endpoint=self.api_base,
+            azure_api_key=self.api_key
         )
-        return client
 
 @dataclass
 class TestSuite:
@@ -145,11 +148,30 @@ class DatabaseManager:
             logger.error(f"Error creating tables: {str(e)}")
             raise
 
+class TestScenario(BaseModel):
+    # The model may answer numbers (e.g. an estimated duration of 30) where text is expected
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+    scenario_id: str
+    title: str
+    preconditions: List[str]
+    steps: List[str]
+    expected_results: List[str]
+    test_data: List[str]
+    priority: str
+    complexity: str
+    estimated_duration: str
+    requirements_covered: List[str]
+    tags: List[str]
+
+class TestScenarioSet(BaseModel):
+    scenarios: List[TestScenario]
+
 class TestScenarioGenerator:
     def __init__(self, client):
         self.client = client
         
-    def generate_scenarios(self, user_story, test_type, complexity, requirements, brd_content=None):
+    def generate_scenarios(self, user_story, test_type, complexity, requirements, brd_content=None, container=None):
         system_prompt = """You are a test scenario generator that creates detailed test scenarios in JSON format.
         Always ensure your response is valid JSON and follows the exact structure provided."""
         
@@ -187,32 +209,30 @@ The JSON must follow this exact structure:
 }}"""
         
         try:
-            response = self.client.chat.completions.create(
-                model="gpt4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.7,
-                response_format={ "type": "json_object" }
-            )
-            
-            response_content = response.choices[0].message.content
-            
-            try:
-                scenarios = json.loads(response_content)
-                if not isinstance(scenarios, dict) or "scenarios" not in scenarios:
-                    raise ValueError("Invalid JSON structure: missing 'scenarios' key")
-                return scenarios
-            except json.JSONDecodeError as e:
-                st.error(f"Invalid JSON response from API: {str(e)}")
-                st.code(response_content)
-                raise ValueError(f"Invalid JSON response: {str(e)}")
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ]
+            # With a container the JSON is shown as it is generated, then replaced by the scenarios
+            if container is not None:
+                scenarios = llm_structured.stream_complete(self.client, "test_case_generator", TestScenarioSet, container,
+                    model="gpt4o", messages=messages, temperature=0.7
+                )
+            else:
+                scenarios = llm_structured.complete(self.client, "test_case_generator", TestScenarioSet,
+                    model="gpt4o", messages=messages, temperature=0.7
+                )
+            return scenarios.model_dump()
                 
         except Exception as e:
-            st.error(f"Error calling Azure OpenAI API: {str(e)}")
+            # Runs on a job worker thread, where st.error shows nothing; the app shows the job's error
+            logger.error(f"Error calling Azure OpenAI API: {str(e)}")
             raise
 
+def scenarios_job(job, scenario_generator, **kwargs):
+    """Background job: generate test scenarios, previewing the JSON as it is written"""
+    return scenario_generator.generate_scenarios(container=job.preview_container(), **kwargs)
+
 class TestScenarioManager:
     def __init__(self, db_manager: DatabaseManager):
         self.db = db_manager
@@ -484,71 +504,82 @@ def show_generator_page(scenario_generator, test_manager):
         
         if st.button("Generate Test Scenarios", type="primary"):
             if user_story:
-                with st.spinner("Generating test scenarios..."):
-                    try:
-                        scenarios = scenario_generator.generate_scenarios(
-                            user_story=user_story,
-                            test_type=test_type,
-                            complexity=complexity,
-                            requirements=requirements,
-                            brd_content=brd_content if brd_content.strip() else None
-                        )
-                        
-                        # Filter scenarios based on priority if needed
-                        if priority_filter:
-                            scenarios['scenarios'] = [
-                                s for s in scenarios['scenarios'] 
-                                if s['priority'] in priority_filter
-                            ]
-                        
-                        # Store scenarios in session state
-                        st.session_state.scenarios = scenarios
-                        st.session_state.generation_metadata = {
-                            'user_story': user_story,
-                            'brd_content': brd_content,
-                            'requirements': requirements,
-                            'test_type': test_type,
-                            'complexity': complexity,
-                            'generated_at': datetime.now().isoformat()
-                        }
-                        
-                        st.success("Test scenarios generated successfully!")
-                        
-                        # Display scenarios in expandable sections
-                        for scenario in scenarios['scenarios']:
-                            with st.expander(f"📝 {scenario['title']}"):
-                                col_left, col_right = st.columns([3, 1])
-                                with col_left:
-                                    st.markdown(f"**ID:** {scenario['scenario_id']}")
-                                with col_right:
-                                    st.markdown(f"**Priority:** {scenario['priority']}")
-                                    st.markdown(f"**Duration:** {scenario['estimated_duration']}")
-                                
-                                st.markdown("### Preconditions")
-                                for pre in scenario['preconditions']:
-                                    st.markdown(f"- {pre}")
-                                
-                                st.markdown("### Steps")
-                                for idx, step in enumerate(scenario['steps'], 1):
-                                    st.markdown(f"{idx}. {step}")
-                                
-                                st.markdown("### Expected Results")
-                                for result in scenario['expected_results']:
-                                    st.markdown(f"- {result}")
-                                
-                                st.markdown("### Test Data")
-                                for data in scenario['test_data']:
-                                    st.markdown(f"- {data}")
-                                
-                                if 'tags' in scenario:
-                                    st.markdown("### Tags")
-                                    st.markdown(", ".join(scenario['tags']))
-                    
-                    except Exception as e:
-                        st.error(f"Error generating scenarios: {str(e)}")
-                        st.error("Please try again or contact support if the error persists.")
+                # Runs in the background, so using the page meanwhile does not restart it
+                st.session_state.scenario_job = jobs.submit(
+                    "test_scenarios", scenarios_job, scenario_generator,
+                    user_story=user_story,
+                    test_type=test_type,
+                    complexity=complexity,
+                    requirements=requirements,
+                    brd_content=brd_content if brd_content.strip() else None
+                )
             else:
                 st.warning("Please enter a user story before generating scenarios.")
+
+        if st.session_state.get("scenario_job"):
+            # The JSON is previewed while it is generated, then replaced by the scenarios
+            job = jobs.show_progress(st.session_state.scenario_job, "Generating test scenarios...")
+            if job is not None:
+                del st.session_state.scenario_job
+                try:
+                    if not job.succeeded:
+                        raise RuntimeError(job.error or f"generation {job.status}")
+                    scenarios = jobs.result(job.id)
+
+                    # Filter scenarios based on priority if needed
+                    if priority_filter:
+                        scenarios['scenarios'] = [
+                            s for s in scenarios['scenarios'] 
+                            if s['priority'] in priority_filter
+                        ]
+
+                    # Store scenarios in session state
+                    st.session_state.scenarios = scenarios
+                    st.session_state.generation_metadata = {
+                        'user_story': user_story,
+                        'brd_content': brd_content,
+                        'requirements': requirements,
+                        'test_type': test_type,
+                        'complexity': complexity,
+                        'generated_at': datetime.now().isoformat()
+                    }
+
+                    st.success("Test scenarios generated successfully!")
+
+                    # Display scenarios in expandable sections
+                    for scenario in scenarios['scenarios']:
+                        with st.expander(f"📝 {scenario['title']}"):
+                            col_left, col_right = st.columns([3, 1])
+                            with col_left:
+                                st.markdown(f"**ID:** {scenario['scenario_id']}")
+                            with col_right:
+                                st.markdown(f"**Priority:** {scenario['priority']}")
+                                st.markdown(f"**Duration:** {scenario['estimated_duration']}")
+
+                            st.markdown("### Preconditions")
+                            for pre in scenario['preconditions']:
+                                st.markdown(f"- {pre}")
+
+                            st.markdown("### Steps")
+                            for idx, step in enumerate(scenario['steps'], 1):
+                                st.markdown(f"{idx}. {step}")
+
+                            st.markdown("### Expected Results")
+                            for result in scenario['expected_results']:
+                                st.markdown(f"- {result}")
+
+                            st.markdown("### Test Data")
+                            for data in scenario['test_data']:
+                                st.markdown(f"- {data}")
+
+                            if 'tags' in scenario:
+                                st.markdown("### Tags")
+                                st.markdown(", ".join(scenario['tags']))
+                
+                except Exception as e:
+                    st.error(f"Error generating scenarios: {str(e)}")
+                    st.error("Please try again or contact support if the error persists.")
+
     
     with col2:
         if 'scenarios' in st.session_state:
@@ -4,13 +4,17 @@ import mimetypes
 from PIL import Image
 import io
 
+import llm_budget
+import llm_gateway
+import session_memory
+
 def get_image_mime_type(file):
     """Determine the MIME type of an image file."""
     return mimetypes.guess_type(file.name)[0] or "application/octet-stream"
 
-def encode_image(image_file):
-    """Encode image file to base64."""
-    return base64.b64encode(image_file.getvalue()).decode('utf-8')
+def encode_image(image_data):
+    """Encode image bytes to base64."""
+    return base64.b64encode(image_data).decode('utf-8')
 
 def extract_text_from_content(content):
     """Extract plain text from content structure."""
@@ -89,11 +93,11 @@ def chatgpt(client):
                     file_type = file.type
                     if file_type.startswith('image/'):
                         try:
-                            image_base64 = encode_image(file)
+                            # Large images are kept on disk until the message is sent
                             st.session_state.uploaded_files_content.append({
                                 "filename": file.name,
                                 "type": "image",
-                                "content": image_base64,
+                                "content": session_memory.spill(file.getvalue()),
                                 "mime_type": get_image_mime_type(file)
                             })
                         except Exception as e:
@@ -106,7 +110,7 @@ def chatgpt(client):
                             st.session_state.uploaded_files_content.append({
                                 "filename": file.name,
                                 "type": "text",
-                                "content": file_content
+                                "content": session_memory.spill(file_content)
                             })
                         except Exception as e:
                             st.error(f"Error processing file {file.name}: {str(e)}")
@@ -175,10 +179,14 @@ def chatgpt(client):
         # Add any images from uploaded files
         for file in st.session_state.uploaded_files_content:
             if file["type"] == "image":
+                image_data = session_memory.load(file["content"])
+                if image_data is None:
+                    st.warning(f"{file['filename']} has expired, please upload it again")
+                    continue
                 api_message_content.append({
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:{file['mime_type']};base64,{file['content']}"
+                        "url": f"data:{file['mime_type']};base64,{encode_image(image_data)}"
                     }
                 })
         
@@ -188,13 +196,20 @@ def chatgpt(client):
             "text": prompt
         })
         
-        # Add text file contents to the prompt
-        for file in st.session_state.uploaded_files_content:
-            if file["type"] == "text":
-                api_message_content.append({
-                    "type": "text",
-                    "text": f"\nContent of {file['filename']}:\n{file['content']}"
-                })
+        # Add text file contents to the prompt; large files contribute the passages most
+        # relevant to the question, sharing the app's token budget
+        text_files = [file for file in st.session_state.uploaded_files_content if file["type"] == "text"]
+        for file in text_files:
+            file_content = session_memory.load(file['content'])
+            if file_content is None:
+                st.warning(f"{file['filename']} has expired, please upload it again")
+                continue
+            file_content = llm_budget.fit("chatgpt_general", file_content, query=prompt, deployment=deployment,
+                max_tokens=llm_budget.get_budget("chatgpt_general")["max_input_tokens"] // len(text_files))
+            api_message_content.append({
+                "type": "text",
+                "text": f"\nContent of {file['filename']}:\n{file_content}"
+            })
 
         # Store and display user message
         st.session_state.chat_messages.append({"role": "user", "content": user_message_content})
@@ -235,7 +250,7 @@ def chatgpt(client):
             })
 
             # Make API call
-            stream = client.chat.completions.create(
+            stream = llm_gateway.chat_completion(client, "chatgpt_general",
                 model=deployment,
                 messages=messages,
                 stream=True,
@@ -1,15 +1,13 @@
 import streamlit as st
-from openai import AzureOpenAI
 import os
 
+import Functions
+import llm_gateway
+import llm_streaming
 from config import api_key, endpoint    
 
-# Initialize Azure OpenAI client
-client = AzureOpenAI(
-    api_key=api_key,
-    api_version="2024-02-15-preview",
-    azure_endpoint=endpoint 
-)
+# Shared Azure OpenAI client (built once per process, not on every rerun)
+client = Functions.get_client(api_version="2024-02-15-preview", azure_endpoint=endpoint, azure_api_key=api_key)
 
 # Define pillar contexts
 PILLAR_CONTEXTS = {
@@ -42,18 +40,11 @@ PILLAR_CONTEXTS = {
     """
 }
 
-# Initialize session state
-if 'department' not in st.session_state:
-    st.session_state.department = ""
-if 'additional_context' not in st.session_state:
-    st.session_state.additional_context = ""
-if 'employee_role' not in st.session_state:
-    st.session_state.employee_role = ""
-
-def convert_to_smart_goal(client, simple_goal: str, timeframe: str, pillar: str, department: str, employee_role: str = "", additional_context: str = "") -> str:
+def convert_to_smart_goal(client, simple_goal: str, timeframe: str, pillar: str, department: str, employee_role: str = "", additional_context: str = "", container=None) -> str:
     """
     Convert a simple goal to a SMART goal using Azure OpenAI GPT-4
     Returns a paragraph of text representing the SMART goal
+    With a Streamlit container the goal is streamed into it as it is written
     """
     # Get pillar-specific context
     pillar_context = PILLAR_CONTEXTS[pillar.lower()]
@@ -110,21 +101,32 @@ def convert_to_smart_goal(client, simple_goal: str, timeframe: str, pillar: str,
     """
     
     try:
-        response = client.chat.completions.create(
+        response = llm_gateway.chat_completion(client, "chatgpt_smart_goal",
             model="gpt4omini",
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt}
             ],
-            temperature=0.3
+            temperature=0.3,
+            stream=container is not None
         )
         
+        if container is not None:
+            return llm_streaming.render(response, container).strip()
         return response.choices[0].message.content.strip()
     except Exception as e:
         st.error(f"Error in API call: {str(e)}")
         return None
 
 def smart_goal_creator(client):
+    # Initialize session state (on every run: the module is imported once for all sessions)
+    if 'department' not in st.session_state:
+        st.session_state.department = ""
+    if 'additional_context' not in st.session_state:
+        st.session_state.additional_context = ""
+    if 'employee_role' not in st.session_state:
+        st.session_state.employee_role = ""
+
     # Custom CSS
     st.markdown("""
         <style>
@@ -261,6 +263,9 @@ def smart_goal_creator(client):
             st.session_state.additional_context = additional_context
             st.session_state.employee_role = employee_role
             
+            # Placed above the goal, which is streamed in below it
+            status = st.empty()
+            st.markdown("### Your SMART Goal:")
             with st.spinner("Creating your SMART goal..."):
                 smart_goal = convert_to_smart_goal(
                     client,
@@ -269,13 +274,10 @@ def smart_goal_creator(client):
                     pillar,
                     department,
                     employee_role,
-                    additional_context
+                    additional_context,
+                    container=st.container()
                 )
                 
                 if smart_goal:
                     # Success message
-                    st.success("Your SMART goal has been generated!")
-                    
-                    # Display the SMART goal in a nice container
-                    st.markdown("### Your SMART Goal:")
-                    st.markdown(smart_goal)
\ No newline at end of file
+                    status.success("Your SMART goal has been generated!")
\ No newline at end of file
@@ -3,10 +3,13 @@ import requests
 import msal
 import json
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
-from openai import AzureOpenAI
+from typing import Dict, List, Literal, Optional
+from pydantic import BaseModel
 import pytz
 
+import Functions
+import llm_structured
+
 # Configuration and Settings
 st.set_page_config(page_title="Microsoft Graph Chatbot", layout="wide")
 
@@ -18,12 +21,8 @@ from config import (
     endpoint,
 )
 
-# Initialize Azure OpenAI client
-client = AzureOpenAI(
-    api_key=api_key,
-    api_version="2024-02-15-preview",
-    azure_endpoint=endpoint
-)
+# Shared Azure OpenAI client (built once per process, not on every rerun)
+client = Functions.get_client(api_version="2024-02-15-preview", azure_endpoint=endpoint, azure_api_key=api_key)
 
 # Initialize session state
 if 'access_token' not in st.session_state:
@@ -233,6 +232,10 @@ def find_available_time_slot(person_name: str, token: str) -> Dict:
         "error": f"No available time slots found in the next week for {contact['displayName']}"
     }
 
+class QueryIntent(BaseModel):
+    intent: Literal["latest_email", "available_time", "unknown"]
+    person_name: str
+
 def process_user_query(query: str, token: str) -> Dict:
     """Process natural language query with improved error handling and debugging."""
     system_message = """You are a helpful assistant that interprets natural language queries about emails and calendar events.
@@ -264,27 +267,24 @@ def process_user_query(query: str, token: str) -> Dict:
     ]
     
     try:
-        response = client.chat.completions.create(
+        parsed_intent = llm_structured.complete(client, "copilot", QueryIntent,
             model="gpt4o",
             messages=messages,
-            temperature=0,
-            response_format={ "type": "json_object" }
+            temperature=0
         )
         
-        parsed_intent = json.loads(response.choices[0].message.content)
-        
-        if parsed_intent["intent"] == "latest_email":
-            return get_latest_email_from_person(parsed_intent["person_name"], token)
-        elif parsed_intent["intent"] == "available_time":
-            return find_available_time_slot(parsed_intent["person_name"], token)
+        if parsed_intent.intent == "latest_email":
+            return get_latest_email_from_person(parsed_intent.person_name, token)
+        elif parsed_intent.intent == "available_time":
+            return find_available_time_slot(parsed_intent.person_name, token)
         else:
             return {
                 "error": "I couldn't understand what you're asking for. Try asking about latest emails or finding available meeting times."
             }
             
-    except json.JSONDecodeError as e:
+    except llm_structured.StructuredOutputError as e:
         return {
-            "error": f"Failed to parse AI response. Raw response: {response.choices[0].message.content if 'response' in locals() else 'No response'}"
+            "error": f"Failed to parse AI response: {str(e)}"
         }
     except Exception as e:
         return {"error": f"Error processing query: {str(e)}"}
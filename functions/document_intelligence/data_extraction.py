@@ -1,39 +1,34 @@
 import streamlit as st
-from openai import AzureOpenAI
-import fitz  # PyMuPDF
-import docx
-import io
 import json
-from typing import List, Dict
+from typing import List, Dict, Optional, Union
 import os
+from pydantic import Field, create_model
+
+import Functions
+import cpu_pool
+import cpu_tasks
+import llm_budget
+import llm_fixtures
+import llm_structured
 
 #from config import api_key, endpoint
 
 api_key = os.environ.get("AZURE_OPENAI_KEY")
 endpoint  = os.environ.get("AZURE_OPENAI_ENDPOINT")
 
-# Initialize Azure OpenAI client
+# Shared Azure OpenAI client (one connection pool per process)
 def init_azure_openai_client():
-    client = AzureOpenAI(
+    return Functions.get_client(
+        api_version="2024-02-15-preview",
         azure_endpoint=os.getenv('AZURE_OPENAI_ENDPOINT'),
-        api_key=os.getenv('AZURE_OPENAI_KEY'),
-        api_version="2024-02-15-preview"
+        azure_api_key=os.getenv('AZURE_OPENAI_KEY')
     )
-    return client
 
 def extract_text_from_pdf(file_bytes):
-    with fitz.open(stream=file_bytes.read(), filetype="pdf") as doc:
-        text = ""
-        for page in doc:
-            text += page.get_text()
-    return text
+    return cpu_pool.run(cpu_tasks.pdf_text, file_bytes.read(), separator="")
 
 def extract_text_from_docx(file_bytes):
-    doc = docx.Document(io.BytesIO(file_bytes.read()))
-    text = ""
-    for paragraph in doc.paragraphs:
-        text += paragraph.text + "\n"
-    return text
+    return cpu_pool.run(cpu_tasks.docx_text, file_bytes.read())
 
 def generate_extraction_prompt(text: str, fields: List[str]) -> str:
     fields_str = "\n".join([f"- {field}" for field in fields])
@@ -50,22 +45,33 @@ Document text:
 Provide only the JSON output, nothing else."""
     return prompt
 
+def extraction_model(fields: List[str]):
+    """
+    A model with one nullable value per requested field, keyed by the field name. Values may be
+    text, numbers or booleans, as the model returns amounts and counts as JSON numbers.
+    """
+    return create_model(
+        "ExtractedFields",
+        **{f"field_{i}": (Optional[Union[str, int, float, bool]], Field(alias=field)) for i, field in enumerate(fields)}
+    )
+
+@llm_fixtures.recorded("extract_data")
 def extract_data(client, text: str, fields: List[str]) -> Dict:
+    # Long documents are cut down to the passages that mention the requested fields
+    text = llm_budget.fit("doc_extraction", text, query=" ".join(fields), deployment="gpt4omini")
     prompt = generate_extraction_prompt(text, fields)
     
-    response = client.chat.completions.create(
-        model="gpt4omini",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant that extracts specific fields from documents and returns them in JSON format."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0,
-        response_format={"type": "json_object"}
-    )
-    
     try:
-        return json.loads(response.choices[0].message.content)
-    except json.JSONDecodeError:
+        extracted = llm_structured.complete(client, "doc_extraction", extraction_model(fields), cache=True,
+            model="gpt4omini",
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant that extracts specific fields from documents and returns them in JSON format."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0
+        )
+        return extracted.model_dump(by_alias=True)
+    except llm_structured.StructuredOutputError:
         return {"error": "Failed to parse JSON response"}
 
 def data_extraction(client):
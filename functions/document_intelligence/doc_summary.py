@@ -3,6 +3,18 @@ import pptx
 import docx
 import openpyxl
 import Functions
+import cpu_pool
+import cpu_tasks
+import jobs
+import llm_budget
+import llm_fanout
+import llm_fixtures
+import llm_gateway
+import llm_router
+import llm_streaming
+import llm_structured
+import llm_telemetry
+import metrics
 
 
 from langchain_community.vectorstores import FAISS                  # --> (U002) For creating the vectorstore of the embeddings (text -> embed to vector -> store in vectorstore)  
@@ -19,6 +31,7 @@ from langchain.prompts import PromptTemplate
 
 
 @st.cache_resource
+@metrics.timed("portal_vectorstore_load_seconds", "Loading or building a vectorstore", app="doc_summary")
 def get_vectorstore(text_content):
     # Create embeddings
     embeddings = AzureOpenAIEmbeddings(
@@ -41,19 +54,27 @@ def get_vectorstore(text_content):
 
 
 def extract_text_from_ppt(file): 
-    from pptx import Presentation 
-      
-    presentation = Presentation(file)  
-    text_content = []  
-    
-    for slide in presentation.slides:  
-        for shape in slide.shapes:  
-            if hasattr(shape, "text"):  
-                text_content.append(shape.text)  
-    return "\n".join(text_content)  
+    return cpu_pool.run(cpu_tasks.pptx_text, file.getvalue())
+
+
+async def summarize_part(client, text):
+    """Condense one part of a long document for the final summary"""
+    response = await llm_fanout.chat_completion(client, "doc_summary", task="map", output_tokens=1500,
+        messages=[
+            {"role": "system",
+             "content": "You condense one part of a longer document so it can be summarised as a whole later. "
+                        "Keep every key point, finding, figure, decision and action item, and keep page, slide and "
+                        "section headings. Leave out repetition and filler. Reply with the condensed text only."},
+            {"role": "user", "content": text}
+        ],
+        temperature=0
+    )
+    return response.choices[0].message.content
 
 
-def summarize_text(client, deployment, temperature, text, summary_length, summary_type):  
+@llm_fixtures.recorded("summarize_text")
+def summarize_text(client, temperature, text, summary_length, summary_type, container=None, on_progress=None):  
+    """Summarize text; with a Streamlit container the summary is streamed into it as it is written"""
     
     if summary_length =="Short":
         number_words = 250
@@ -64,8 +85,11 @@ def summarize_text(client, deployment, temperature, text, summary_length, summar
     else:
         number_words = 5000
     
-    response = client.chat.completions.create(  
-        model=deployment,  
+    # Long documents are summarised part by part first, so the final summary sees all of them
+    text = llm_budget.fit("doc_summary", text, worker=lambda part: summarize_part(client, part), on_progress=on_progress)
+
+    # Roughly 4 tokens for every 3 words of the requested summary
+    response = llm_router.chat_completion(client, "doc_summary", output_tokens=number_words * 4 // 3,
         messages=[  
             {"role": "system",
              "content": f"""You are an AI assistant designed to summarize documents. Your goal is to distill the information into clear summaries that highlight key points, actionable insights, and essential data.
@@ -90,118 +114,122 @@ def summarize_text(client, deployment, temperature, text, summary_length, summar
              "content": f"Please summarize the following text:\n\n{text}"
             }  
         ],
-        temperature=temperature
+        temperature=temperature,
+        stream=container is not None
     )  
+    if container is not None:
+        return llm_streaming.render(response, container)
     return response.choices[0].message.content
 
 
+def summary_job(job, client, temperature, text, summary_length, summary_type):
+    """Background job: summarize a document too long for one prompt"""
+    job.progress(0.0, "Summarizing the document part by part...")
+    summary = summarize_text(client, temperature, text, summary_length, summary_type,
+                             on_progress=job.progress_callback("Summarized {done} of {total} parts", end=0.9))
+    job.progress(1.0, "Summary complete")
+    return summary
+
+
+def show_pptx_download(client, summary):
+    with st.spinner("Preparing PowerPoint download..."):
+        pptx_buffer = download_as_pptx(client, summary)
+        
+        st.download_button(
+            label="📥 Download as PowerPoint",
+            data=pptx_buffer.getvalue(),
+            file_name="summary_presentation.pptx",
+            mime="application/vnd.openxmlformats-officedocument.presentationml.presentation",
+            key="download_pptx"
+        )
+
+
 def extract_text_from_docx(file):
-    import docx
-    doc = docx.Document(file)
-    text = []
-    for paragraph in doc.paragraphs:
-        text.append(paragraph.text)
-    return "\n".join(text)
+    return cpu_pool.run(cpu_tasks.docx_text, file.getvalue())
 
 def extract_text_from_pdf(file):
-    import fitz
-    doc = fitz.open(stream=file.read(), filetype="pdf")
-    text = []
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        text.append(page.get_text())
-    return "\n".join(text)
+    return cpu_pool.run(cpu_tasks.pdf_text, file.getvalue())
 
 def extract_text_from_excel(file):
-    import pandas as pd
-    df = pd.read_excel(file)
-    text = df.to_string(index=False)
-    return text
+    return cpu_pool.run(cpu_tasks.excel_text, file.getvalue())
 
 from pptx import Presentation
 from pptx.util import Inches, Pt
 from pptx.enum.text import PP_ALIGN
 from pptx.dml.color import RGBColor
 import io
-import json
+from typing import List
+from pydantic import BaseModel
+
+
+class TitleSlide(BaseModel):
+    title: str
+    subtitle: str
+
+
+class PresentationSection(BaseModel):
+    title: str
+    points: List[str]
+
+
+class PresentationContent(BaseModel):
+    title_slide: TitleSlide
+    agenda: List[str]
+    sections: List[PresentationSection]
+    key_takeaways: List[str]
 
 
 def optimize_for_presentation(client, summary):
     """Optimize the summary content for presentation format using LLM"""
-    response = client.chat.completions.create(
-        model="gpt4omini",
-        messages=[
-            {"role": "system", 
-             "content": """You are an expert at converting document summaries into presentation-ready content.
-                          You must return valid JSON following this exact structure:
-                          {
-                              "title_slide": {
-                                  "title": "Document Summary",
-                                  "subtitle": "Key Points and Insights"
-                              },
-                              "agenda": ["Introduction", "Key Findings", "Recommendations"],
-                              "sections": [
-                                  {
-                                      "title": "Section Title",
-                                      "points": ["Point 1", "Point 2", "Point 3"]
-                                  }
-                              ],
-                              "key_takeaways": ["Takeaway 1", "Takeaway 2", "Takeaway 3"]
-                          }
-                          
-                          Guidelines:
-                          - Break content into 3-7 points per section
-                          - Use active voice and clear language
-                          - Group related points together
-                          - Do not include bullet points or dashes in the text
-                          - Ensure all text is concise and presentation-friendly"""},
-            {"role": "user",
-             "content": f"Convert this summary into presentation-ready content, returning only the JSON structure:\n\n{summary}"}
-        ],
-        temperature=0.7
-    )
-    
     try:
-        content = json.loads(response.choices[0].message.content)
-    except json.JSONDecodeError:
-        try:
-            json_str = response.choices[0].message.content
-            start = json_str.find('{')
-            end = json_str.rfind('}') + 1
-            if start != -1 and end != 0:
-                content = json.loads(json_str[start:end])
-            else:
-                content = {
-                    "title_slide": {
-                        "title": "Document Summary",
-                        "subtitle": "Key Points and Insights"
-                    },
-                    "agenda": ["Key Points", "Details", "Conclusion"],
-                    "sections": [
-                        {
-                            "title": "Key Points",
-                            "points": [point.lstrip('•- ').strip() for point in summary.split('\n')[:5]]
-                        }
-                    ],
-                    "key_takeaways": [point.lstrip('•- ').strip() for point in summary.split('\n')[-3:]]
+        content = llm_structured.complete(client, "doc_summary", PresentationContent, cache=True,
+            model="gpt4omini",
+            messages=[
+                {"role": "system", 
+                 "content": """You are an expert at converting document summaries into presentation-ready content.
+                              You must return valid JSON following this exact structure:
+                              {
+                                  "title_slide": {
+                                      "title": "Document Summary",
+                                      "subtitle": "Key Points and Insights"
+                                  },
+                                  "agenda": ["Introduction", "Key Findings", "Recommendations"],
+                                  "sections": [
+                                      {
+                                          "title": "Section Title",
+                                          "points": ["Point 1", "Point 2", "Point 3"]
+                                      }
+                                  ],
+                                  "key_takeaways": ["Takeaway 1", "Takeaway 2", "Takeaway 3"]
+                              }
+                          
+                              Guidelines:
+                              - Break content into 3-7 points per section
+                              - Use active voice and clear language
+                              - Group related points together
+                              - Do not include bullet points or dashes in the text
+                              - Ensure all text is concise and presentation-friendly"""},
+                {"role": "user",
+                 "content": f"Convert this summary into presentation-ready content, returning only the JSON structure:\n\n{summary}"}
+            ],
+            temperature=0.7
+        )
+        return content.model_dump()
+    except llm_structured.StructuredOutputError:
+        return {
+            "title_slide": {
+                "title": "Document Summary",
+                "subtitle": "Key Points and Insights"
+            },
+            "agenda": ["Key Points", "Details", "Conclusion"],
+            "sections": [
+                {
+                    "title": "Key Points",
+                    "points": [point.lstrip('•- ').strip() for point in summary.split('\n')[:5]]
                 }
-        except Exception as e:
-            content = {
-                "title_slide": {
-                    "title": "Document Summary",
-                    "subtitle": "Key Points and Insights"
-                },
-                "agenda": ["Summary"],
-                "sections": [
-                    {
-                        "title": "Summary",
-                        "points": [summary]
-                    }
-                ],
-                "key_takeaways": ["Please refer to the main summary for details"]
-            }
-    
-    return content
+            ],
+            "key_takeaways": [point.lstrip('•- ').strip() for point in summary.split('\n')[-3:]]
+        }
 
 def create_presentation(ppt_content):
     """Create a PowerPoint presentation from optimized content"""
@@ -341,27 +369,38 @@ def doc_summary(client):
             
             with summary_tab:
                 if st.button("Summarize"):  
-                    with st.spinner("Generating summary..."):  
-                        summary = summarize_text(client, "gpt4omini", summarizer_temperature, 
-                                            text_content, summary_length, summary_type)  
-                        
-                        # Store the summary in session state
-                        st.session_state['current_summary'] = summary
-                        
-                    st.subheader("Summary:")   
-                    st.write(summary)
-                    
-                    # Add download button
-                    with st.spinner("Preparing PowerPoint download..."):
-                        pptx_buffer = download_as_pptx(client, summary)
-                        
-                        st.download_button(
-                            label="📥 Download as PowerPoint",
-                            data=pptx_buffer.getvalue(),
-                            file_name="summary_presentation.pptx",
-                            mime="application/vnd.openxmlformats-officedocument.presentationml.presentation",
-                            key="download_pptx"
+                    if llm_budget.over_budget("doc_summary", text_content):
+                        # Long documents take minutes, so they are summarized in the background
+                        st.session_state.summary_job = jobs.submit(
+                            "doc_summary", summary_job, client, summarizer_temperature,
+                            text_content, summary_length, summary_type
                         )
+                    else:
+                        st.subheader("Summary:")   
+                        with st.spinner("Generating summary..."):  
+                            # The summary appears as it is written
+                            summary = summarize_text(client, summarizer_temperature, 
+                                                text_content, summary_length, summary_type,
+                                                container=st.container())  
+                            
+                            # Store the summary in session state
+                            st.session_state['current_summary'] = summary
+                        
+                        # Add download button
+                        show_pptx_download(client, summary)
+
+                if st.session_state.get("summary_job"):
+                    st.subheader("Summary:")
+                    job = jobs.show_progress(st.session_state.summary_job, "Summarizing a long document...")
+                    if job is not None:
+                        del st.session_state.summary_job
+                        if job.succeeded:
+                            summary = jobs.result(job.id)
+                            st.session_state['current_summary'] = summary
+                            st.write(summary)
+                            show_pptx_download(client, summary)
+                        else:
+                            st.error(f"Summary {job.status}{': ' + job.error if job.error else ''}")
             
             with chat_tab:
                 # Initialize chat history
@@ -370,6 +409,9 @@ def doc_summary(client):
                 
                 # Get or create vectorstore
                 vectorstore = get_vectorstore(text_content)
+                retrieve = metrics.timed("portal_retrieval_seconds", "Vectorstore searches", app="doc_summary")(
+                    vectorstore.similarity_search
+                )
                 
                 # Create chat interface
                 st.write("Ask questions about your document:")
@@ -388,7 +430,7 @@ def doc_summary(client):
                         st.markdown(question)
                     
                     # Get relevant documents
-                    docs = vectorstore.similarity_search(question)
+                    docs = retrieve(question)
                     
                     # Create QA chain
                     llm = AzureChatOpenAI(
@@ -420,7 +462,7 @@ def doc_summary(client):
 
                     # Create the retrieval chain
                     retrieval_chain = {
-                        "context": lambda x: vectorstore.similarity_search(x["question"]),
+                        "context": lambda x: retrieve(x["question"]),
                         "question": RunnablePassthrough()
                     }
 
@@ -430,7 +472,12 @@ def doc_summary(client):
                     with st.chat_message("assistant", avatar="DNA Navigators.png"):
                         with st.spinner("Thinking..."):
                             # Get response from QA chain
-                            answer = chain.invoke({"question": question})
+                            with (
+                                get_openai_callback() as cb,
+                                llm_gateway.limit("doc_summary", "gpt4omini"),
+                                llm_telemetry.track_langchain("doc_summary", "gpt4omini", cb),
+                            ):
+                                answer = chain.invoke({"question": question})
                             st.markdown(answer)
                             
                             # Add assistant response to chat history
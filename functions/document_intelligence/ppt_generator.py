@@ -1,6 +1,4 @@
 import streamlit as st
-from openai import AzureOpenAI
-import fitz  # PyMuPDF
 from pptx import Presentation
 from pptx.util import Inches, Pt
 from pptx.dml.color import RGBColor
@@ -13,25 +11,42 @@ import os
 from PIL import Image
 import json
 import base64
+import asyncio
+from typing import List
+from pydantic import BaseModel
 
+import Functions
+import cpu_pool
+import cpu_tasks
+import jobs
+import llm_budget
+import llm_fanout
+import llm_fixtures
+import llm_gateway
+import llm_structured
+import session_memory
 from config import api_key, endpoint
 
 
+class SlideContent(BaseModel):
+    title: str
+    content: str
+    key_points: List[str]
+
+class PresentationOutline(BaseModel):
+    title: str
+    subtitle: str
+    slides: List[SlideContent]
+
+class SpecialSlideContent(BaseModel):
+    content: str
+    key_points: List[str]
+
 def initialize_azure_client():
-    """Initialize Azure OpenAI client"""
-    client = AzureOpenAI(
-        api_key=api_key,  
-        api_version="2024-02-15-preview",
-        azure_endpoint=endpoint
-    )
-    return client
+    """Return the shared Azure OpenAI client"""
+    return Functions.get_client(api_version="2024-02-15-preview", azure_endpoint=endpoint, azure_api_key=api_key)
 
-def generate_optimized_dalle_prompt(client, slide_content):
-    """
-    Generate an optimized prompt for DALLE-3 image generation using GPT-4
-    to create detailed, professional, and contextually relevant prompts.
-    """
-    system_prompt = """You are an expert at creating optimal prompts for DALLE-3 image generation.
+DALLE_SYSTEM_PROMPT = """You are an expert at creating optimal prompts for DALLE-3 image generation.
     Your role is to convert presentation slide content into detailed, specific image prompts that will
     generate professional, photorealistic images suitable for business presentations.
 
@@ -47,6 +62,17 @@ def generate_optimized_dalle_prompt(client, slide_content):
 
     Return only the prompt text without any explanations or additional content."""
 
+# Consistent style guidelines added to every prompt to ensure professional quality
+DALLE_STYLE_SUFFIX = (
+    "Create this as a photorealistic image with professional lighting, "
+    "shallow depth of field, high detail, 4K quality. "
+    "Style: modern corporate photography, editorial quality. "
+    "No text or words should appear in the image. "
+    "Use natural lighting and professional composition."
+)
+
+def dalle_prompt_messages(slide_content):
+    """Messages asking the chat model for a DALLE-3 prompt for a slide"""
     user_prompt = f"""Create a DALLE-3 prompt for a presentation slide with:
     Title: {slide_content['title']}
     Content: {slide_content['content']}
@@ -54,29 +80,26 @@ def generate_optimized_dalle_prompt(client, slide_content):
     
     The image should be suitable for a professional presentation."""
 
+    return [
+        {"role": "system", "content": DALLE_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
+
+def generate_optimized_dalle_prompt(client, slide_content):
+    """
+    Generate an optimized prompt for DALLE-3 image generation using GPT-4
+    to create detailed, professional, and contextually relevant prompts.
+    """
     try:
-        response = client.chat.completions.create(
+        response = llm_gateway.chat_completion(client, "ppt_creator", cache=True,
             model=st.session_state.model_deployment,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
+            messages=dalle_prompt_messages(slide_content),
             temperature=0.7,
             max_tokens=300
         )
         
         optimized_prompt = response.choices[0].message.content.strip()
-        
-        # Add consistent style guidelines to ensure professional quality
-        style_suffix = (
-            "Create this as a photorealistic image with professional lighting, "
-            "shallow depth of field, high detail, 4K quality. "
-            "Style: modern corporate photography, editorial quality. "
-            "No text or words should appear in the image. "
-            "Use natural lighting and professional composition."
-        )
-        
-        return f"{optimized_prompt} {style_suffix}"
+        return f"{optimized_prompt} {DALLE_STYLE_SUFFIX}"
     except Exception as e:
         st.warning(f"Error generating optimized prompt: {str(e)}")
         return None
@@ -93,7 +116,7 @@ def generate_enhanced_dalle_image(client, slide_content, size="1024x1024"):
         st.write(f"Generating image with optimized prompt: {optimized_prompt}")
         
         # Generate image using DALLE-3
-        response = client.images.generate(
+        response = llm_gateway.image_generation(client, "ppt_creator",
             model="Dalle3",  # Use your actual DALLE-3 deployment name
             prompt=optimized_prompt,
             n=1,
@@ -119,40 +142,58 @@ def generate_enhanced_dalle_image(client, slide_content, size="1024x1024"):
         st.warning(f"Error generating image: {str(e)}")
         return None
 
-def generate_presentation_images(client, slides):
-    """Generate images for all presentation slides"""
-    generated_images = []
-    total_slides = len(slides)
-    progress_bar = st.progress(0)
-    
-    for idx, slide in enumerate(slides):
-        if slide.get("is_special", False):
-            generated_images.append(None)
-            continue
-            
-        with st.spinner(f"Generating image {idx + 1}/{total_slides}..."):
-            try:
-                image = generate_enhanced_dalle_image(client, slide)
-                generated_images.append(image)
-            except Exception as e:
-                st.warning(f"Failed to generate image for slide {idx + 1}: {str(e)}")
-                generated_images.append(None)
-        
-        progress = min(1.0, (idx + 1) / total_slides)
-        progress_bar.progress(progress)
+def generate_presentation_images(client, slides, model_deployment, on_progress=None, on_warning=st.warning):
+    """Generate images for all presentation slides; returns the images and the prompts they were made from"""
+    image_slides = [idx for idx, slide in enumerate(slides) if not slide.get("is_special", False)]
+
+    async def generate_image(idx):
+        response = await llm_fanout.chat_completion(client, "ppt_creator", cache=True,
+            model=model_deployment,
+            messages=dalle_prompt_messages(slides[idx]),
+            temperature=0.7,
+            max_tokens=300
+        )
+        optimized_prompt = f"{response.choices[0].message.content.strip()} {DALLE_STYLE_SUFFIX}"
+
+        image = await llm_fanout.image_generation(client, "ppt_creator",
+            model="Dalle3",  # Use your actual DALLE-3 deployment name
+            prompt=optimized_prompt,
+            n=1,
+            size="1024x1024"
+        )
+
+        image_response = await asyncio.to_thread(requests.get, image.data[0].url)
+        if image_response.status_code != 200:
+            raise ValueError(f"Failed to download image: HTTP {image_response.status_code}")
+        return optimized_prompt, BytesIO(image_response.content)
+
+    # The slides are independent, so their images are generated in parallel
+    results = llm_fanout.run(image_slides, generate_image, on_progress=on_progress)
+
+    generated_images = [None] * len(slides)
+    image_prompts = [None] * len(slides)
+    for idx, result in zip(image_slides, results):
+        if result.ok:
+            image_prompts[idx], generated_images[idx] = result.value
+        else:
+            on_warning(f"Failed to generate image for slide {idx + 1}: {str(result.error)}")
     
-    return generated_images
+    return generated_images, image_prompts
+
+def presentation_images_job(job, client, slides, model_deployment):
+    """Background job: generate the images of a presentation"""
+    job.progress(0.0, "Generating images...")
+    return generate_presentation_images(
+        client,
+        slides,
+        model_deployment,
+        on_progress=job.progress_callback("Generated {done} of {total} images"),
+        on_warning=job.warn
+    )
 
 def extract_text_from_pdf(pdf_file):
     """Extract text from PDF file"""
-    text_content = []
-    pdf_document = fitz.open(stream=pdf_file.read(), filetype="pdf")
-    
-    for page_num in range(pdf_document.page_count):
-        page = pdf_document[page_num]
-        text_content.append(page.get_text())
-    
-    return " ".join(text_content)
+    return cpu_pool.run(cpu_tasks.pdf_text, pdf_file.read(), separator=" ")
 
 def generate_special_slides(client, content_data):
     """Generate comprehensive content for special slides using LLM"""
@@ -176,35 +217,6 @@ def generate_special_slides(client, content_data):
         "key_points": ["detailed point 1", "detailed point 2", ...]
     }}"""
 
-    try:
-        contents_response = client.chat.completions.create(
-            model=st.session_state.model_deployment,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": contents_prompt}
-            ],
-            temperature=0.7,
-            response_format={ "type": "json_object" }
-        )
-        
-        contents_data = json.loads(contents_response.choices[0].message.content)
-        special_slides['contents'] = {
-            "title": "Contents",
-            "content": contents_data['content'],
-            "key_points": contents_data['key_points'],
-            "is_special": True,
-            "special_type": "contents"
-        }
-    except Exception as e:
-        st.warning(f"Error generating contents: {str(e)}")
-        special_slides['contents'] = {
-            "title": "Contents",
-            "content": "Presentation Overview",
-            "key_points": [slide['title'] for slide in content_data['slides']],
-            "is_special": True,
-            "special_type": "contents"
-        }
-
     # Generate conclusion slide
     conclusion_prompt = f"""Create a comprehensive conclusion for this presentation:
     Title: {content_data['title']}
@@ -232,18 +244,47 @@ def generate_special_slides(client, content_data):
         ]
     }}"""
 
-    try:
-        conclusion_response = client.chat.completions.create(
-            model=st.session_state.model_deployment,
+    model_deployment = st.session_state.model_deployment
+
+    async def generate_slide(prompt):
+        slide = await llm_structured.acomplete(client, "ppt_creator", SpecialSlideContent,
+            model=model_deployment,
             messages=[
                 {"role": "system", "content": system_prompt},
-                {"role": "user", "content": conclusion_prompt}
+                {"role": "user", "content": prompt}
             ],
-            temperature=0.7,
-            response_format={ "type": "json_object" }
+            temperature=0.7
         )
-        
-        conclusion_data = json.loads(conclusion_response.choices[0].message.content)
+        return slide.model_dump()
+
+    # The contents and conclusion slides do not depend on each other, so both are generated at once
+    contents_result, conclusion_result = llm_fanout.run([contents_prompt, conclusion_prompt], generate_slide)
+
+    try:
+        if not contents_result.ok:
+            raise contents_result.error
+        contents_data = contents_result.value
+        special_slides['contents'] = {
+            "title": "Contents",
+            "content": contents_data['content'],
+            "key_points": contents_data['key_points'],
+            "is_special": True,
+            "special_type": "contents"
+        }
+    except Exception as e:
+        st.warning(f"Error generating contents: {str(e)}")
+        special_slides['contents'] = {
+            "title": "Contents",
+            "content": "Presentation Overview",
+            "key_points": [slide['title'] for slide in content_data['slides']],
+            "is_special": True,
+            "special_type": "contents"
+        }
+
+    try:
+        if not conclusion_result.ok:
+            raise conclusion_result.error
+        conclusion_data = conclusion_result.value
         special_slides['conclusion'] = {
             "title": "Conclusion",
             "content": conclusion_data['content'],
@@ -263,8 +304,9 @@ def generate_special_slides(client, content_data):
 
     return special_slides
 
-def get_content_sections(client, text, style, num_slides, include_contents, include_conclusion, include_references, max_tokens=10000):
-    """Use Azure OpenAI to analyze and structure the content"""
+@llm_fixtures.recorded("get_content_sections", session_keys=("model_deployment",))
+def get_content_sections(client, text, style, num_slides, include_contents, include_conclusion, include_references, max_tokens=None):
+    """Use Azure OpenAI to analyze and structure the content; max_tokens overrides the app's token budget for the document"""
     system_prompt = f"""You are a professional presentation creator. Create a presentation outline with exactly {num_slides} content slides.
     You must respond with valid JSON only, using the following structure:
     {{
@@ -282,18 +324,19 @@ def get_content_sections(client, text, style, num_slides, include_contents, incl
     Each slide should have a clear title, detailed content, and 3-4 key points."""
 
     try:
+        text = llm_budget.fit("ppt_creator", text, deployment=st.session_state.model_deployment, max_tokens=max_tokens)
+
         # First generate main content
-        response = client.chat.completions.create(
+        outline = llm_structured.complete(client, "ppt_creator", PresentationOutline,
             model=st.session_state.model_deployment,
             messages=[
                 {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Create a {style} presentation from:\n{text[:max_tokens]}"}
+                {"role": "user", "content": f"Create a {style} presentation from:\n{text}"}
             ],
-            temperature=0.7,
-            response_format={ "type": "json_object" }
+            temperature=0.7
         )
         
-        content = json.loads(response.choices[0].message.content)
+        content = outline.model_dump()
         
         # Generate special slides using the main content
         special_slides = generate_special_slides(client, content)
@@ -321,7 +364,7 @@ def get_content_sections(client, text, style, num_slides, include_contents, incl
             Create 3-5 properly formatted references."""
             
             try:
-                references_response = client.chat.completions.create(
+                references_response = llm_gateway.chat_completion(client, "ppt_creator",
                     model=st.session_state.model_deployment,
                     messages=[
                         {"role": "system", "content": "Generate academic references and citations."},
@@ -395,17 +438,16 @@ def get_content_from_prompt(client, prompt, style, num_slides, include_contents,
 
     try:
         # Generate main content from prompt
-        response = client.chat.completions.create(
+        outline = llm_structured.complete(client, "ppt_creator", PresentationOutline,
             model=st.session_state.model_deployment,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": f"Create a detailed presentation about: {prompt}"}
             ],
-            temperature=0.7,
-            response_format={ "type": "json_object" }
+            temperature=0.7
         )
         
-        content = json.loads(response.choices[0].message.content)
+        content = outline.model_dump()
         
         # Generate special slides using the main content
         special_slides = generate_special_slides(client, content)
@@ -441,7 +483,7 @@ def get_content_from_prompt(client, prompt, style, num_slides, include_contents,
             Create 3-5 properly formatted references."""
             
             try:
-                references_response = client.chat.completions.create(
+                references_response = llm_gateway.chat_completion(client, "ppt_creator",
                     model=st.session_state.model_deployment,
                     messages=[
                         {"role": "system", "content": "Generate academic references and citations."},
@@ -566,7 +608,7 @@ def add_image_to_slide(slide, image_stream, layout_style):
     except Exception as e:
         st.warning(f"Error adding image to slide: {str(e)}")
 
-def create_presentation(content_data, theme, layout_style, include_images=True):
+def create_presentation(content_data, theme, layout_style, include_images=True, on_warning=st.warning):
     """Create PowerPoint presentation using python-pptx with enhanced formatting and images"""
     prs = Presentation()
     colors = apply_theme_colors(theme)
@@ -718,12 +760,32 @@ def create_presentation(content_data, theme, layout_style, include_images=True):
                     height
                 )
             except Exception as e:
-                st.warning(f"Error adding image to slide {idx}: {str(e)}")
+                on_warning(f"Error adding image to slide {idx}: {str(e)}")
         
         add_slide_number(slide, idx + 1, total_slides, colors)
     
     return prs
 
+def build_presentation_file(content_data, theme, layout_style, include_images=True):
+    """
+    create_presentation saved as .pptx bytes, for building in the CPU pool; returns (bytes, warnings)
+
+    The pool's worker process has no Streamlit session, so its warnings are returned for the app to show.
+    """
+    warnings = []
+    pptx_io = BytesIO()
+    create_presentation(content_data, theme, layout_style, include_images, on_warning=warnings.append).save(pptx_io)
+    return pptx_io.getvalue(), warnings
+
+def store_image(image):
+    """Image bytes as kept in session state: large images go to disk and are referenced by handle"""
+    return session_memory.spill(image.getvalue()) if image else None
+
+def load_image(stored):
+    """An image kept with store_image, or None if it is missing or was evicted"""
+    data = session_memory.load(stored)
+    return BytesIO(data) if data else None
+
 def regenerate_single_image(client, slide_data):
     """Regenerate image for a single slide"""
     try:
@@ -880,14 +942,26 @@ def ppt_app():
                 st.rerun()
             return
         
-        # Generate images using enhanced function
-        st.session_state.generated_images = generate_presentation_images(
-            st.session_state.client,
-            st.session_state.content_data["slides"]
-        )
-        
-        st.session_state.current_step = "create_presentation"
-        st.rerun()
+        # Images take minutes, so they are generated in the background and survive reruns
+        if not st.session_state.get("image_job"):
+            st.session_state.image_job = jobs.submit(
+                "ppt_images",
+                presentation_images_job,
+                st.session_state.client,
+                st.session_state.content_data["slides"],
+                st.session_state.model_deployment
+            )
+
+        job = jobs.show_progress(st.session_state.image_job, "Generating images...")
+        if job is not None:
+            del st.session_state.image_job
+            if job.succeeded:
+                generated_images, st.session_state.image_descriptions = jobs.result(job.id)
+                st.session_state.generated_images = [store_image(image) for image in generated_images]
+            st.session_state.image_warnings = job.warnings if job.succeeded else [f"Image generation {job.status}: {job.error or ''}"]
+            
+            st.session_state.current_step = "create_presentation"
+            st.rerun()
 
     # Step 4: Create Presentation
     elif st.session_state.current_step == "create_presentation":
@@ -900,6 +974,9 @@ def ppt_app():
                 st.rerun()
             return
             
+        for warning in st.session_state.get("image_warnings", []):
+            st.warning(warning)
+
         presentation_data = {
             "title": st.session_state.content_data["title"],
             "subtitle": st.session_state.content_data["subtitle"],
@@ -911,9 +988,9 @@ def ppt_app():
             if include_images:
                 # Use regenerated image if available, otherwise use original
                 if idx in st.session_state.regenerated_images:
-                    slide_data["image"] = st.session_state.regenerated_images[idx]
+                    slide_data["image"] = load_image(st.session_state.regenerated_images[idx])
                 elif idx < len(st.session_state.generated_images):
-                    slide_data["image"] = st.session_state.generated_images[idx]
+                    slide_data["image"] = load_image(st.session_state.generated_images[idx])
             presentation_data["slides"].append(slide_data)
 
         with st.spinner("Creating presentation..."):
@@ -953,22 +1030,22 @@ def ppt_app():
                                                 slide
                                             )
                                             if new_image:
-                                                st.session_state.regenerated_images[idx] = new_image
+                                                st.session_state.regenerated_images[idx] = store_image(new_image)
                                                 # Update the presentation data
                                                 presentation_data["slides"][idx]["image"] = new_image
                                                 st.rerun()
             
-            # Generate the presentation with latest images
-            presentation = create_presentation(
+            # Generate the presentation with latest images, in the CPU pool
+            pptx_bytes, build_warnings = cpu_pool.run(
+                build_presentation_file,
                 presentation_data,
                 theme,
                 layout_style,
                 include_images
             )
-            
-            pptx_io = BytesIO()
-            presentation.save(pptx_io)
-            pptx_io.seek(0)
+            pptx_io = BytesIO(pptx_bytes)
+            for warning in build_warnings:
+                st.warning(warning)
             
             # Download column
             with download_col:
@@ -985,7 +1062,7 @@ def ppt_app():
                 st.markdown("### Additional Options")
                 if st.button("Create New Presentation", use_container_width=True):
                     for key in ["content_data", "current_step", "mode", "image_descriptions", 
-                              "generated_images", "regenerated_images"]:
+                              "generated_images", "regenerated_images", "image_warnings"]:
                         if key in st.session_state:
                             del st.session_state[key]
                     st.rerun()
@@ -1014,8 +1091,10 @@ def ppt_app():
     
     # Add a "Start Over" button in the sidebar that's always available
     if st.sidebar.button("Start Over", use_container_width=True):
+        if st.session_state.get("image_job"):
+            jobs.cancel(st.session_state.image_job)
         for key in ["content_data", "current_step", "mode", "image_descriptions", 
-                   "generated_images", "regenerated_images"]:
+                   "generated_images", "regenerated_images", "image_job", "image_warnings"]:
             if key in st.session_state:
                 del st.session_state[key]
         st.rerun()
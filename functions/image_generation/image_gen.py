@@ -2,6 +2,8 @@ import streamlit as st
 import os
 import requests
 
+import llm_gateway
+
 
 
 # Predefined style guides with detailed descriptions
@@ -83,7 +85,7 @@ def enhance_prompt(client, prompt, style_guide="", additional_instructions="", c
             {"role": "user", "content": f"Enhance this prompt for image generation: {full_prompt}"}
         ]
 
-        response = client.chat.completions.create(
+        response = llm_gateway.chat_completion(client, "image_gen",
             model="gpt4o",
             messages=messages,
             temperature=0.7,
@@ -148,7 +150,7 @@ def improve_prompt_based_on_feedback(client, original_prompt, satisfaction, aspe
             {"role": "user", "content": f"Improve this image generation prompt based on feedback and settings: {feedback_context}"}
         ]
 
-        response = client.chat.completions.create(
+        response = llm_gateway.chat_completion(client, "image_gen",
             model="gpt4o",
             messages=messages,
             temperature=0.7,
@@ -165,7 +167,7 @@ def generate_image(client, prompt):
     Generate image with error handling and quality settings.
     """
     try:
-        response = client.images.generate(
+        response = llm_gateway.image_generation(client, "image_gen",
             model="Dalle3",
             prompt=prompt,
             size="1024x1024",
@@ -3,8 +3,12 @@ import requests
 import json
 import pandas as pd
 from datetime import datetime
-from PIL import Image
-import io
+
+import cpu_pool
+import cpu_tasks
+import metrics
+
+OCR_SECONDS = metrics.histogram("portal_ocr_request_seconds", "Requests to the document OCR API")
 
 def save_results_to_file(data, filename):
     """Save the extracted information to a structured text file"""
@@ -26,8 +30,8 @@ def display_image_preview(uploaded_file):
             st.warning("PDF preview not available. File will still be processed.")
             return image_bytes
             
-        # Open and display image
-        image = Image.open(io.BytesIO(image_bytes))
+        # Decode and downscale the image in the CPU pool
+        image = cpu_pool.run(cpu_tasks.image_preview, image_bytes)
         
         col1, col2, col3 = st.columns(3)
         
@@ -109,7 +113,9 @@ def ocr_drivers_license():
                 
                 # Process with API
                 files = {'file': uploaded_file}
-                response = requests.post('https://coe-apis.azurewebsites.net/drivers_license', files=files)
+                with OCR_SECONDS.time(app="ocr_drivers_license") as labels:
+                    response = requests.post('https://coe-apis.azurewebsites.net/drivers_license', files=files)
+                    labels["status"] = response.status_code
                 
                 if response.status_code == 200:
                     st.subheader("Extracted Information")
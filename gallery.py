@@ -0,0 +1,178 @@
+import time
+import logging
+import statistics
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+
+import config
+import metrics
+import app_registry
+import static_assets
+from app_registry import APP_METADATA
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Injected once per gallery render rather than once per card
+GALLERY_CSS = """
+<style>
+.app-card {
+    border: 1px solid rgba(255, 107, 0, 0.3);
+    border-radius: 10px;
+    padding: 12px;
+    margin: 10px 5px;
+    background-color: rgba(255, 255, 255, 0.05);
+    transition: all 0.3s ease;
+    height: 100%;
+    position: relative;
+    box-shadow: 0 0 15px rgba(255, 107, 0, 0.1);
+}
+.app-card:hover {
+    transform: translateY(-2px);
+    box-shadow: 0 0 20px rgba(255, 107, 0, 0.3);
+}
+.app-card img {
+    width: 100%;
+    border-radius: 8px;
+}
+.emoji-fallback {
+    font-size: 32px;
+    text-align: center;
+    background-color: rgba(255, 255, 255, 0.1);
+    border-radius: 8px;
+    padding: 6px;
+    min-height: 60px;
+    display: flex;
+    align-items: center;
+    justify-content: center;
+}
+.app-title {
+    font-size: 1.1em;
+    margin: 8px 0;
+    font-weight: bold;
+}
+.app-description {
+    font-size: 0.85em;
+    margin: 6px 0;
+    color: rgba(255, 255, 255, 0.8);
+}
+.app-tags {
+    display: flex;
+    flex-wrap: wrap;
+    gap: 4px;
+    margin-top: 8px;
+}
+.app-tag {
+    background-color: rgba(255, 107, 0, 0.2);
+    border-radius: 12px;
+    padding: 2px 8px;
+    font-size: 0.7em;
+    color: #FF6B00;
+}
+.api-badge {
+    background-color: rgba(0, 255, 0, 0.2);
+    color: #00FF00;
+    border-radius: 12px;
+    padding: 2px 8px;
+    font-size: 0.7em;
+    display: inline-block;
+    margin-top: 4px;
+}
+.stColumn {
+    padding: 0 10px;
+}
+</style>
+"""
+
+# Kept free of blank lines, which would end the HTML block in Streamlit's markdown renderer
+CARD_TEMPLATE = """<div class="app-card">
+{image}
+<div style='display: flex; justify-content: space-between; align-items: center;'><div class='app-title'>{name}</div>{api_badge}</div>
+<div class='app-description'>{description}</div>
+<div class="app-tags">{tags}</div>
+<small><b>Category:</b> {category}</small>{parent}
+</div>"""
+
+# Recent gallery render times, used to keep an eye on render cost as the catalogue grows
+RENDER_TIMES_MS = deque(maxlen=500)
+
+
+@lru_cache(maxsize=1)
+def thumbnails():
+    """Generate the card thumbnails once per process and return their URLs by app id"""
+    urls = {}
+    for app_id, metadata in app_registry.gallery_apps().items():
+        if metadata.get("image_name"):
+            url = static_assets.thumbnail_url(f"images/{metadata['image_name']}")
+            if url:
+                urls[app_id] = url
+    return urls
+
+
+@lru_cache(maxsize=None)
+def card_html(app_id):
+    """Build the static markup of an app card (everything except the Launch button)"""
+    metadata = APP_METADATA[app_id]
+
+    thumbnail = thumbnails().get(app_id)
+    if thumbnail:
+        image = f"<img src='{thumbnail}' alt='{metadata['name']}' loading='lazy'>"
+    else:
+        image = f"<div class='emoji-fallback'>{metadata['fallback_emoji']}</div>"
+
+    parent = ""
+    if metadata['parent_app'] != metadata['name']:
+        parent = f"<br><small><b>Part of:</b> {metadata['parent_app']}</small>"
+
+    return CARD_TEMPLATE.format(
+        image=image,
+        name=metadata['name'],
+        api_badge="<span class='api-badge'>API Available</span>" if metadata.get('api_available', False) else "",
+        description=metadata['description'],
+        tags=''.join(f'<span class="app-tag">#{tag}</span>' for tag in metadata['tags']),
+        category=metadata['category'],
+        parent=parent,
+    )
+
+
+def _clear_caches(app_id, metadata):
+    thumbnails.cache_clear()
+    card_html.cache_clear()
+
+
+# Registering an app at runtime adds or changes a card
+app_registry.on_register(_clear_caches)
+
+
+@contextmanager
+def timed_render():
+    """Time a gallery render and warn when it goes over GALLERY_RENDER_BUDGET_MS"""
+    start = time.perf_counter()
+    yield
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    RENDER_TIMES_MS.append(elapsed_ms)
+
+    if elapsed_ms > config.GALLERY_RENDER_BUDGET_MS:
+        logger.warning(
+            f"Gallery render took {elapsed_ms:.0f}ms for {len(app_registry.gallery_apps())} apps "
+            f"(budget {config.GALLERY_RENDER_BUDGET_MS}ms)"
+        )
+
+
+def render_stats():
+    """Summarise the recent gallery render times"""
+    if not RENDER_TIMES_MS:
+        return {"renders": 0}
+
+    ordered = sorted(RENDER_TIMES_MS)
+    return {
+        "renders": len(ordered),
+        "median_ms": statistics.median(ordered),
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max_ms": ordered[-1],
+    }
+
+
+metrics.register_stats("gallery_render", render_stats)
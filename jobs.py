@@ -0,0 +1,462 @@
+import json
+import time
+import uuid
+import pickle
+import sqlite3
+import logging
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import config
+import metrics
+import llm_telemetry
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+# Queued or running when the server stopped
+INTERRUPTED = "interrupted"
+FINISHED_STATUSES = {SUCCEEDED, FAILED, CANCELLED, INTERRUPTED}
+# Reported by show_progress for a job id this server does not know (purged, or from another
+# replica's or an earlier jobs.db); never stored
+MISSING = "missing"
+
+# Most jobs of one type running at once; types not listed may use every worker.
+# Overridden by config.JOBS_TYPE_LIMITS.
+DEFAULT_TYPE_LIMITS = {
+    # Each image job already generates its images in parallel
+    "ppt_images": 2,
+}
+
+# Progress updates closer together than this are written once
+PROGRESS_WRITE_INTERVAL_SECONDS = 0.5
+
+# How often finished jobs past the retention period are deleted while the server runs
+PURGE_INTERVAL_SECONDS = 3600
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    job_type TEXT NOT NULL,
+    user_id TEXT,
+    session_id TEXT,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    preview TEXT,
+    warnings TEXT NOT NULL DEFAULT '[]',
+    error TEXT,
+    result BLOB,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+)
+"""
+
+JOB_COLUMNS = (
+    "id, job_type, user_id, session_id, status, progress, message, preview, warnings, error, "
+    "created_at, started_at, finished_at"
+)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job that was cancelled, at its next check"""
+
+
+@dataclass
+class Job:
+    id: str
+    job_type: str
+    user_id: str
+    session_id: str
+    status: str
+    progress: float = 0.0
+    message: str = None
+    preview: str = None
+    warnings: list = field(default_factory=list)
+    error: str = None
+    created_at: float = None
+    started_at: float = None
+    finished_at: float = None
+
+    @property
+    def done(self):
+        return self.status in FINISHED_STATUSES or self.status == MISSING
+
+    @property
+    def succeeded(self):
+        return self.status == SUCCEEDED
+
+
+class JobContext:
+    """Handed to a running job's function to report progress and check for cancellation"""
+
+    def __init__(self, job_queue, job_id, cancel_event):
+        self.job_id = job_id
+        self._queue = job_queue
+        self._cancel_event = cancel_event
+        self._written_at = 0.0
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self):
+        """Stop the job here if it has been cancelled"""
+        if self.cancelled:
+            raise JobCancelled()
+
+    def progress(self, fraction, message=None):
+        """Report progress between 0 and 1, with an optional status message"""
+        self.check_cancelled()
+        now = time.monotonic()
+        if fraction < 1 and now - self._written_at < PROGRESS_WRITE_INTERVAL_SECONDS:
+            return
+        self._written_at = now
+        self._queue._update(self.job_id, progress=min(max(fraction, 0.0), 1.0), message=message)
+
+    def progress_callback(self, text=None, start=0.0, end=1.0):
+        """
+        on_progress(done, total) callback (e.g. for llm_fanout.run) reporting into the share of
+        the job between start and end. text may use {done} and {total}.
+        """
+        def on_progress(done, total):
+            self.progress(start + (end - start) * done / total, text.format(done=done, total=total) if text else None)
+        return on_progress
+
+    def preview(self, text):
+        """Show partial output (e.g. text being streamed) while the job runs"""
+        self._queue._update(self.job_id, preview=text)
+
+    def warn(self, message):
+        """Add a warning to show with the job's result"""
+        self._queue._add_warning(self.job_id, message)
+
+    def preview_container(self):
+        """Stand-in for a Streamlit container for code that streams into one (see llm_structured.stream_complete)"""
+        return _PreviewContainer(self)
+
+
+class _PreviewContainer:
+    def __init__(self, context):
+        self._context = context
+
+    def empty(self):
+        self._context.preview(None)
+        return self
+
+    def code(self, body, language=None):
+        self._context.preview(body)
+
+
+class JobQueue:
+    """
+    Worker pool for long-running app tasks, with a SQLite table of their status and results.
+
+    Jobs start in submission order as soon as a worker is free and neither the user's nor the
+    job type's limit of running jobs is reached. The functions of queued jobs are held in memory,
+    so jobs still queued or running when the server stops are marked interrupted on the next start.
+    """
+
+    def __init__(self, db_path, workers, per_user_limit, type_limits, retention_seconds):
+        self.workers = workers
+        self.per_user_limit = per_user_limit
+        self.type_limits = type_limits
+        self.retention_seconds = retention_seconds
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._db_lock = threading.Lock()
+        self._condition = threading.Condition()
+        # (job_id, job_type, user_id, session_id, fn, args, kwargs) in submission order
+        self._pending = []
+        # job_id -> (job_type, user_id)
+        self._running = {}
+        self._cancel_events = {}
+        self._wait_seconds = defaultdict(lambda: deque(maxlen=200))
+        self._run_seconds = defaultdict(lambda: deque(maxlen=200))
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job-worker")
+
+        with self._db_lock, self._conn:
+            self._conn.execute(CREATE_TABLE_SQL)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_user_created ON jobs (user_id, created_at)")
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE status IN (?, ?)",
+                (INTERRUPTED, time.time(), QUEUED, RUNNING),
+            )
+        self.purge()
+        self._purged_at = time.monotonic()
+        threading.Thread(target=self._dispatch_loop, name="job-dispatcher", daemon=True).start()
+
+    def submit(self, job_type, fn, *args, user_id=None, session_id=None, **kwargs):
+        """
+        Queue fn(context, *args, **kwargs) and return the job id.
+
+        context is a JobContext; fn's return value is the job's result and must be picklable.
+        """
+        job_id = uuid.uuid4().hex
+        with self._db_lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, job_type, user_id, session_id, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, job_type, user_id, session_id, QUEUED, time.time()),
+            )
+        with self._condition:
+            self._pending.append((job_id, job_type, user_id, session_id, fn, args, kwargs))
+            self._cancel_events[job_id] = threading.Event()
+            self._condition.notify()
+        logger.info(f"Queued job {job_id} ({job_type}) for {user_id}")
+        return job_id
+
+    def _can_start(self, job_type, user_id):
+        running = list(self._running.values())
+        if len(running) >= self.workers:
+            return False
+        if user_id is not None and sum(1 for _, user in running if user == user_id) >= self.per_user_limit:
+            return False
+        type_limit = self.type_limits.get(job_type, self.workers)
+        return sum(1 for running_type, _ in running if running_type == job_type) < type_limit
+
+    def _dispatch_loop(self):
+        with self._condition:
+            while True:
+                for entry in list(self._pending):
+                    job_id, job_type, user_id = entry[:3]
+                    if self._can_start(job_type, user_id):
+                        self._pending.remove(entry)
+                        self._running[job_id] = (job_type, user_id)
+                        self._executor.submit(self._run, *entry)
+                if time.monotonic() - self._purged_at >= PURGE_INTERVAL_SECONDS:
+                    self._purged_at = time.monotonic()
+                    try:
+                        self.purge()
+                    except Exception as e:
+                        logger.error(f"Error purging old jobs: {str(e)}")
+                self._condition.wait(timeout=PURGE_INTERVAL_SECONDS)
+
+    def _run(self, job_id, job_type, user_id, session_id, fn, args, kwargs):
+        started_at = time.time()
+        created_at = self._update(job_id, status=RUNNING, started_at=started_at)
+        context = JobContext(self, job_id, self._cancel_events[job_id])
+        try:
+            with llm_telemetry.session_scope(session_id):
+                result = fn(context, *args, **kwargs)
+            self._update(job_id, status=SUCCEEDED, progress=1.0, preview=None, result=pickle.dumps(result), finished_at=time.time())
+        except JobCancelled:
+            logger.info(f"Job {job_id} ({job_type}) cancelled")
+            self._update(job_id, status=CANCELLED, preview=None, finished_at=time.time())
+        except Exception as e:
+            logger.error(f"Error running job {job_id} ({job_type}): {str(e)}")
+            self._update(job_id, status=FAILED, preview=None, error=str(e), finished_at=time.time())
+        finally:
+            with self._condition:
+                self._running.pop(job_id, None)
+                self._cancel_events.pop(job_id, None)
+                if created_at is not None:
+                    self._wait_seconds[job_type].append(started_at - created_at)
+                self._run_seconds[job_type].append(time.time() - started_at)
+                self._condition.notify()
+
+    def _update(self, job_id, **values):
+        """Set columns of a job's row; returns the job's created_at"""
+        assignments = ", ".join(f"{column} = ?" for column in values)
+        with self._db_lock, self._conn:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*values.values(), job_id))
+            row = self._conn.execute("SELECT created_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def _add_warning(self, job_id, message):
+        with self._db_lock, self._conn:
+            row = self._conn.execute("SELECT warnings FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row:
+                warnings = json.loads(row[0]) + [message]
+                self._conn.execute("UPDATE jobs SET warnings = ? WHERE id = ?", (json.dumps(warnings), job_id))
+
+    @staticmethod
+    def _to_job(row):
+        values = list(row)
+        values[8] = json.loads(values[8] or "[]")
+        return Job(*values)
+
+    def get(self, job_id):
+        """The job's current status, or None if there is no such job"""
+        with self._db_lock:
+            row = self._conn.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_job(row) if row else None
+
+    def result(self, job_id):
+        """The value a succeeded job returned"""
+        with self._db_lock:
+            row = self._conn.execute("SELECT status, result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row[0] != SUCCEEDED:
+            raise ValueError(f"Job {job_id} has no result")
+        return pickle.loads(row[1])
+
+    def cancel(self, job_id):
+        """Cancel a queued job, or ask a running one to stop at its next progress report"""
+        with self._condition:
+            for entry in self._pending:
+                if entry[0] == job_id:
+                    self._pending.remove(entry)
+                    self._cancel_events.pop(job_id, None)
+                    self._update(job_id, status=CANCELLED, finished_at=time.time())
+                    return
+            if job_id in self._cancel_events:
+                self._cancel_events[job_id].set()
+
+    def list_jobs(self, user_id=None, limit=20):
+        """Most recent jobs, optionally of one user"""
+        query = f"SELECT {JOB_COLUMNS} FROM jobs"
+        params = ()
+        if user_id is not None:
+            query += " WHERE user_id = ?"
+            params = (user_id,)
+        with self._db_lock:
+            rows = self._conn.execute(f"{query} ORDER BY created_at DESC LIMIT ?", (*params, limit)).fetchall()
+        return [self._to_job(row) for row in rows]
+
+    def purge(self):
+        """Delete finished jobs and their results once they are past the retention period"""
+        with self._db_lock, self._conn:
+            self._conn.execute(
+                f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED_STATUSES))}) AND finished_at < ?",
+                (*FINISHED_STATUSES, time.time() - self.retention_seconds),
+            )
+
+    def stats(self):
+        """Queued and running jobs per type, jobs per status, and recent wait and run times"""
+        with self._condition:
+            queued = defaultdict(int)
+            for _, job_type, *_ in self._pending:
+                queued[job_type] += 1
+            running = defaultdict(int)
+            for job_type, _ in self._running.values():
+                running[job_type] += 1
+            timings = {
+                job_type: {
+                    "avg_wait_seconds": sum(self._wait_seconds[job_type]) / len(self._wait_seconds[job_type]) if self._wait_seconds[job_type] else 0.0,
+                    "avg_run_seconds": sum(runs) / len(runs),
+                }
+                for job_type, runs in self._run_seconds.items() if runs
+            }
+        with self._db_lock:
+            statuses = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {"queued": dict(queued), "running": dict(running), "statuses": statuses, "timings": timings}
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """The process-wide job queue, created the first time it is needed"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(
+                db_path=config.JOBS_DB_PATH,
+                workers=config.JOBS_WORKERS,
+                per_user_limit=config.JOBS_PER_USER_LIMIT,
+                type_limits={**DEFAULT_TYPE_LIMITS, **config.JOBS_TYPE_LIMITS},
+                retention_seconds=config.JOBS_RETENTION_HOURS * 3600,
+            )
+        return _queue
+
+
+def submit(job_type, fn, *args, **kwargs):
+    """Queue fn(context, *args, **kwargs) for the current user and session; returns the job id"""
+    import streamlit as st
+    return get_queue().submit(
+        job_type, fn, *args,
+        user_id=st.session_state.get("user_email", "anonymous"),
+        session_id=llm_telemetry.current_session_id(),
+        **kwargs,
+    )
+
+
+def get(job_id):
+    return get_queue().get(job_id)
+
+
+def result(job_id):
+    return get_queue().result(job_id)
+
+
+def cancel(job_id):
+    get_queue().cancel(job_id)
+
+
+def stats():
+    return get_queue().stats()
+
+
+def show_progress(job_id, label="Working..."):
+    """
+    Show a job's progress until it finishes; returns the finished Job, or None while it is
+    queued or running. A job id this server does not know is returned as a finished Job with
+    status MISSING, so callers clear it and show an error rather than waiting forever.
+
+    The status refreshes every config.JOBS_POLL_SECONDS without rerunning the rest of the page,
+    and the whole page reruns once the job has finished, so other widgets stay usable meanwhile.
+    """
+    import streamlit as st
+
+    job = get(job_id)
+    if job is None:
+        logger.error(f"Job {job_id} not found; it was purged or belongs to another jobs database")
+        return Job(
+            id=job_id, job_type=None, user_id=None, session_id=None, status=MISSING,
+            error="the job is no longer known to the server, please submit it again",
+        )
+    if job.done:
+        return job
+
+    @st.fragment(run_every=config.JOBS_POLL_SECONDS)
+    def job_status():
+        current = get(job_id)
+        if current is None or current.done:
+            st.rerun()
+        if current.status == QUEUED:
+            st.progress(0.0, text=f"{label} (waiting for a free worker)")
+        else:
+            st.progress(current.progress, text=current.message or label)
+        if current.preview:
+            st.code(current.preview)
+        if st.button("Cancel", key=f"cancel_job_{job_id}"):
+            cancel(job_id)
+
+    job_status()
+    return None
+
+
+def show_warnings(job):
+    """Show the warnings a finished job collected"""
+    import streamlit as st
+    for warning in job.warnings:
+        st.warning(warning)
+
+
+def _metrics_stats():
+    """stats() arranged for the metrics endpoint; nothing until the queue has been started"""
+    if _queue is None:
+        return {"job_type": {}, "status": {}}
+    report = _queue.stats()
+    by_type = defaultdict(lambda: {"queued": 0, "running": 0})
+    for state in ("queued", "running"):
+        for job_type, count in report[state].items():
+            by_type[job_type][state] = count
+    for job_type, timings in report["timings"].items():
+        by_type[job_type].update(timings)
+    return {
+        "job_type": dict(by_type),
+        "status": {status: {"jobs": count} for status, count in report["statuses"].items()},
+    }
+
+
+metrics.register_stats("jobs", lambda: _metrics_stats()["job_type"], labels=("job_type",))
+metrics.register_stats("jobs_by_status", lambda: _metrics_stats()["status"], labels=("status",))
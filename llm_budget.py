@@ -0,0 +1,242 @@
+import re
+import math
+import logging
+import threading
+from collections import Counter, defaultdict
+
+import config
+import metrics
+import llm_fanout
+import llm_router
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# How each app fits a document into its prompt when the document is over budget.
+#   head_tail   keep the beginning and the end, drop the middle
+#   retrieval   keep the chunks most relevant to the question, in document order
+#   map_reduce  condense every chunk with a model call and use the condensed text
+# max_input_tokens is the most document text sent in one prompt; chunk_tokens is the chunk size
+# for retrieval and map_reduce. Overridden by config.LLM_BUDGETS.
+DEFAULT_BUDGETS = {
+    "doc_summary": {"strategy": "map_reduce", "max_input_tokens": 60000, "chunk_tokens": 12000},
+    "ppt_creator": {"strategy": "head_tail", "max_input_tokens": 24000},
+    "doc_extraction": {"strategy": "retrieval", "max_input_tokens": 12000, "chunk_tokens": 800},
+    "chatgpt_general": {"strategy": "retrieval", "max_input_tokens": 16000, "chunk_tokens": 800},
+}
+
+# Used for apps without a budget of their own
+FALLBACK_BUDGET = {"strategy": "head_tail", "max_input_tokens": 32000, "chunk_tokens": 4000}
+
+# Share of a head/tail budget given to the beginning of the document
+HEAD_FRACTION = 0.7
+
+# Map-reduce passes before whatever is left over budget is cut with head/tail
+MAX_REDUCE_ROUNDS = 2
+
+STRATEGIES = ("head_tail", "retrieval", "map_reduce")
+
+_stats = defaultdict(lambda: {
+    "checked": 0, "within_budget": 0, "head_tail": 0, "retrieval": 0, "map_reduce": 0,
+    "tokens_in": 0, "tokens_out": 0,
+})
+_stats_lock = threading.Lock()
+
+
+def get_budget(app_id):
+    """Budget of an app, with config overrides applied"""
+    budget = {**FALLBACK_BUDGET, **DEFAULT_BUDGETS.get(app_id, {})}
+    budget.update(config.LLM_BUDGETS.get(app_id, {}))
+    return budget
+
+
+def _encoding_name(deployment):
+    return llm_router.get_profile(deployment).get("encoding", "o200k_base") if deployment else "o200k_base"
+
+
+def count_tokens(text, deployment=None):
+    """Tokens of a piece of text in the deployment's encoding"""
+    return llm_router.count_text_tokens(text, _encoding_name(deployment))
+
+
+def over_budget(app_id, text, deployment=None):
+    """True if a document is too long to go into the app's prompt as it is"""
+    return count_tokens(text or "", deployment) > get_budget(app_id)["max_input_tokens"]
+
+
+def _cut(text, max_tokens, encoding_name, from_end=False):
+    """The first (or last) max_tokens tokens of a text"""
+    if max_tokens <= 0:
+        return ""
+    encoding = llm_router._encoding(encoding_name)
+    if encoding is None:
+        return text[-max_tokens * 4:] if from_end else text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    return encoding.decode(tokens[-max_tokens:] if from_end else tokens[:max_tokens])
+
+
+def _pieces(text, max_tokens, encoding_name):
+    """A text cut at token boundaries into pieces of max_tokens tokens"""
+    encoding = llm_router._encoding(encoding_name)
+    if encoding is None:
+        return [text[start:start + max_tokens * 4] for start in range(0, len(text), max_tokens * 4)]
+    tokens = encoding.encode(text, disallowed_special=())
+    return [encoding.decode(tokens[start:start + max_tokens]) for start in range(0, len(tokens), max_tokens)]
+
+
+def split(text, chunk_tokens, deployment=None):
+    """
+    Split text into chunks of at most chunk_tokens tokens.
+
+    Paragraphs are kept together where they fit; a paragraph longer than a chunk is cut at
+    token boundaries.
+    """
+    encoding_name = _encoding_name(deployment)
+    chunks, current, current_tokens = [], [], 0
+    for paragraph in re.split(r"\n\s*\n", text):
+        if not paragraph.strip():
+            continue
+        tokens = llm_router.count_text_tokens(paragraph, encoding_name)
+        if current and current_tokens + tokens > chunk_tokens:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        if tokens > chunk_tokens:
+            chunks.extend(_pieces(paragraph, chunk_tokens, encoding_name))
+            continue
+        current.append(paragraph)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def head_tail(text, max_tokens, deployment=None):
+    """The beginning and the end of a text within max_tokens, with a marker where the middle was"""
+    encoding_name = _encoding_name(deployment)
+    total = llm_router.count_text_tokens(text, encoding_name)
+    if total <= max_tokens:
+        return text
+    # Room for the marker
+    max_tokens -= 20
+    head_tokens = int(max_tokens * HEAD_FRACTION)
+    tail_tokens = max_tokens - head_tokens
+    omitted = total - head_tokens - tail_tokens
+    return (
+        f"{_cut(text, head_tokens, encoding_name)}\n\n"
+        f"[... about {omitted} tokens omitted ...]\n\n"
+        f"{_cut(text, tail_tokens, encoding_name, from_end=True)}"
+    )
+
+
+def _terms(text):
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def retrieve(text, query, max_tokens, chunk_tokens, deployment=None):
+    """
+    The chunks of a text that best match a query, within max_tokens and in document order.
+
+    Chunks are scored by the query terms they contain, weighted by how rare each term is
+    across the chunks. Without query terms this is head_tail.
+    """
+    query_terms = set(_terms(query or ""))
+    if not query_terms:
+        return head_tail(text, max_tokens, deployment)
+
+    encoding_name = _encoding_name(deployment)
+    chunks = split(text, chunk_tokens, deployment)
+    chunk_terms = [Counter(_terms(chunk)) for chunk in chunks]
+    document_frequency = Counter(term for terms in chunk_terms for term in query_terms if term in terms)
+
+    def score(index):
+        terms = chunk_terms[index]
+        return sum(
+            (1 + math.log(terms[term])) * math.log(1 + len(chunks) / document_frequency[term])
+            for term in query_terms if terms[term]
+        )
+
+    selected, used = [], 0
+    for index in sorted(range(len(chunks)), key=lambda index: (-score(index), index)):
+        tokens = llm_router.count_text_tokens(chunks[index], encoding_name)
+        if used + tokens > max_tokens:
+            continue
+        selected.append(index)
+        used += tokens
+    return "\n\n[...]\n\n".join(chunks[index] for index in sorted(selected))
+
+
+def map_reduce(text, worker, max_tokens, chunk_tokens, deployment=None, on_progress=None):
+    """
+    Condense a text until it fits max_tokens by running the coroutine function worker(chunk)
+    on every chunk with llm_fanout and joining the results.
+
+    A chunk whose call fails keeps a head/tail cut of its text. If the joined results are still
+    over budget after MAX_REDUCE_ROUNDS passes, they are cut with head_tail.
+    """
+    for _ in range(MAX_REDUCE_ROUNDS):
+        if count_tokens(text, deployment) <= max_tokens:
+            return text
+        chunks = split(text, chunk_tokens, deployment)
+        results = llm_fanout.run(chunks, worker, on_progress=on_progress)
+        share = max_tokens // len(chunks)
+        text = "\n\n".join(
+            result.value if result.ok and result.value else head_tail(chunks[result.index], share, deployment)
+            for result in results
+        )
+    return head_tail(text, max_tokens, deployment)
+
+
+def fit(app_id, text, query=None, worker=None, deployment=None, max_tokens=None, on_progress=None):
+    """
+    Count a document's tokens before it goes into a prompt and apply the app's strategy if it
+    is over budget.
+
+    query is what retrieval ranks chunks against; worker is the map step of map_reduce
+    (an async function condensing one chunk to text). A strategy whose input is missing
+    falls back to head_tail. max_tokens overrides the app's max_input_tokens.
+    """
+    budget = get_budget(app_id)
+    max_tokens = max_tokens or budget["max_input_tokens"]
+    # Leave room for the instructions and the answer on small-context deployments
+    if deployment:
+        max_tokens = min(max_tokens, llm_router.get_profile(deployment)["context_tokens"] // 2)
+
+    tokens_in = count_tokens(text or "", deployment)
+    if tokens_in <= max_tokens:
+        _record(app_id, None, tokens_in, tokens_in)
+        return text
+
+    strategy = budget["strategy"]
+    if (strategy == "retrieval" and not query) or (strategy == "map_reduce" and worker is None) or strategy not in STRATEGIES:
+        strategy = "head_tail"
+
+    if strategy == "retrieval":
+        fitted = retrieve(text, query, max_tokens, budget["chunk_tokens"], deployment)
+    elif strategy == "map_reduce":
+        fitted = map_reduce(text, worker, max_tokens, budget["chunk_tokens"], deployment, on_progress)
+    else:
+        fitted = head_tail(text, max_tokens, deployment)
+
+    tokens_out = count_tokens(fitted, deployment)
+    logger.info(f"Token budget: app={app_id} strategy={strategy} tokens {tokens_in} -> {tokens_out} (budget {max_tokens})")
+    _record(app_id, strategy, tokens_in, tokens_out)
+    return fitted
+
+
+def _record(app_id, strategy, tokens_in, tokens_out):
+    with _stats_lock:
+        counts = _stats[app_id]
+        counts["checked"] += 1
+        counts[strategy or "within_budget"] += 1
+        counts["tokens_in"] += tokens_in
+        counts["tokens_out"] += tokens_out
+
+
+def stats():
+    """How often each app's documents were within budget or needed each strategy"""
+    with _stats_lock:
+        return {app_id: dict(counts) for app_id, counts in _stats.items()}
+
+
+metrics.register_stats("llm_budget", stats, labels=("app",))
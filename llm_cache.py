@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+
+import config
+import metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Request arguments that do not change the response
+KEY_EXCLUDED_ARGS = {"stream", "stream_options", "timeout", "user"}
+
+# Responses cut short or filtered are not worth replaying
+CACHEABLE_FINISH_REASONS = {"stop", "tool_calls"}
+
+# When the disk tier is over its cap it is trimmed back to this fraction of it
+DISK_TRIM_TARGET = 0.9
+
+
+def _normalise_message(message):
+    """Drop empty fields and normalise whitespace so trivially different prompts share a key"""
+    normalised = {}
+    for field, value in dict(message).items():
+        if value is None:
+            continue
+        if field == "content" and isinstance(value, str):
+            value = value.replace("\r\n", "\n").strip()
+        normalised[field] = value
+    return normalised
+
+
+def cache_key(kwargs):
+    """Hash the deployment, the normalised messages and the generation parameters of a call"""
+    request = {name: value for name, value in kwargs.items() if name not in KEY_EXCLUDED_ARGS}
+    request["messages"] = [_normalise_message(message) for message in kwargs.get("messages") or []]
+    serialised = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialised.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier exact-match cache of serialised model responses.
+
+    An in-memory LRU (bounded by entries and bytes) sits in front of a directory of
+    JSON files (bounded by total size). Entries expire after ttl_seconds in both tiers.
+    """
+
+    def __init__(self, directory, ttl_seconds, memory_entries, memory_bytes, disk_bytes):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.memory_entries = memory_entries
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = None
+        self._lock = threading.Lock()
+        self.app_stats = defaultdict(lambda: {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0})
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key, app_id):
+        """Return the cached payload for a key, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, payload = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.app_stats[app_id]["memory_hits"] += 1
+                    return payload
+                self._forget(key)
+
+        payload = self._read_disk(key, now)
+        with self._lock:
+            if payload is None:
+                self.app_stats[app_id]["misses"] += 1
+                return None
+            self.app_stats[app_id]["disk_hits"] += 1
+            self._remember(key, payload[0], payload[1])
+        return payload[1]
+
+    def set(self, key, app_id, payload):
+        """Store a payload in both tiers"""
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._remember(key, expires_at, payload)
+            self.app_stats[app_id]["stores"] += 1
+        self._write_disk(key, app_id, expires_at, payload)
+
+    def _remember(self, key, expires_at, payload):
+        size = len(payload)
+        if size > self.memory_bytes:
+            return
+        self._forget(key)
+        self._memory[key] = (expires_at, payload)
+        self._memory_size += size
+        while len(self._memory) > self.memory_entries or self._memory_size > self.memory_bytes:
+            _, (_, evicted) = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _forget(self, key):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_size -= len(entry[1])
+
+    def _read_disk(self, key, now):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Error reading cached response {key}: {str(e)}")
+            return None
+
+        if entry["expires_at"] <= now:
+            self._remove_file(path)
+            return None
+        # Touch the file so trimming removes the least recently used entries first
+        os.utime(path)
+        return entry["expires_at"], entry["payload"]
+
+    def _write_disk(self, key, app_id, expires_at, payload):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"app_id": app_id, "expires_at": expires_at, "payload": payload}, f)
+            size = os.path.getsize(temp_path)
+            os.replace(temp_path, path)
+        except Exception as e:
+            logger.error(f"Error writing cached response {key}: {str(e)}")
+            return
+
+        with self._lock:
+            if self._disk_size is None:
+                self._disk_size = self._scan_disk_size()
+            else:
+                self._disk_size += size
+            over_cap = self._disk_size > self.disk_bytes
+        if over_cap:
+            self.trim_disk()
+
+    def _scan_disk_size(self):
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for file_name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, file_name))
+                except OSError:
+                    pass
+        return total
+
+    def _remove_file(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            if self._disk_size is not None:
+                self._disk_size -= size
+
+    def trim_disk(self):
+        """Delete the least recently used files until the disk tier is back under its cap"""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for file_name in names:
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        target = self.disk_bytes * DISK_TRIM_TARGET
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+        with self._lock:
+            self._disk_size = total
+
+    def stats(self):
+        """Hit rates per app"""
+        with self._lock:
+            report = {}
+            for app_id, counts in self.app_stats.items():
+                lookups = counts["memory_hits"] + counts["disk_hits"] + counts["misses"]
+                hits = counts["memory_hits"] + counts["disk_hits"]
+                report[app_id] = {**counts, "hit_rate": hits / lookups if lookups else 0.0}
+            return report
+
+
+cache = ResponseCache(
+    directory=config.LLM_CACHE_DIR,
+    ttl_seconds=config.LLM_CACHE_TTL_SECONDS,
+    memory_entries=config.LLM_CACHE_MEMORY_ENTRIES,
+    memory_bytes=config.LLM_CACHE_MEMORY_MB * 1024 * 1024,
+    disk_bytes=config.LLM_CACHE_DISK_MB * 1024 * 1024,
+)
+
+
+def is_cacheable(response):
+    """Only complete, unfiltered responses are cached"""
+    choices = getattr(response, "choices", None) or []
+    return bool(choices) and all(choice.finish_reason in CACHEABLE_FINISH_REASONS for choice in choices)
+
+
+def cached_call(app_id, kwargs, call, response_type):
+    """
+    Return a cached response for these request arguments, or make the call and cache its result.
+
+    response_type is the pydantic model the payload is restored into (e.g. ChatCompletion).
+    """
+    if not config.LLM_CACHE_ENABLED:
+        return call()
+
+    key = cache_key(kwargs)
+    payload = cache.get(key, app_id)
+    if payload is not None:
+        try:
+            return response_type.model_validate_json(payload)
+        except Exception as e:
+            logger.error(f"Error restoring cached response {key}: {str(e)}")
+
+    response = call()
+    if is_cacheable(response):
+        cache.set(key, app_id, response.model_dump_json())
+    return response
+
+
+def stats():
+    """Cache hit rates per app"""
+    return cache.stats()
+
+
+metrics.register_stats("llm_cache", stats, labels=("app",))
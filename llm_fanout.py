@@ -0,0 +1,188 @@
+import queue
+import random
+import asyncio
+import logging
+import threading
+import contextvars
+from dataclasses import dataclass
+
+import config
+import Functions
+import llm_cache
+import llm_gateway
+import llm_router
+import llm_telemetry
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# How often the calling thread checks for finished items while it waits
+PROGRESS_POLL_SECONDS = 0.1
+
+# Streamlit session of the run() call an item belongs to, for telemetry recorded on the loop thread
+_session_id = contextvars.ContextVar("llm_fanout_session_id", default=None)
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+@dataclass
+class FanoutResult:
+    """Outcome of one item: its value, or the error it failed with after its retries"""
+    index: int
+    value: object = None
+    error: Exception = None
+    attempts: int = 0
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def _get_loop():
+    """Start the shared event loop thread the first time it is needed"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-fanout", daemon=True).start()
+        return _loop
+
+
+async def _run_item(index, item, worker, semaphore, retries, finished):
+    result = FanoutResult(index)
+    for attempt in range(1, retries + 2):
+        result.attempts = attempt
+        try:
+            async with semaphore:
+                result.value = await worker(item)
+            result.error = None
+            break
+        except Exception as e:
+            result.error = e
+            if attempt > retries or not llm_gateway._is_retryable(e):
+                break
+
+            retry_after = llm_gateway._retry_after(e)
+            if retry_after is not None:
+                delay = retry_after + random.uniform(0, 1)
+            else:
+                delay = random.uniform(0, min(llm_gateway.BACKOFF_MAX_SECONDS, llm_gateway.BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
+            logger.warning(f"Fan-out item {index} failed with {type(e).__name__}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    if result.error is not None:
+        logger.error(f"Fan-out item {index} failed after {result.attempts} attempt(s): {str(result.error)}")
+    finished.put(result)
+    return result
+
+
+async def _run_all(items, worker, concurrency, retries, finished, session_id):
+    _session_id.set(session_id)
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*(
+        _run_item(index, item, worker, semaphore, retries, finished) for index, item in enumerate(items)
+    ))
+
+
+def run(items, worker, concurrency=None, retries=None, on_progress=None):
+    """
+    Run the coroutine function worker(item) for every item concurrently and wait for all of them.
+
+    At most concurrency items run at once (config.LLM_FANOUT_CONCURRENCY by default). An item
+    that fails with a throttling or transient error is retried up to retries times; any other
+    failure only fails that item. Returns one FanoutResult per item, in the order of items.
+
+    on_progress(done, total) is called on the calling thread as items finish, so it can
+    update Streamlit elements (see progress_bar). Must not be called from a worker.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    finished = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(
+        _run_all(
+            items,
+            worker,
+            concurrency or config.LLM_FANOUT_CONCURRENCY,
+            config.LLM_FANOUT_RETRIES if retries is None else retries,
+            finished,
+            llm_telemetry.current_session_id(),
+        ),
+        _get_loop(),
+    )
+
+    done = 0
+    while done < len(items) and not future.done():
+        try:
+            finished.get(timeout=PROGRESS_POLL_SECONDS)
+        except queue.Empty:
+            continue
+        done += 1
+        if on_progress:
+            on_progress(done, len(items))
+
+    results = future.result()
+    if on_progress and done < len(items):
+        on_progress(len(items), len(items))
+    return results
+
+
+def progress_bar(bar, text=None):
+    """
+    Progress callback that drives a st.progress element.
+
+    text may use {done} and {total}, e.g. "Generated {done} of {total} images".
+    """
+    def on_progress(done, total):
+        bar.progress(done / total, text=text.format(done=done, total=total) if text else None)
+    return on_progress
+
+
+async def chat_completion(client, app_id, task=None, output_tokens=None, cache=False, deadline=None, **kwargs):
+    """
+    Async chat completion for fan-out workers, the counterpart of llm_router/llm_gateway.chat_completion.
+
+    client is a shared client from Functions.get_client; the matching async client is used.
+    Without a model the deployment is picked by llm_router for app_id (and task).
+    Admission goes through the gateway's per-deployment limits; retries are left to run().
+    """
+    if not kwargs.get("model"):
+        kwargs["model"] = llm_router.route(
+            app_id, kwargs.get("messages"), task=task, output_tokens=output_tokens or kwargs.get("max_tokens")
+        ).deployment
+
+    from openai.types.chat import ChatCompletion
+
+    key = llm_cache.cache_key(kwargs) if cache and config.LLM_CACHE_ENABLED else None
+    if key:
+        payload = await asyncio.to_thread(llm_cache.cache.get, key, app_id)
+        if payload is not None:
+            try:
+                return ChatCompletion.model_validate_json(payload)
+            except Exception as e:
+                logger.error(f"Error restoring cached response {key}: {str(e)}")
+
+    async_client = Functions.get_async_client(client).with_options(max_retries=0)
+    estimated_tokens = llm_gateway.estimate_tokens(kwargs)
+    async with llm_gateway.alimit(app_id, kwargs["model"], estimated_tokens, deadline) as limiter:
+        with llm_telemetry.track_call(app_id, kwargs["model"], "chat", session_id=_session_id.get()) as record:
+            response = await async_client.chat.completions.create(
+                timeout=deadline or config.LLM_DEFAULT_DEADLINE_SECONDS, **kwargs
+            )
+            llm_telemetry.set_usage(record, getattr(response, "usage", None))
+        limiter.reconcile(estimated_tokens, getattr(response, "usage", None))
+
+    if key and llm_cache.is_cacheable(response):
+        await asyncio.to_thread(llm_cache.cache.set, key, app_id, response.model_dump_json())
+    return response
+
+
+async def image_generation(client, app_id, deadline=None, **kwargs):
+    """Async image generation for fan-out workers, the counterpart of llm_gateway.image_generation"""
+    async_client = Functions.get_async_client(client).with_options(max_retries=0)
+    async with llm_gateway.alimit(app_id, kwargs.get("model"), 0, deadline):
+        with llm_telemetry.track_call(app_id, kwargs.get("model"), "image", session_id=_session_id.get()):
+            return await async_client.images.generate(timeout=deadline or config.LLM_DEFAULT_DEADLINE_SECONDS, **kwargs)
@@ -0,0 +1,601 @@
+import os
+import re
+import json
+import time
+import uuid
+import base64
+import random
+import asyncio
+import hashlib
+import inspect
+import logging
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+
+import config
+import metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Only Azure OpenAI API calls are recorded (not image downloads made with the same client library)
+RECORDED_PATH_PREFIXES = ("/openai/",)
+
+# Response headers kept in a fixture; everything else (request ids, regions, keys) is dropped
+KEPT_RESPONSE_HEADERS = {
+    "content-type", "retry-after", "retry-after-ms",
+    "x-ratelimit-remaining-requests", "x-ratelimit-remaining-tokens",
+}
+
+# Personal data and credentials replaced before anything is written. Applied to every string in
+# request and response bodies and to the recorded arguments; the placeholders do not match
+# again, so scrubbing a live request at replay time gives the same key as at recording time.
+SCRUB_PATTERNS = [
+    (re.compile(r"(?i)\b(api[-_ ]?key|password|secret|token|authorization)(\s*[:=]\s*)[^\s,;\"']+"), r"\1\2<secret>"),
+    (re.compile(r"(?i)\bbearer\s+[\w\-.~+/]+=*"), "Bearer <secret>"),
+    (re.compile(r"\beyJ[\w-]+\.[\w-]+\.[\w-]+"), "<token>"),
+    (re.compile(r"(https?://[^\s\"'?]+)\?[^\s\"']+"), r"\1?<query>"),
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "<email>"),
+    (re.compile(r"(?:\+27|\b0)\d{2}[ -]?\d{3}[ -]?\d{4}\b"), "<phone>"),
+    (re.compile(r"\b(?:\d[ -]?){12,18}\d\b"), "<number>"),
+    (re.compile(r"\b[0-9a-f]{32,}\b"), "<secret>"),
+]
+
+# Episode currently being recorded or replayed by this thread (or coroutine)
+_episode = contextvars.ContextVar("llm_fixtures_episode", default=None)
+
+_stats = {
+    "recorded_episodes": 0,
+    "recorded_calls": 0,
+    "replayed_calls": 0,
+    "exact_matches": 0,
+    "fallback_matches": 0,
+    "misses": 0,
+}
+_stats_lock = threading.Lock()
+_index = None
+_index_lock = threading.Lock()
+
+
+def _httpx():
+    """The HTTP library the openai SDK is built on (httpx2 in newer releases, httpx before)"""
+    try:
+        import httpx2
+        return httpx2
+    except ImportError:
+        import httpx
+        return httpx
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def scrub(value):
+    """A copy of a string, or of the strings in a JSON-like value, with secrets and personal data replaced"""
+    if isinstance(value, str):
+        for pattern, replacement in SCRUB_PATTERNS:
+            value = pattern.sub(replacement, value)
+        return value
+    if isinstance(value, dict):
+        return {key: scrub(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [scrub(item) for item in value]
+    return value
+
+
+def scrub_body(text, content_type):
+    """Scrub a JSON, server-sent events or plain text body, keeping its format"""
+    if "json" in content_type:
+        try:
+            return json.dumps(scrub(json.loads(text)), ensure_ascii=False)
+        except ValueError:
+            return scrub(text)
+    if "event-stream" in content_type:
+        lines = []
+        for line in text.split("\n"):
+            if line.startswith("data: ") and line[6:].strip() != "[DONE]":
+                try:
+                    line = "data: " + json.dumps(scrub(json.loads(line[6:])), ensure_ascii=False)
+                except ValueError:
+                    line = scrub(line)
+            lines.append(line)
+        return "\n".join(lines)
+    return scrub(text)
+
+
+def _operation(path):
+    """The API operation of a request path, without the deployment (e.g. "chat/completions")"""
+    match = re.search(r"/deployments/[^/]+/(.+)$", path)
+    return match.group(1) if match else path
+
+
+def _deployment(path):
+    match = re.search(r"/deployments/([^/]+)/", path)
+    return match.group(1) if match else None
+
+
+def describe_request(request):
+    """The scrubbed, comparable parts of an httpx request"""
+    content_type = request.headers.get("content-type", "")
+    data = request.read()
+    body = None
+    if "json" in content_type and data:
+        try:
+            body = scrub(json.loads(data))
+        except ValueError:
+            body = None
+    if body is not None:
+        canonical = json.dumps(body, sort_keys=True, ensure_ascii=False)
+    else:
+        # Uploads (audio files) are not kept; their content and size identify them
+        canonical = hashlib.sha256(data).hexdigest()
+    path = request.url.path
+    return {
+        "method": request.method,
+        "path": path,
+        "operation": _operation(path),
+        "deployment": _deployment(path),
+        "stream": bool(isinstance(body, dict) and body.get("stream")),
+        "key": hashlib.sha256(f"{request.method} {path} {canonical}".encode("utf-8")).hexdigest(),
+        "request_bytes": len(data),
+        "request": body if body is not None else {"content_type": content_type.split(";")[0], "size": len(data)},
+    }
+
+
+def is_recorded(request):
+    return request.url.path.startswith(RECORDED_PATH_PREFIXES)
+
+
+class Episode:
+    """The model calls made by one run of a recorded function, with its arguments and timing"""
+
+    def __init__(self, label, entry, args):
+        self.label = label
+        self.entry = entry
+        self.args = args
+        self.session_state = {}
+        self.calls = []
+        self.started = time.perf_counter()
+        self.recorded_at = datetime.now()
+        self._lock = threading.Lock()
+
+    def add(self, call):
+        with self._lock:
+            self.calls.append(call)
+
+    def to_dict(self):
+        with self._lock:
+            calls = sorted(self.calls, key=lambda call: call["started_ms"])
+        return {
+            "label": self.label,
+            "entry": self.entry,
+            "recorded_at": self.recorded_at.isoformat(timespec="seconds"),
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "args": self.args,
+            "session_state": self.session_state,
+            "calls": calls,
+        }
+
+    def save(self, directory=None):
+        """Write the episode under directory/label/ and drop the oldest beyond LLM_FIXTURES_MAX_EPISODES"""
+        label_dir = os.path.join(directory or config.LLM_FIXTURES_DIR, self.label)
+        os.makedirs(label_dir, exist_ok=True)
+        path = os.path.join(label_dir, f"{self.recorded_at:%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}.json")
+        data = json.dumps(self.to_dict(), ensure_ascii=False, indent=1)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(data)
+
+        episodes = sorted(name for name in os.listdir(label_dir) if name.endswith(".json"))
+        for name in episodes[:max(0, len(episodes) - config.LLM_FIXTURES_MAX_EPISODES)]:
+            os.remove(os.path.join(label_dir, name))
+        return path
+
+
+class _Recorder:
+    """Collects a response body as it is read, then adds the finished call to its episode"""
+
+    def __init__(self, episode, request, response, started):
+        self.episode = episode
+        self.call = describe_request(request)
+        self.call["started_ms"] = round((started - episode.started) * 1000, 1)
+        self.call["status"] = response.status_code
+        self.call["headers"] = {
+            name: value for name, value in response.headers.items() if name.lower() in KEPT_RESPONSE_HEADERS
+        }
+        self.call["headers_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        self.headers = response.headers
+        self.received = time.perf_counter()
+        self.parts = []
+        self.offsets = []
+        self.finished = False
+
+    def add(self, chunk):
+        self.parts.append(chunk)
+        self.offsets.append((round((time.perf_counter() - self.received) * 1000, 1), len(chunk)))
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        try:
+            httpx = _httpx()
+            # The transport sees the body as sent; decode gzip and the like the way the client would
+            raw = b"".join(self.parts)
+            encoding = self.headers.get("content-encoding")
+            data = httpx.Response(200, headers={"content-encoding": encoding} if encoding else {}, content=raw).content
+            content_type = self.headers.get("content-type", "")
+            try:
+                self.call["body"] = scrub_body(data.decode("utf-8"), content_type)
+            except UnicodeDecodeError:
+                self.call["body"] = base64.b64encode(data).decode("ascii")
+                self.call["body_encoding"] = "base64"
+
+            total, seen, chunks = len(raw) or 1, 0, []
+            for offset_ms, size in self.offsets:
+                seen += size
+                chunks.append([offset_ms, round(seen / total, 4)])
+            self.call["chunks"] = chunks
+            self.call["total_ms"] = round(self.call["headers_ms"] + (chunks[-1][0] if chunks else 0), 1)
+            self.episode.add(self.call)
+            _count("recorded_calls")
+        except Exception as e:
+            logger.error(f"Error recording LLM call: {str(e)}")
+
+
+def _make_recording_transports():
+    httpx = _httpx()
+
+    class RecordingStream(httpx.SyncByteStream):
+        def __init__(self, stream, recorder):
+            self._stream = stream
+            self._recorder = recorder
+
+        def __iter__(self):
+            for chunk in self._stream:
+                self._recorder.add(chunk)
+                yield chunk
+
+        def close(self):
+            # Also reached when the caller stops reading a stream early
+            self._stream.close()
+            self._recorder.finish()
+
+    class AsyncRecordingStream(httpx.AsyncByteStream):
+        def __init__(self, stream, recorder):
+            self._stream = stream
+            self._recorder = recorder
+
+        async def __aiter__(self):
+            async for chunk in self._stream:
+                self._recorder.add(chunk)
+                yield chunk
+
+        async def aclose(self):
+            await self._stream.aclose()
+            self._recorder.finish()
+
+    def recorded_response(request, response, stream):
+        return httpx.Response(response.status_code, headers=response.headers, stream=stream, extensions=response.extensions, request=request)
+
+    class RecordingTransport(httpx.BaseTransport):
+        """Passes requests to the real transport and records those made inside a recorded episode"""
+
+        def __init__(self, transport):
+            self.transport = transport
+
+        def handle_request(self, request):
+            episode = _episode.get()
+            if not isinstance(episode, Episode) or not is_recorded(request):
+                return self.transport.handle_request(request)
+            started = time.perf_counter()
+            response = self.transport.handle_request(request)
+            recorder = _Recorder(episode, request, response, started)
+            return recorded_response(request, response, RecordingStream(response.stream, recorder))
+
+        def close(self):
+            self.transport.close()
+
+    class AsyncRecordingTransport(httpx.AsyncBaseTransport):
+        def __init__(self, transport):
+            self.transport = transport
+
+        async def handle_async_request(self, request):
+            episode = _episode.get()
+            if not isinstance(episode, Episode) or not is_recorded(request):
+                return await self.transport.handle_async_request(request)
+            started = time.perf_counter()
+            response = await self.transport.handle_async_request(request)
+            recorder = _Recorder(episode, request, response, started)
+            return recorded_response(request, response, AsyncRecordingStream(response.stream, recorder))
+
+        async def aclose(self):
+            await self.transport.aclose()
+
+    return RecordingTransport, AsyncRecordingTransport
+
+
+class Replay:
+    """
+    Recorded calls to answer requests from.
+
+    A request gets the recorded call with the same key (the same scrubbed request), else -
+    because changed chunking or prompts change the requests - the recorded call of the same
+    operation and streaming mode closest in request size, preferring the same deployment.
+    Within an episode each recorded call answers once while unused ones remain.
+    """
+
+    def __init__(self, calls, strict=False):
+        self.calls = list(calls)
+        self.strict = strict
+        self.used = [0] * len(self.calls)
+        self.stats = {"calls": 0, "exact": 0, "fallback": 0, "misses": 0, "throttled": 0}
+        self._lock = threading.Lock()
+
+    def match(self, described):
+        with self._lock:
+            self.stats["calls"] += 1
+            exact = [i for i, call in enumerate(self.calls) if call["key"] == described["key"]]
+            similar = [] if self.strict else [
+                i for i, call in enumerate(self.calls)
+                if call["operation"] == described["operation"] and call.get("stream") == described["stream"]
+            ]
+            for candidates, kind in ((exact, "exact"), (similar, "fallback")):
+                if not candidates:
+                    continue
+                unused = [i for i in candidates if not self.used[i]] or candidates
+                best = min(unused, key=lambda i: (
+                    self.used[i],
+                    self.calls[i].get("deployment") != described["deployment"],
+                    abs(self.calls[i].get("request_bytes", 0) - described["request_bytes"]),
+                ))
+                self.used[best] += 1
+                self.stats[kind] += 1
+                if self.calls[best]["status"] == 429:
+                    self.stats["throttled"] += 1
+                _count("exact_matches" if kind == "exact" else "fallback_matches")
+                _count("replayed_calls")
+                return self.calls[best]
+            self.stats["misses"] += 1
+            _count("misses")
+            return None
+
+
+def _load_index():
+    """Every recorded call under LLM_FIXTURES_DIR, for requests made outside a replayed episode"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            calls = []
+            for episode in load_episodes(config.LLM_FIXTURES_DIR):
+                calls.extend(episode["calls"])
+            _index = Replay(calls, strict=config.LLM_FIXTURES_STRICT)
+            logger.info(f"Loaded {len(calls)} recorded LLM calls from {config.LLM_FIXTURES_DIR}")
+        return _index
+
+
+def _replay_plan(request):
+    """The recorded call answering a request, as (call, body pieces with their delays)"""
+    replay = _episode.get()
+    if not isinstance(replay, Replay):
+        replay = _load_index()
+    described = describe_request(request)
+    call = replay.match(described)
+    if call is None:
+        return None, described
+
+    body = call.get("body", "")
+    data = base64.b64decode(body) if call.get("body_encoding") == "base64" else body.encode("utf-8")
+    pieces, start, previous_ms = [], 0, 0.0
+    for offset_ms, fraction in call.get("chunks") or [[0, 1]]:
+        end = len(data) if fraction >= 1 else int(len(data) * fraction)
+        pieces.append(((offset_ms - previous_ms) / 1000, data[start:end]))
+        start, previous_ms = end, offset_ms
+    if start < len(data):
+        pieces.append((0, data[start:]))
+    return call, pieces
+
+
+def _miss_response(request, described):
+    httpx = _httpx()
+    message = f"No recorded response for {described['method']} {described['operation']} ({described['deployment']})"
+    logger.warning(message)
+    return httpx.Response(404, json={"error": {"code": "FixtureNotFound", "message": message}}, request=request)
+
+
+def _make_replay_transports():
+    httpx = _httpx()
+
+    class ReplayStream(httpx.SyncByteStream):
+        def __init__(self, pieces, speed):
+            self.pieces = pieces
+            self.speed = speed
+
+        def __iter__(self):
+            for delay, piece in self.pieces:
+                if delay > 0 and self.speed:
+                    time.sleep(delay * self.speed)
+                yield piece
+
+    class AsyncReplayStream(httpx.AsyncByteStream):
+        def __init__(self, pieces, speed):
+            self.pieces = pieces
+            self.speed = speed
+
+        async def __aiter__(self):
+            for delay, piece in self.pieces:
+                if delay > 0 and self.speed:
+                    await asyncio.sleep(delay * self.speed)
+                yield piece
+
+    class ReplayTransport(httpx.BaseTransport):
+        """Answers requests from recorded calls with their original timing; nothing goes over the network"""
+
+        def handle_request(self, request):
+            call, pieces = _replay_plan(request)
+            if call is None:
+                return _miss_response(request, pieces)
+            time.sleep(call["headers_ms"] / 1000 * config.LLM_FIXTURES_SPEED)
+            return httpx.Response(call["status"], headers=call["headers"], stream=ReplayStream(pieces, config.LLM_FIXTURES_SPEED), request=request)
+
+    class AsyncReplayTransport(httpx.AsyncBaseTransport):
+        async def handle_async_request(self, request):
+            call, pieces = _replay_plan(request)
+            if call is None:
+                return _miss_response(request, pieces)
+            await asyncio.sleep(call["headers_ms"] / 1000 * config.LLM_FIXTURES_SPEED)
+            return httpx.Response(call["status"], headers=call["headers"], stream=AsyncReplayStream(pieces, config.LLM_FIXTURES_SPEED), request=request)
+
+    return ReplayTransport, AsyncReplayTransport
+
+
+def transport(limits=None):
+    """
+    The httpx transport for an Azure OpenAI client in the current LLM_FIXTURES_MODE.
+
+    None when fixtures are off, so the client builds its usual transport.
+    """
+    if config.LLM_FIXTURES_MODE == "record":
+        httpx = _httpx()
+        RecordingTransport, _ = _make_recording_transports()
+        return RecordingTransport(httpx.HTTPTransport(limits=limits) if limits else httpx.HTTPTransport())
+    if config.LLM_FIXTURES_MODE == "replay":
+        ReplayTransport, _ = _make_replay_transports()
+        return ReplayTransport()
+    return None
+
+
+def async_transport(limits=None):
+    """Like transport(), for async clients"""
+    if config.LLM_FIXTURES_MODE == "record":
+        httpx = _httpx()
+        _, AsyncRecordingTransport = _make_recording_transports()
+        return AsyncRecordingTransport(httpx.AsyncHTTPTransport(limits=limits) if limits else httpx.AsyncHTTPTransport())
+    if config.LLM_FIXTURES_MODE == "replay":
+        _, AsyncReplayTransport = _make_replay_transports()
+        return AsyncReplayTransport()
+    return None
+
+
+def http_client():
+    """An httpx client for LangChain models (http_client=...), or None when fixtures are off"""
+    sync_transport = transport()
+    if sync_transport is None:
+        return None
+    httpx = _httpx()
+    return httpx.Client(transport=sync_transport)
+
+
+def _recordable_args(signature, args, kwargs):
+    """The call's arguments as scrubbed JSON; clients and Streamlit containers become markers, other objects are left out"""
+    recorded = {}
+    for name, value in signature.bind(*args, **kwargs).arguments.items():
+        # Containers answer any attribute, so they are told apart from clients first
+        if type(value).__name__ == "DeltaGenerator":
+            recorded[name] = {"__container__": True}
+        elif hasattr(value, "chat") and hasattr(value, "_api_version"):
+            recorded[name] = {"__client__": value._api_version}
+        else:
+            try:
+                json.dumps(value)
+            except (TypeError, ValueError):
+                continue
+            recorded[name] = scrub(value)
+    return recorded
+
+
+def _recordable_session_state(session_keys):
+    if not session_keys:
+        return {}
+    import streamlit as st
+    return {key: scrub(st.session_state[key]) for key in session_keys if key in st.session_state}
+
+
+def recorded(label, session_keys=()):
+    """
+    Record the model calls a function makes, as one episode per call, when LLM_FIXTURES_MODE is "record".
+
+    A sample (LLM_FIXTURES_SAMPLE_RATE) of the calls that succeed is written to
+    LLM_FIXTURES_DIR/label/ together with the function's arguments and the session_keys it
+    reads from st.session_state, so the episode can be replayed by calling the function again
+    (see benchmarks/fixture_replay.py). Calls made inside another recorded function belong to
+    the outer episode.
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if (config.LLM_FIXTURES_MODE != "record" or _episode.get() is not None
+                    or random.random() >= config.LLM_FIXTURES_SAMPLE_RATE):
+                return fn(*args, **kwargs)
+
+            try:
+                episode = Episode(label, f"{fn.__module__}:{fn.__qualname__}", _recordable_args(signature, args, kwargs))
+                episode.session_state = _recordable_session_state(session_keys)
+            except Exception as e:
+                logger.error(f"Error starting LLM fixture episode {label}: {str(e)}")
+                return fn(*args, **kwargs)
+
+            token = _episode.set(episode)
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                _episode.reset(token)
+            try:
+                episode.save()
+                _count("recorded_episodes")
+            except Exception as e:
+                logger.error(f"Error saving LLM fixture episode {label}: {str(e)}")
+            return result
+
+        return wrapper
+    return decorator
+
+
+def load_episodes(directory, labels=None):
+    """Every episode recorded under directory (optionally only some labels), oldest first per label"""
+    episodes = []
+    if not os.path.isdir(directory):
+        return episodes
+    for label in sorted(os.listdir(directory)):
+        label_dir = os.path.join(directory, label)
+        if not os.path.isdir(label_dir) or (labels and label not in labels):
+            continue
+        for name in sorted(os.listdir(label_dir)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(label_dir, name), encoding="utf-8") as f:
+                    episode = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Error loading LLM fixture {name}: {str(e)}")
+                continue
+            episode["file"] = os.path.join(label, name)
+            episodes.append(episode)
+    return episodes
+
+
+@contextmanager
+def replaying(episode, strict=None):
+    """Answer the model calls made in this context from one recorded episode; yields its Replay"""
+    replay = Replay(episode["calls"], config.LLM_FIXTURES_STRICT if strict is None else strict)
+    token = _episode.set(replay)
+    try:
+        yield replay
+    finally:
+        _episode.reset(token)
+
+
+def stats():
+    """Episodes and calls recorded, and how replayed calls were matched"""
+    with _stats_lock:
+        return dict(_stats, mode=config.LLM_FIXTURES_MODE or "off")
+
+
+metrics.register_stats("llm_fixtures", stats)
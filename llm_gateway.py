@@ -0,0 +1,484 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
+
+import config
+import metrics
+import llm_cache
+import llm_telemetry
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Azure OpenAI quota per deployment. tpm/rpm of None means that dimension is not limited.
+# Overridden per deployment by config.LLM_DEPLOYMENT_LIMITS; "default" covers unlisted deployments.
+DEFAULT_LIMITS = {
+    "gpt4o": {"tpm": 150000, "rpm": 900, "concurrency": 10},
+    "gpt4omini": {"tpm": 300000, "rpm": 1800, "concurrency": 20},
+    "gpt-4o-mini": {"tpm": 300000, "rpm": 1800, "concurrency": 20},
+    "Dalle3": {"tpm": None, "rpm": 6, "concurrency": 2},
+    "default": {"tpm": 100000, "rpm": 600, "concurrency": 8},
+}
+
+# Completion tokens reserved for a call that does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 1000
+
+# Full-jitter exponential backoff between attempts when the service gives no Retry-After
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+
+# A single attempt always gets at least this long, even close to the deadline
+MIN_ATTEMPT_TIMEOUT_SECONDS = 1.0
+
+
+class LLMGatewayError(Exception):
+    """A model call could not be completed within its deadline or retry budget"""
+
+
+class TokenBucket:
+    """Per-minute budget that refills continuously; callers wait until enough is available"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.available = float(per_minute)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount, deadline):
+        """Take amount from the bucket, waiting at most until deadline (time.monotonic()). False on timeout."""
+        # A request larger than the whole bucket is let through once the bucket is full
+        amount = min(amount, self.capacity)
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.available >= amount:
+                    self.available -= amount
+                    return True
+
+                wait = max(self.paused_until - now, (amount - self.available) / self.rate)
+                if now + wait > deadline:
+                    return False
+                self._cond.wait(wait)
+
+    def refund(self, amount):
+        """Return (or, if negative, take) budget after the real cost of a call is known"""
+        with self._cond:
+            self._refill(time.monotonic())
+            self.available = min(self.capacity, self.available + amount)
+            self._cond.notify_all()
+
+    def pause(self, seconds):
+        """Admit nothing for a while, e.g. after the service answered 429"""
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class DeploymentLimiter:
+    """Concurrency, TPM and RPM admission for one deployment, plus its metrics"""
+
+    def __init__(self, deployment, tpm=None, rpm=None, concurrency=8):
+        self.deployment = deployment
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.concurrency = concurrency
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.metrics = {
+            "calls": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "retries": 0,
+            "throttled": 0,
+            "rejected": 0,
+            "admitted": 0,
+            "in_flight": 0,
+            "admission_wait_ms_total": 0.0,
+            "admission_wait_ms_max": 0.0,
+            "latency_ms_total": 0.0,
+        }
+        self._metrics_lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self._metrics_lock:
+            self.metrics[name] += amount
+
+    def admit(self, estimated_tokens, deadline):
+        """Wait for a request slot, token budget and a free concurrency slot. False if the deadline passes first."""
+        started = time.monotonic()
+        if self.requests and not self.requests.acquire(1, deadline):
+            return False
+        if self.tokens and not self.tokens.acquire(estimated_tokens, deadline):
+            if self.requests:
+                self.requests.refund(1)
+            return False
+        if not self.semaphore.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            if self.requests:
+                self.requests.refund(1)
+            if self.tokens:
+                self.tokens.refund(estimated_tokens)
+            return False
+
+        waited_ms = (time.monotonic() - started) * 1000
+        with self._metrics_lock:
+            self.metrics["admitted"] += 1
+            self.metrics["in_flight"] += 1
+            self.metrics["admission_wait_ms_total"] += waited_ms
+            self.metrics["admission_wait_ms_max"] = max(self.metrics["admission_wait_ms_max"], waited_ms)
+        return True
+
+    def release(self):
+        self.count("in_flight", -1)
+        self.semaphore.release()
+
+    def throttle(self, seconds):
+        """Hold back every caller of this deployment after a 429"""
+        self.count("throttled")
+        for bucket in (self.requests, self.tokens):
+            if bucket:
+                bucket.pause(seconds)
+
+    def is_throttled(self):
+        """True while a 429 pause is in effect or every concurrency slot is taken"""
+        now = time.monotonic()
+        if any(bucket and bucket.paused_until > now for bucket in (self.requests, self.tokens)):
+            return True
+        with self._metrics_lock:
+            return self.metrics["in_flight"] >= self.concurrency
+
+    def reconcile(self, estimated_tokens, usage):
+        """Correct the token budget with the usage the service reported"""
+        total_tokens = getattr(usage, "total_tokens", None) if usage is not None else None
+        if self.tokens and total_tokens is not None:
+            self.tokens.refund(estimated_tokens - total_tokens)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Lets concurrent identical requests share one upstream call and its result or error"""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.app_stats = defaultdict(lambda: {"upstream": 0, "coalesced": 0})
+
+    def do(self, key, app_id, call):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.app_stats[app_id]["upstream"] += 1
+            else:
+                self.app_stats[app_id]["coalesced"] += 1
+
+        if not leader:
+            # The leader's own deadline bounds how long this can take
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            # Each caller gets its own copy so one session cannot change another's response
+            return flight.result.model_copy(deep=True) if hasattr(flight.result, "model_copy") else flight.result
+
+        try:
+            flight.result = call()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {app_id: dict(counts) for app_id, counts in self.app_stats.items()}
+
+
+single_flight = SingleFlight()
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(deployment):
+    """Return the process-wide limiter for a deployment"""
+    deployment = deployment or "default"
+    with _limiters_lock:
+        if deployment not in _limiters:
+            if deployment in DEFAULT_LIMITS:
+                limits = dict(DEFAULT_LIMITS[deployment])
+            else:
+                limits = {**DEFAULT_LIMITS["default"], **config.LLM_DEPLOYMENT_LIMITS.get("default", {})}
+            limits.update(config.LLM_DEPLOYMENT_LIMITS.get(deployment, {}))
+            _limiters[deployment] = DeploymentLimiter(deployment, **limits)
+        return _limiters[deployment]
+
+
+def is_throttled(deployment):
+    """True if calls to a deployment would currently have to wait (used by llm_router to pick another one)"""
+    with _limiters_lock:
+        limiter = _limiters.get(deployment)
+    return limiter is not None and limiter.is_throttled()
+
+
+def estimate_tokens(kwargs):
+    """Rough prompt + completion token estimate for admission (about 4 characters per token)"""
+    characters = 0
+    for message in kwargs.get("messages") or []:
+        content = message.get("content") if isinstance(message, dict) else None
+        if isinstance(content, str):
+            characters += len(content)
+        elif isinstance(content, list):
+            characters += sum(len(part.get("text", "")) for part in content if isinstance(part, dict))
+    characters += len(kwargs.get("prompt") or "")
+    return characters // 4 + (kwargs.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+
+
+def _retry_after(error):
+    """Seconds the service asked us to wait, if it said"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+def _is_retryable(error):
+    import openai
+    return isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError))
+
+
+def _is_throttle(error):
+    import openai
+    return isinstance(error, openai.RateLimitError)
+
+
+class _ReleasingStream:
+    """Passes a stream through and frees the deployment slot once it is consumed, closed or dropped"""
+
+    def __init__(self, stream, limiter):
+        self._stream = stream
+        self._limiter = limiter
+        self._released = False
+
+    def __iter__(self):
+        try:
+            yield from self._stream
+        finally:
+            self.close()
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._limiter.release()
+
+    def __del__(self):
+        self.close()
+
+
+def _call(app_id, deployment, estimated_tokens, deadline, attempt, stream=False):
+    """
+    Run attempt(timeout) under the deployment's limits, retrying throttling and transient errors.
+
+    Non-retryable errors (bad requests, content filter, auth) are re-raised unchanged.
+    Running out of attempts or time raises LLMGatewayError.
+    """
+    limiter = get_limiter(deployment)
+    limiter.count("calls")
+    deadline_at = time.monotonic() + (deadline or config.LLM_DEFAULT_DEADLINE_SECONDS)
+
+    for attempt_number in range(1, config.LLM_MAX_ATTEMPTS + 1):
+        if not limiter.admit(estimated_tokens, deadline_at):
+            limiter.count("rejected")
+            limiter.count("failed")
+            raise LLMGatewayError(f"The {deployment} model is busy right now, please try again in a minute.")
+
+        started = time.monotonic()
+        try:
+            result = attempt(max(deadline_at - started, MIN_ATTEMPT_TIMEOUT_SECONDS))
+        except Exception as e:
+            limiter.release()
+            if not _is_retryable(e):
+                limiter.count("failed")
+                raise
+
+            retry_after = _retry_after(e)
+            if _is_throttle(e):
+                limiter.throttle(retry_after or BACKOFF_BASE_SECONDS)
+
+            if retry_after is not None:
+                # Small jitter so the callers released by the same Retry-After do not return in lockstep
+                delay = retry_after + random.uniform(0, 1)
+            else:
+                delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt_number - 1)))
+
+            if attempt_number == config.LLM_MAX_ATTEMPTS or time.monotonic() + delay >= deadline_at:
+                limiter.count("failed")
+                raise LLMGatewayError(
+                    f"The {deployment} model did not respond after {attempt_number} attempt(s): {type(e).__name__}"
+                ) from e
+
+            limiter.count("retries")
+            logger.warning(f"{app_id} call to {deployment} failed with {type(e).__name__}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+
+        limiter.count("succeeded")
+        limiter.count("latency_ms_total", (time.monotonic() - started) * 1000)
+        if stream:
+            # The slot stays taken until the caller has read the stream
+            return _ReleasingStream(result, limiter)
+        limiter.release()
+        limiter.reconcile(estimated_tokens, getattr(result, "usage", None))
+        return result
+
+
+def chat_completion(client, app_id, deadline=None, cache=False, coalesce=True, **kwargs):
+    """
+    Call client.chat.completions.create through the gateway.
+
+    deadline is the total number of seconds the call may take, including waiting for
+    admission and retries (config.LLM_DEFAULT_DEADLINE_SECONDS by default).
+    cache=True serves identical non-streaming requests from llm_cache; only use it
+    where replaying an earlier answer is acceptable. Identical non-streaming requests
+    that are in flight at the same time share one upstream call unless coalesce=False.
+    """
+    # The gateway owns the retry policy, so the SDK's own retries are switched off
+    no_retry_client = client.with_options(max_retries=0)
+
+    def attempt(timeout):
+        return llm_telemetry.chat_completion(no_retry_client, app_id, timeout=timeout, **kwargs)
+
+    def upstream():
+        return _call(app_id, kwargs.get("model"), estimate_tokens(kwargs), deadline, attempt, stream=bool(kwargs.get("stream")))
+
+    if kwargs.get("stream"):
+        return upstream()
+
+    def call():
+        if cache:
+            from openai.types.chat import ChatCompletion
+            return llm_cache.cached_call(app_id, kwargs, upstream, ChatCompletion)
+        return upstream()
+
+    if coalesce:
+        return single_flight.do(llm_cache.cache_key(kwargs), app_id, call)
+    return call()
+
+
+def image_generation(client, app_id, deadline=None, **kwargs):
+    """Call client.images.generate through the gateway"""
+    no_retry_client = client.with_options(max_retries=0)
+
+    def attempt(timeout):
+        return llm_telemetry.image_generation(no_retry_client, app_id, timeout=timeout, **kwargs)
+
+    return _call(app_id, kwargs.get("model"), 0, deadline, attempt)
+
+
+@contextmanager
+def limit(app_id, deployment, estimated_tokens=DEFAULT_COMPLETION_TOKENS, deadline=None):
+    """
+    Admission control for calls that do not go through the OpenAI SDK directly (e.g. LangChain chains).
+
+    Only waits for capacity; retries are left to the wrapped library.
+    """
+    limiter = get_limiter(deployment)
+    limiter.count("calls")
+    if not limiter.admit(estimated_tokens, time.monotonic() + (deadline or config.LLM_DEFAULT_DEADLINE_SECONDS)):
+        limiter.count("rejected")
+        limiter.count("failed")
+        raise LLMGatewayError(f"The {deployment} model is busy right now, please try again in a minute.")
+
+    started = time.monotonic()
+    try:
+        yield
+    except Exception:
+        limiter.count("failed")
+        raise
+    else:
+        limiter.count("succeeded")
+        limiter.count("latency_ms_total", (time.monotonic() - started) * 1000)
+    finally:
+        limiter.release()
+
+
+@asynccontextmanager
+async def alimit(app_id, deployment, estimated_tokens=DEFAULT_COMPLETION_TOKENS, deadline=None):
+    """
+    limit() for asyncio callers (llm_fanout), yielding the deployment's limiter.
+
+    Waiting for admission happens on a worker thread so the event loop keeps running.
+    A throttled call pauses the deployment for every caller, as in the synchronous path;
+    retrying is left to the caller.
+    """
+    limiter = get_limiter(deployment)
+    limiter.count("calls")
+    deadline_at = time.monotonic() + (deadline or config.LLM_DEFAULT_DEADLINE_SECONDS)
+    if not await asyncio.to_thread(limiter.admit, estimated_tokens, deadline_at):
+        limiter.count("rejected")
+        limiter.count("failed")
+        raise LLMGatewayError(f"The {deployment} model is busy right now, please try again in a minute.")
+
+    started = time.monotonic()
+    try:
+        yield limiter
+    except Exception as e:
+        limiter.count("failed")
+        if _is_throttle(e):
+            limiter.throttle(_retry_after(e) or BACKOFF_BASE_SECONDS)
+        raise
+    else:
+        limiter.count("succeeded")
+        limiter.count("latency_ms_total", (time.monotonic() - started) * 1000)
+    finally:
+        limiter.release()
+
+
+def coalesced_stats():
+    """Upstream and coalesced (shared) request counts per app"""
+    return single_flight.stats()
+
+
+def stats():
+    """Gateway metrics per deployment"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+
+    report = {}
+    for limiter in limiters:
+        with limiter._metrics_lock:
+            metrics = dict(limiter.metrics)
+        metrics["admission_wait_ms_avg"] = metrics["admission_wait_ms_total"] / metrics["admitted"] if metrics["admitted"] else 0.0
+        metrics["latency_ms_avg"] = metrics["latency_ms_total"] / metrics["succeeded"] if metrics["succeeded"] else 0.0
+        report[limiter.deployment] = metrics
+    return report
+
+
+metrics.register_stats("llm_gateway", stats, labels=("deployment",))
+metrics.register_stats("llm_gateway_coalesced", coalesced_stats, labels=("app",))
@@ -0,0 +1,308 @@
+import time
+import logging
+import threading
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+import config
+import metrics
+import llm_gateway
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# What the router knows about each deployment. Costs are USD per 1k tokens, latencies are rough
+# service-side figures used only to compare candidates. Overridden by config.LLM_ROUTING_PROFILES.
+DEFAULT_PROFILES = {
+    "gpt4omini": {
+        "context_tokens": 128000,
+        "input_cost_per_1k": 0.00015,
+        "output_cost_per_1k": 0.0006,
+        "base_latency_ms": 400,
+        "ms_per_prompt_token": 0.02,
+        "ms_per_output_token": 8,
+        "encoding": "o200k_base",
+    },
+    "gpt-4o-mini": {
+        "context_tokens": 128000,
+        "input_cost_per_1k": 0.00015,
+        "output_cost_per_1k": 0.0006,
+        "base_latency_ms": 400,
+        "ms_per_prompt_token": 0.02,
+        "ms_per_output_token": 8,
+        "encoding": "o200k_base",
+    },
+    "gpt4o": {
+        "context_tokens": 128000,
+        "input_cost_per_1k": 0.0025,
+        "output_cost_per_1k": 0.01,
+        "base_latency_ms": 700,
+        "ms_per_prompt_token": 0.05,
+        "ms_per_output_token": 15,
+        "encoding": "o200k_base",
+    },
+}
+
+# Routing policy per app, or per "app_id:task" for apps with several kinds of call.
+# candidates are tried in order; the first one that fits the prompt, the latency target and
+# the cost ceiling and is not being throttled wins. Prompts over escalate_above_tokens skip
+# the first candidate. Overridden by config.LLM_ROUTING_POLICIES.
+DEFAULT_POLICIES = {
+    "doc_summary": {
+        "candidates": ["gpt4omini", "gpt4o"],
+        "latency_target_ms": 60000,
+        "max_cost_usd": 0.50,
+    },
+    "audio_transcription:cleanup": {
+        "candidates": ["gpt4omini", "gpt4o"],
+        "latency_target_ms": 30000,
+        "max_cost_usd": 0.10,
+    },
+    # Short questions about a transcript are answered quickly by the small model,
+    # long transcripts go to the larger one
+    "audio_transcription:analysis": {
+        "candidates": ["gpt4omini", "gpt4o"],
+        "escalate_above_tokens": 2000,
+        "latency_target_ms": 45000,
+        "max_cost_usd": 0.25,
+    },
+    # The chatbots can only use deployments on their own Azure OpenAI resource
+    "claims_decisioning_chatbot": {"candidates": ["gpt-4o-mini"]},
+    "comp_anlaysis_chatbot": {"candidates": ["gpt4o"]},
+}
+
+# Token overhead of the chat format per message and for priming the reply
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# Completion tokens assumed for a call that does not say how long its answer will be
+DEFAULT_OUTPUT_TOKENS = llm_gateway.DEFAULT_COMPLETION_TOKENS
+
+# Recent routing decisions, for tuning the policies
+DECISIONS = deque(maxlen=500)
+_decision_counts = defaultdict(lambda: defaultdict(int))
+_decision_lock = threading.Lock()
+
+
+@dataclass
+class RouteDecision:
+    app_id: str
+    task: str
+    deployment: str
+    prompt_tokens: int
+    output_tokens: int
+    reason: str
+    estimated_cost_usd: float = 0.0
+    estimated_latency_ms: float = 0.0
+    # candidate -> why it was passed over
+    skipped: dict = field(default_factory=dict)
+    # candidates still worth trying, in order, if the chosen one fails
+    fallbacks: list = field(default_factory=list)
+
+
+def get_profile(deployment):
+    """Routing profile of a deployment, with config overrides applied"""
+    profile = dict(DEFAULT_PROFILES.get(deployment, DEFAULT_PROFILES["gpt4o"]))
+    profile.update(config.LLM_ROUTING_PROFILES.get(deployment, {}))
+    return profile
+
+
+def get_policy(app_id, task=None):
+    """Routing policy for an app (and task), with config overrides applied"""
+    for key in ([f"{app_id}:{task}"] if task else []) + [app_id]:
+        if key in DEFAULT_POLICIES or key in config.LLM_ROUTING_POLICIES:
+            return {**DEFAULT_POLICIES.get(key, {}), **config.LLM_ROUTING_POLICIES.get(key, {})}
+    return None
+
+
+@lru_cache(maxsize=None)
+def _encoding(name):
+    """Load a tiktoken encoding once, or None if tiktoken or its data is not available"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        logger.warning(f"tiktoken encoding {name} unavailable, estimating tokens from characters: {str(e)}")
+        return None
+
+
+def count_text_tokens(text, encoding_name="o200k_base"):
+    """Number of tokens in a piece of text"""
+    if not text:
+        return 0
+    encoding = _encoding(encoding_name)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages, encoding_name="o200k_base"):
+    """Prompt tokens of a list of chat messages, including the chat format overhead"""
+    total = TOKENS_PER_REPLY
+    for message in messages or []:
+        total += TOKENS_PER_MESSAGE
+        content = message.get("content") if isinstance(message, dict) else None
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        total += count_text_tokens(content if isinstance(content, str) else "", encoding_name)
+    return total
+
+
+def _estimate(profile, prompt_tokens, output_tokens):
+    cost = (prompt_tokens * profile["input_cost_per_1k"] + output_tokens * profile["output_cost_per_1k"]) / 1000
+    latency = (
+        profile["base_latency_ms"]
+        + prompt_tokens * profile["ms_per_prompt_token"]
+        + output_tokens * profile["ms_per_output_token"]
+    )
+    return cost, latency
+
+
+def route(app_id, messages, task=None, output_tokens=None, default=None):
+    """
+    Pick a deployment for a prompt from the app's routing policy.
+
+    Candidates are skipped when the prompt plus the expected output does not fit their context,
+    when the estimated cost or latency is over the policy's limits, or while the gateway is
+    holding them back after throttling. If every candidate is ruled out, the first one that
+    still fits the context is used. Apps without a policy get default.
+    """
+    policy = get_policy(app_id, task)
+    candidates = list(policy["candidates"]) if policy else [default or "gpt4o"]
+    output_tokens = output_tokens or DEFAULT_OUTPUT_TOKENS
+
+    encodings = {get_profile(candidate).get("encoding", "o200k_base") for candidate in candidates}
+    prompt_tokens = {name: count_message_tokens(messages, name) for name in encodings}
+
+    escalate_above = (policy or {}).get("escalate_above_tokens")
+    first_prompt_tokens = prompt_tokens[get_profile(candidates[0]).get("encoding", "o200k_base")]
+    if escalate_above and len(candidates) > 1 and first_prompt_tokens > escalate_above:
+        candidates = candidates[1:] + candidates[:1]
+
+    skipped = {}
+    fitting = []
+    chosen = None
+    for candidate in candidates:
+        profile = get_profile(candidate)
+        tokens = prompt_tokens[profile.get("encoding", "o200k_base")]
+        cost, latency = _estimate(profile, tokens, output_tokens)
+
+        if tokens + output_tokens > profile["context_tokens"]:
+            skipped[candidate] = f"context ({tokens}+{output_tokens} > {profile['context_tokens']})"
+            continue
+        fitting.append((candidate, tokens, cost, latency))
+
+        if chosen is not None:
+            continue
+        if llm_gateway.is_throttled(candidate):
+            skipped[candidate] = "throttled"
+        elif policy and policy.get("max_cost_usd") is not None and cost > policy["max_cost_usd"]:
+            skipped[candidate] = f"cost (${cost:.4f} > ${policy['max_cost_usd']})"
+        elif policy and policy.get("latency_target_ms") is not None and latency > policy["latency_target_ms"]:
+            skipped[candidate] = f"latency ({latency:.0f}ms > {policy['latency_target_ms']}ms)"
+        else:
+            chosen = (candidate, tokens, cost, latency)
+
+    if chosen is not None:
+        reason = "escalated" if escalate_above and first_prompt_tokens > escalate_above else "policy"
+        if chosen[0] != candidates[0]:
+            reason = f"{reason}, skipped {', '.join(skipped)}"
+    elif fitting:
+        chosen = fitting[0]
+        reason = "best effort, no candidate met every limit"
+    else:
+        # Nothing fits; the largest context gives the call its best chance
+        largest = max(candidates, key=lambda candidate: get_profile(candidate)["context_tokens"])
+        profile = get_profile(largest)
+        tokens = prompt_tokens[profile.get("encoding", "o200k_base")]
+        chosen = (largest, tokens) + _estimate(profile, tokens, output_tokens)
+        reason = "overflow, prompt does not fit any candidate"
+
+    deployment, tokens, cost, latency = chosen
+    decision = RouteDecision(
+        app_id=app_id,
+        task=task or "",
+        deployment=deployment,
+        prompt_tokens=tokens,
+        output_tokens=output_tokens,
+        reason=reason,
+        estimated_cost_usd=cost,
+        estimated_latency_ms=latency,
+        skipped=skipped,
+        fallbacks=[candidate for candidate, *_ in fitting if candidate != deployment],
+    )
+    _record(decision)
+    return decision
+
+
+def _record(decision, event="route"):
+    logger.info(
+        f"Routing {event}: app={decision.app_id} task={decision.task or '-'} deployment={decision.deployment} "
+        f"prompt_tokens={decision.prompt_tokens} output_tokens={decision.output_tokens} "
+        f"est_cost=${decision.estimated_cost_usd:.4f} est_latency={decision.estimated_latency_ms:.0f}ms "
+        f"reason={decision.reason!r} skipped={decision.skipped}"
+    )
+    with _decision_lock:
+        DECISIONS.append({
+            "time": time.time(),
+            "event": event,
+            "app_id": decision.app_id,
+            "task": decision.task,
+            "deployment": decision.deployment,
+            "prompt_tokens": decision.prompt_tokens,
+            "output_tokens": decision.output_tokens,
+            "estimated_cost_usd": decision.estimated_cost_usd,
+            "estimated_latency_ms": decision.estimated_latency_ms,
+            "reason": decision.reason,
+            "skipped": dict(decision.skipped),
+        })
+        key = f"{decision.app_id}:{decision.task}" if decision.task else decision.app_id
+        _decision_counts[key][decision.deployment if event == "route" else f"{event}:{decision.deployment}"] += 1
+
+
+def _is_context_overflow(error):
+    import openai
+    return isinstance(error, openai.BadRequestError) and getattr(error, "code", None) == "context_length_exceeded"
+
+
+def chat_completion(client, app_id, task=None, output_tokens=None, **kwargs):
+    """
+    Route a chat completion to a deployment and call it through llm_gateway.
+
+    Takes the same arguments as llm_gateway.chat_completion, minus model. If the chosen
+    deployment overflows its context or stays throttled past the gateway's retries, the
+    next candidate of the policy that fits the prompt is tried.
+    """
+    decision = route(app_id, kwargs.get("messages"), task=task, output_tokens=output_tokens or kwargs.get("max_tokens"))
+    deployments = [decision.deployment] + decision.fallbacks
+
+    for index, deployment in enumerate(deployments):
+        try:
+            return llm_gateway.chat_completion(client, app_id, model=deployment, **kwargs)
+        except Exception as e:
+            if index == len(deployments) - 1 or not (isinstance(e, llm_gateway.LLMGatewayError) or _is_context_overflow(e)):
+                raise
+            decision.deployment = deployments[index + 1]
+            decision.reason = f"fallback after {type(e).__name__} from {deployment}"
+            _record(decision, event="fallback")
+
+
+def stats():
+    """Routing decisions per app (and task) and deployment, plus the most recent decisions"""
+    with _decision_lock:
+        return {
+            "decisions": {key: dict(counts) for key, counts in _decision_counts.items()},
+            "recent": list(DECISIONS)[-20:],
+        }
+
+
+metrics.register_stats(
+    "llm_router",
+    lambda: {
+        route: {deployment: {"decisions": count} for deployment, count in counts.items()}
+        for route, counts in stats()["decisions"].items()
+    },
+    labels=("route", "deployment"),
+)
@@ -0,0 +1,21 @@
+import streamlit as st
+
+
+def text_chunks(stream):
+    """Yield the text of each chunk of a chat completion stream"""
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+def render(stream, container=None):
+    """
+    Show a streamed chat completion as it arrives and return its full text.
+
+    container is the Streamlit container to write into (the main area by default).
+    The returned text is the same as the non-streaming response content, so it can
+    be kept in session state or offered for download.
+    """
+    text = (container or st).write_stream(text_chunks(stream))
+    # write_stream returns a list when nothing was written
+    return text if isinstance(text, str) else "".join(text)
@@ -0,0 +1,310 @@
+import copy
+import json
+import asyncio
+import time
+import logging
+import threading
+from collections import defaultdict
+
+import config
+import metrics
+import llm_cache
+import llm_fanout
+import llm_gateway
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# First Azure OpenAI API version that accepts response_format={"type": "json_schema", ...}
+JSON_SCHEMA_MIN_API_VERSION = "2024-08-01"
+
+# Minimum time between redraws of a streamed JSON preview
+PREVIEW_INTERVAL_SECONDS = 0.2
+
+# Deployments that rejected a json_schema response format; they get json_object from then on
+_schema_unsupported = set()
+
+_stats = defaultdict(lambda: {"calls": 0, "parse_failures": 0, "repairs": 0, "repaired": 0, "failures": 0})
+_stats_lock = threading.Lock()
+
+
+class StructuredOutputError(ValueError):
+    """The model's reply did not validate against the expected structure, even after a repair attempt"""
+
+
+def _count(app_id, name):
+    with _stats_lock:
+        _stats[app_id][name] += 1
+
+
+def supports_json_schema(client):
+    """True if the client's API version accepts JSON-schema constrained output"""
+    api_version = (getattr(client, "default_query", None) or {}).get("api-version") or ""
+    return api_version[:10] >= JSON_SCHEMA_MIN_API_VERSION
+
+
+def strict_schema(response_model):
+    """
+    JSON schema of a pydantic model in the form strict structured outputs require.
+
+    Every object lists all of its properties as required and allows no others, and
+    defaults are dropped (the service rejects them).
+    """
+    schema = copy.deepcopy(response_model.model_json_schema())
+
+    def tighten(node):
+        if isinstance(node, dict):
+            node.pop("default", None)
+            if node.get("type") == "object" and "properties" in node:
+                node["required"] = list(node["properties"])
+                node["additionalProperties"] = False
+            for value in node.values():
+                tighten(value)
+        elif isinstance(node, list):
+            for value in node:
+                tighten(value)
+
+    tighten(schema)
+    return schema
+
+
+def response_format(client, deployment, response_model):
+    """The strongest response_format the client and deployment support for a model"""
+    if deployment not in _schema_unsupported and supports_json_schema(client):
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": response_model.__name__, "schema": strict_schema(response_model), "strict": True},
+        }
+    return {"type": "json_object"}
+
+
+def _is_schema_rejected(error, kwargs):
+    import openai
+    return (
+        isinstance(error, openai.BadRequestError)
+        and kwargs.get("response_format", {}).get("type") == "json_schema"
+        and "response_format" in str(error)
+    )
+
+
+def _parse(content, finish_reason, response_model):
+    """Validate a reply against the model, returning (instance, None) or (None, error message)"""
+    if finish_reason == "length":
+        return None, "the reply was cut off before the JSON was complete"
+    try:
+        return response_model.model_validate_json(content or ""), None
+    except Exception as e:
+        return None, str(e)
+
+
+def _parse_response(response, response_model):
+    choice = response.choices[0]
+    return _parse(choice.message.content, choice.finish_reason, response_model)
+
+
+def _repair_kwargs(kwargs, content, error, response_model):
+    """The original request plus the invalid reply and a targeted request to fix it"""
+    repair = dict(kwargs)
+    repair["messages"] = list(kwargs["messages"]) + [
+        {"role": "assistant", "content": content or ""},
+        {"role": "user", "content": (
+            f"Your reply did not match the required JSON structure: {error}\n\n"
+            f"Return only the corrected JSON object, matching this JSON schema:\n"
+            f"{json.dumps(strict_schema(response_model))}"
+        )},
+    ]
+    return repair
+
+
+def _prepare(client, kwargs, response_model):
+    kwargs = dict(kwargs)
+    kwargs["response_format"] = response_format(client, kwargs.get("model"), response_model)
+    return kwargs
+
+
+def _without_schema(kwargs):
+    _schema_unsupported.add(kwargs.get("model"))
+    logger.warning(f"{kwargs.get('model')} rejected a json_schema response format, using json_object instead")
+    return {**kwargs, "response_format": {"type": "json_object"}}
+
+
+def _result(app_id, response_model, parsed, error):
+    if parsed is not None:
+        _count(app_id, "repaired")
+        return parsed
+    _count(app_id, "failures")
+    raise StructuredOutputError(f"{response_model.__name__} could not be parsed after a repair attempt: {error}")
+
+
+def _repair(client, app_id, response_model, kwargs, content, error):
+    _count(app_id, "parse_failures")
+    _count(app_id, "repairs")
+    logger.warning(f"{app_id} reply did not validate as {response_model.__name__}, asking for a repair: {error}")
+    kwargs = {name: value for name, value in kwargs.items() if name != "stream"}
+    repaired = llm_gateway.chat_completion(client, app_id, **_repair_kwargs(kwargs, content, error, response_model))
+    return _result(app_id, response_model, *_parse_response(repaired, response_model))
+
+
+def _cache_key(kwargs, cache):
+    return llm_cache.cache_key(kwargs) if cache and config.LLM_CACHE_ENABLED else None
+
+
+def _from_cache(key, app_id, response_model):
+    """The cached reply for key validated into response_model, or None"""
+    payload = llm_cache.cache.get(key, app_id)
+    if payload is None:
+        return None
+    from openai.types.chat import ChatCompletion
+    try:
+        parsed, _ = _parse_response(ChatCompletion.model_validate_json(payload), response_model)
+    except Exception as e:
+        logger.error(f"Error restoring cached response {key}: {str(e)}")
+        return None
+    return parsed
+
+
+def _to_cache(app_id, kwargs, response):
+    """Cache a reply that validated, under the request as finally sent (after any json_object fallback)"""
+    if llm_cache.is_cacheable(response):
+        llm_cache.cache.set(llm_cache.cache_key(kwargs), app_id, response.model_dump_json())
+
+
+def complete(client, app_id, response_model, cache=False, **kwargs):
+    """
+    Chat completion through llm_gateway whose reply is validated into a pydantic model instance.
+
+    The request is constrained with the model's JSON schema where the API version and deployment
+    support it (JSON mode otherwise). A reply that does not validate gets exactly one repair call
+    that shows the model its reply and the validation error. Raises StructuredOutputError if that
+    fails too. With cache=True a cached reply is returned straight away, and a new reply is
+    cached once it has validated.
+    """
+    _count(app_id, "calls")
+    kwargs = _prepare(client, kwargs, response_model)
+
+    key = _cache_key(kwargs, cache)
+    if key:
+        parsed = _from_cache(key, app_id, response_model)
+        if parsed is not None:
+            return parsed
+
+    try:
+        response = llm_gateway.chat_completion(client, app_id, **kwargs)
+    except Exception as e:
+        if not _is_schema_rejected(e, kwargs):
+            raise
+        kwargs = _without_schema(kwargs)
+        response = llm_gateway.chat_completion(client, app_id, **kwargs)
+
+    parsed, error = _parse_response(response, response_model)
+    if parsed is not None:
+        if key:
+            _to_cache(app_id, kwargs, response)
+        return parsed
+    return _repair(client, app_id, response_model, kwargs, response.choices[0].message.content, error)
+
+
+async def acomplete(client, app_id, response_model, cache=False, **kwargs):
+    """complete() for llm_fanout workers"""
+    _count(app_id, "calls")
+    kwargs = _prepare(client, kwargs, response_model)
+
+    key = _cache_key(kwargs, cache)
+    if key:
+        parsed = await asyncio.to_thread(_from_cache, key, app_id, response_model)
+        if parsed is not None:
+            return parsed
+
+    try:
+        response = await llm_fanout.chat_completion(client, app_id, **kwargs)
+    except Exception as e:
+        if not _is_schema_rejected(e, kwargs):
+            raise
+        kwargs = _without_schema(kwargs)
+        response = await llm_fanout.chat_completion(client, app_id, **kwargs)
+
+    parsed, error = _parse_response(response, response_model)
+    if parsed is not None:
+        if key:
+            await asyncio.to_thread(_to_cache, app_id, kwargs, response)
+        return parsed
+
+    _count(app_id, "parse_failures")
+    _count(app_id, "repairs")
+    logger.warning(f"{app_id} reply did not validate as {response_model.__name__}, asking for a repair: {error}")
+    content = response.choices[0].message.content
+    repaired = await llm_fanout.chat_completion(client, app_id, **_repair_kwargs(kwargs, content, error, response_model))
+    return _result(app_id, response_model, *_parse_response(repaired, response_model))
+
+
+def _completion_from_text(model, content, finish_reason):
+    """A ChatCompletion holding streamed text, so it can be cached like a normal response"""
+    from openai.types.chat import ChatCompletion
+    return ChatCompletion.model_validate({
+        "id": "streamed",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model or "",
+        "choices": [{"index": 0, "finish_reason": finish_reason or "stop", "message": {"role": "assistant", "content": content}}],
+    })
+
+
+def stream_complete(client, app_id, response_model, container, cache=False, **kwargs):
+    """
+    complete() that shows the JSON in a Streamlit container while it is generated.
+
+    The preview is cleared once the reply is complete and validated. With cache=True a cached
+    reply is returned straight away and a new one is cached once it has validated, as with complete().
+    """
+    _count(app_id, "calls")
+    kwargs = _prepare(client, kwargs, response_model)
+
+    key = _cache_key(kwargs, cache)
+    if key:
+        parsed = _from_cache(key, app_id, response_model)
+        if parsed is not None:
+            return parsed
+
+    try:
+        stream = llm_gateway.chat_completion(client, app_id, stream=True, **kwargs)
+    except Exception as e:
+        if not _is_schema_rejected(e, kwargs):
+            raise
+        kwargs = _without_schema(kwargs)
+        stream = llm_gateway.chat_completion(client, app_id, stream=True, **kwargs)
+
+    preview = container.empty()
+    content, finish_reason, drawn_at = "", None, 0.0
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        content += chunk.choices[0].delta.content or ""
+        finish_reason = chunk.choices[0].finish_reason or finish_reason
+        if time.monotonic() - drawn_at >= PREVIEW_INTERVAL_SECONDS:
+            preview.code(content, language="json")
+            drawn_at = time.monotonic()
+    preview.empty()
+
+    parsed, error = _parse(content, finish_reason, response_model)
+    if parsed is None:
+        return _repair(client, app_id, response_model, kwargs, content, error)
+    if key and finish_reason in llm_cache.CACHEABLE_FINISH_REASONS:
+        _to_cache(app_id, kwargs, _completion_from_text(kwargs.get("model"), content, finish_reason))
+    return parsed
+
+
+def stats():
+    """Structured-output calls, parse failures and repairs per app"""
+    with _stats_lock:
+        report = {}
+        for app_id, counts in _stats.items():
+            report[app_id] = {
+                **counts,
+                "parse_failure_rate": counts["parse_failures"] / counts["calls"] if counts["calls"] else 0.0,
+                "failure_rate": counts["failures"] / counts["calls"] if counts["calls"] else 0.0,
+            }
+        return report
+
+
+metrics.register_stats("llm_structured", stats, labels=("app",))
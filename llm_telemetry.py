@@ -0,0 +1,358 @@
+import time
+import queue
+import statistics
+import atexit
+import logging
+import threading
+import contextvars
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime
+
+import db_utils
+import metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Writer tuning: rows are flushed when a batch fills up or the interval elapses, whichever comes first
+BATCH_SIZE = 50
+FLUSH_INTERVAL_SECONDS = 5
+MAX_QUEUE_SIZE = 10000
+
+# Recent time-to-first-token of streamed calls per app, kept in memory for quick reporting
+TTFT_MS = defaultdict(lambda: deque(maxlen=500))
+
+# Oldest Azure OpenAI API version that accepts stream_options, older versions reject the parameter
+STREAM_USAGE_MIN_API_VERSION = "2024-09-01"
+
+CALL_SECONDS = metrics.histogram("portal_llm_call_seconds", "Model, speech-to-text and image generation calls")
+TTFT_SECONDS = metrics.histogram("portal_llm_ttft_seconds", "Time to the first token of streamed model calls")
+TOKENS = metrics.counter("portal_llm_tokens_total", "Prompt and completion tokens reported by the service")
+DB_WRITE_SECONDS = metrics.histogram("portal_db_write_seconds", "Writes to the portal database")
+
+# Session that calls made off the script thread (e.g. background jobs) are attributed to
+_session_scope = contextvars.ContextVar("llm_telemetry_session_id", default=None)
+
+INSERT_SQL = """
+INSERT INTO ai_portal_llm_calls (session_id, app_id, call_type, deployment, prompt_tokens, completion_tokens, total_tokens,
+                                 latency_ms, ttft_ms, streamed, error_class, call_time, reporting_period)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+CREATE_TABLE_SQL = """
+IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'ai_portal_llm_calls')
+BEGIN
+    CREATE TABLE ai_portal_llm_calls (
+        id BIGINT IDENTITY(1,1) PRIMARY KEY,
+        session_id NVARCHAR(255),
+        app_id NVARCHAR(255),
+        call_type NVARCHAR(50),
+        deployment NVARCHAR(255),
+        prompt_tokens INT,
+        completion_tokens INT,
+        total_tokens INT,
+        latency_ms INT,
+        ttft_ms INT,
+        streamed BIT,
+        error_class NVARCHAR(255),
+        call_time DATETIME,
+        reporting_period NVARCHAR(6)
+    )
+END
+"""
+
+
+class TelemetryWriter:
+    """Background writer that batches LLM call records into ai_portal_llm_calls"""
+
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL_SECONDS, max_queue_size=MAX_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.dropped = 0
+        self.written = 0
+        self._table_checked = False
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Start the writer thread if it is not already running"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="llm-telemetry-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, record):
+        """Queue a call record without blocking the caller"""
+        self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self):
+        """Collect up to a full batch, waiting at most one flush interval"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._drain()
+            if batch:
+                self.write(batch)
+
+    def flush(self):
+        """Write everything that is currently queued"""
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self.write(batch)
+
+    def write(self, batch):
+        """Insert a batch of records in a single round trip"""
+        conn = db_utils.get_db_connection()
+        if not conn:
+            logger.error("Failed to connect to database")
+            return False
+
+        try:
+            with DB_WRITE_SECONDS.time(table="ai_portal_llm_calls"):
+                cursor = conn.cursor()
+                if not self._table_checked:
+                    cursor.execute(CREATE_TABLE_SQL)
+                    self._table_checked = True
+
+                cursor.fast_executemany = True
+                cursor.executemany(INSERT_SQL, [_to_row(record) for record in batch])
+                conn.commit()
+
+            self.written += len(batch)
+            return True
+
+        except Exception as e:
+            logger.error(f"Error writing LLM telemetry: {str(e)}")
+            return False
+        finally:
+            conn.close()
+
+
+def _to_row(record):
+    return (
+        record.get("session_id"),
+        record.get("app_id"),
+        record.get("call_type"),
+        record.get("deployment"),
+        record.get("prompt_tokens"),
+        record.get("completion_tokens"),
+        record.get("total_tokens"),
+        record.get("latency_ms"),
+        record.get("ttft_ms"),
+        record.get("streamed", False),
+        record.get("error_class"),
+        record["call_time"],
+        record["call_time"].strftime("%Y%m"),
+    )
+
+
+writer = TelemetryWriter()
+atexit.register(writer.flush)
+
+
+@contextmanager
+def session_scope(session_id):
+    """Attribute calls made in this context to a session"""
+    token = _session_scope.set(session_id)
+    try:
+        yield
+    finally:
+        _session_scope.reset(token)
+
+
+def current_session_id():
+    """Return the Streamlit session id of the current script run, if there is one"""
+    if _session_scope.get() is not None:
+        return _session_scope.get()
+    try:
+        import streamlit as st
+        return st.session_state.get("session_id")
+    except Exception:
+        return None
+
+
+def new_record(app_id, deployment, call_type="chat", session_id=None):
+    """Create a telemetry record for a model call that is about to start"""
+    return {
+        "session_id": session_id or current_session_id(),
+        "app_id": app_id,
+        "call_type": call_type,
+        "deployment": deployment,
+        "call_time": datetime.now(),
+        "started": time.perf_counter(),
+    }
+
+
+def finish_record(record, error=None):
+    """Stamp the latency (and error class) on a record and queue it for writing"""
+    if error is not None:
+        record["error_class"] = type(error).__name__
+    record.setdefault("latency_ms", int((time.perf_counter() - record.pop("started")) * 1000))
+    _observe(record)
+    writer.submit(record)
+
+
+def _observe(record):
+    labels = {"app": record["app_id"], "call_type": record["call_type"], "deployment": record.get("deployment") or "unknown"}
+    CALL_SECONDS.observe(record["latency_ms"] / 1000, outcome="error" if record.get("error_class") else "ok", **labels)
+    if record.get("ttft_ms") is not None:
+        TTFT_SECONDS.observe(record["ttft_ms"] / 1000, **labels)
+    for kind in ("prompt", "completion"):
+        if record.get(f"{kind}_tokens"):
+            TOKENS.inc(record[f"{kind}_tokens"], kind=kind, **labels)
+
+
+@contextmanager
+def track_call(app_id, deployment, call_type="chat", session_id=None):
+    """
+    Time a model call and queue its telemetry record on exit.
+
+    The yielded dict can be filled in by the caller with token counts and ttft_ms.
+    The error class is recorded and the exception re-raised if the call fails.
+    session_id is needed for calls made off the Streamlit script thread.
+    """
+    record = new_record(app_id, deployment, call_type, session_id)
+    try:
+        yield record
+    except Exception as e:
+        finish_record(record, e)
+        raise
+    finish_record(record)
+
+
+def set_usage(record, usage):
+    """Copy the token counts the service reported onto a record"""
+    if usage is None:
+        return
+    record["prompt_tokens"] = getattr(usage, "prompt_tokens", None)
+    record["completion_tokens"] = getattr(usage, "completion_tokens", None)
+    record["total_tokens"] = getattr(usage, "total_tokens", None)
+
+
+def supports_stream_usage(client):
+    """True if the client's API version accepts stream_options, the only way to get a streamed reply's usage"""
+    api_version = (getattr(client, "default_query", None) or {}).get("api-version") or ""
+    return api_version[:10] >= STREAM_USAGE_MIN_API_VERSION
+
+
+def _estimate_usage(record, messages, text):
+    """Fill in token counts for a stream whose usage the service did not report"""
+    import llm_router
+    record["prompt_tokens"] = llm_router.count_message_tokens(messages)
+    record["completion_tokens"] = llm_router.count_text_tokens(text)
+    record["total_tokens"] = record["prompt_tokens"] + record["completion_tokens"]
+
+
+def _tracked_stream(stream, record, messages=None):
+    """Pass stream chunks through while capturing time-to-first-token and usage"""
+    text = []
+    try:
+        for chunk in stream:
+            # The usage chunk that ends a stream with include_usage has no choices
+            if chunk.choices and chunk.choices[0].delta.content:
+                if "ttft_ms" not in record:
+                    record["ttft_ms"] = int((time.perf_counter() - record["started"]) * 1000)
+                    TTFT_MS[record["app_id"]].append(record["ttft_ms"])
+                text.append(chunk.choices[0].delta.content)
+            set_usage(record, getattr(chunk, "usage", None))
+            yield chunk
+    except GeneratorExit:
+        # The caller stopped reading early; still record what was seen
+        finish_record(record)
+        raise
+    except Exception as e:
+        finish_record(record, e)
+        raise
+    if record.get("completion_tokens") is None:
+        try:
+            _estimate_usage(record, messages, "".join(text))
+        except Exception as e:
+            logger.error(f"Error estimating streamed token usage: {str(e)}")
+    finish_record(record)
+
+
+def chat_completion(client, app_id, **kwargs):
+    """
+    Call client.chat.completions.create and record its telemetry.
+
+    Streamed calls ask for the usage to be sent at the end of the stream when the client's API
+    version allows it; otherwise their token counts are estimated with tiktoken.
+    """
+    if kwargs.get("stream") and "stream_options" not in kwargs and supports_stream_usage(client):
+        kwargs["stream_options"] = {"include_usage": True}
+    record = new_record(app_id, kwargs.get("model"), "chat")
+    try:
+        response = client.chat.completions.create(**kwargs)
+    except Exception as e:
+        finish_record(record, e)
+        raise
+
+    if kwargs.get("stream"):
+        # The record is queued once the caller has consumed the stream
+        record["streamed"] = True
+        return _tracked_stream(response, record, kwargs.get("messages"))
+
+    set_usage(record, getattr(response, "usage", None))
+    finish_record(record)
+    return response
+
+
+def image_generation(client, app_id, **kwargs):
+    """Call client.images.generate and record its telemetry"""
+    with track_call(app_id, kwargs.get("model"), "image"):
+        return client.images.generate(**kwargs)
+
+
+@contextmanager
+def track_langchain(app_id, deployment, callback):
+    """Record the tokens a LangChain call adds to a get_openai_callback() handler"""
+    before = (callback.prompt_tokens, callback.completion_tokens, callback.total_tokens)
+    with track_call(app_id, deployment, "chat") as record:
+        try:
+            yield record
+        finally:
+            record["prompt_tokens"] = callback.prompt_tokens - before[0]
+            record["completion_tokens"] = callback.completion_tokens - before[1]
+            record["total_tokens"] = callback.total_tokens - before[2]
+
+
+def ttft_stats():
+    """Summarise the recent time-to-first-token of streamed calls per app"""
+    report = {}
+    for app_id, samples in list(TTFT_MS.items()):
+        ordered = sorted(samples)
+        if not ordered:
+            continue
+        report[app_id] = {
+            "streams": len(ordered),
+            "median_ms": statistics.median(ordered),
+            "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            "max_ms": ordered[-1],
+        }
+    return report
+
+
+metrics.register_stats("llm_telemetry_writer", lambda: {"written": writer.written, "dropped": writer.dropped, "queued": writer.queue.qsize()})
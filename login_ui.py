@@ -1,32 +1,28 @@
+import hmac
 import requests
 import streamlit as st
 from msal import ConfidentialClientApplication
-import os
-import base64
 import db_utils
+import static_assets
 from datetime import datetime
 
-from config import AAD_CLIENT_ID, AAD_CLIENT_SECRET, AAD_TENANT_ID, REDIRECT_URI
+from config import AAD_CLIENT_ID, AAD_CLIENT_SECRET, AAD_TENANT_ID, REDIRECT_URI, PORTAL_ADMIN_EMAILS, LOAD_TEST_TOKEN
 
 
 def add_bg_from_local(image_file):
     try:
-        # Get the absolute path to the background gif
-
-        bg_path = image_file
+        # Reference the background by URL so it is downloaded once and cached by the browser
+        bg_url = static_assets.asset_url(image_file)
         
-        if not os.path.exists(bg_path):
-            st.error(f"Background file not found at {bg_path}")
+        if not bg_url:
+            st.error(f"Background file not found: {image_file}")
             return
-
-        with open(bg_path, "rb") as f:
-            data = base64.b64encode(f.read()).decode()
     
         st.markdown(
             f"""
             <style>
             .stApp {{
-                background-image: url("data:image/gif;base64,{data}");
+                background-image: url("{bg_url}");
                 background-size: cover;
                 background-position: center;
                 background-repeat: no-repeat;
@@ -72,6 +68,26 @@ def add_bg_from_local(image_file):
     except Exception as e:
         pass
 
+def is_admin():
+    """True if the signed-in user is one of the portal administrators (PORTAL_ADMIN_EMAILS)"""
+    email = st.session_state.get("user_email") if st.session_state.get("authenticated") else None
+    return bool(email) and email.lower() in PORTAL_ADMIN_EMAILS
+
+def load_test_sign_in():
+    """
+    Sign in a load test session (benchmarks/load_test.py) that opened the portal with
+    ?load_test_token=LOAD_TEST_TOKEN&load_test_user=<n>. Returns True if it was signed in.
+    """
+    token = st.query_params.get("load_test_token")
+    if not LOAD_TEST_TOKEN or not token or not hmac.compare_digest(token.encode(), LOAD_TEST_TOKEN.encode()):
+        return False
+    user = st.query_params.get("load_test_user", "0")
+    st.session_state["authenticated"] = True
+    st.session_state["display_name"] = f"Load Test {user}"
+    st.session_state["user_email"] = f"loadtest+{user}@loadtest.invalid"
+    st.session_state["user_department"] = "Load Test"
+    return True
+
 def initialize_app():
     client_id = AAD_CLIENT_ID
     tenant_id = AAD_TENANT_ID
@@ -138,8 +154,11 @@ def authentication_process(app):
 
 def login_ui():
     
+    if load_test_sign_in():
+        st.rerun()
+    
     # Add the background GIF
-    add_bg_from_local(os.path.join(os.getcwd(), "static", "main_background.gif"))
+    add_bg_from_local("main_background.gif")
     
     # Create columns with better proportions
     col1, col2, col3 = st.columns([1, 2, 1])
@@ -160,9 +179,9 @@ def login_ui():
                     "<div style='text-align: center;'>",
                     unsafe_allow_html=True
                 )
-                st.image(
-                    os.path.join(os.getcwd(), "static", "Telesure-logo.png"),
-                    width=300
+                st.markdown(
+                    static_assets.image_html("Telesure-logo.png", width=300, alt="Telesure"),
+                    unsafe_allow_html=True
                 )
                 st.markdown("</div>", unsafe_allow_html=True)
         with logocol3:
@@ -228,13 +247,11 @@ def login_ui():
     st.markdown(
         """
         <div style='text-align: center; margin-top: 2rem;'>
-            <img src="data:image/png;base64,{}" alt="GAIA Logo" style="width: 105px; margin-bottom: 10px;">
+            <img src="{}" alt="GAIA Logo" style="width: 105px; margin-bottom: 10px;">
             <p style='font-size: 140%; color: orange;'>
                 <b>Powered by GAIA</b>
             </p>
         </div>
-        """.format(
-            base64.b64encode(open(os.path.join(os.getcwd(), "static", "GAIA6.png"), "rb").read()).decode()
-        ),
+        """.format(static_assets.asset_url("GAIA6.png")),
         unsafe_allow_html=True
     )
@@ -0,0 +1,367 @@
+import os
+import sys
+import time
+import inspect
+import logging
+import threading
+import tracemalloc
+from collections import deque, defaultdict
+
+import config
+import metrics
+import session_memory
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Allocations made by the import machinery and by tracemalloc itself are not interesting
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+    tracemalloc.Filter(False, tracemalloc.__file__),
+)
+
+# RSS readings kept for the growth trend in periodic reports, and the shortest span a trend is given for
+TREND_SAMPLES = 48
+MIN_TREND_SECONDS = 600
+
+_lock = threading.Lock()
+_baseline = None
+_previous = None
+_last_report = None
+_trend = deque(maxlen=TREND_SAMPLES)
+_stats = {"snapshots": 0, "reports_logged": 0}
+_started = False
+
+
+def rss_mb():
+    """Resident memory of this process"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        # Peak rather than current RSS where /proc is not available (macOS reports bytes)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        return None
+
+
+def start_tracing(frames=None):
+    """Start tracing allocations (if not already) and take the baseline snapshot"""
+    global _baseline, _previous
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames or config.MEMORY_TRACE_FRAMES)
+        logger.info(f"Started tracing memory allocations ({tracemalloc.get_traceback_limit()} frames)")
+    snapshot = _take_snapshot()
+    with _lock:
+        _baseline = _previous = snapshot
+
+
+def stop_tracing():
+    """Stop tracing allocations and drop the snapshots, which releases tracemalloc's own memory"""
+    global _baseline, _previous
+    tracemalloc.stop()
+    with _lock:
+        _baseline = _previous = None
+    logger.info("Stopped tracing memory allocations")
+
+
+def set_baseline():
+    """Compare later snapshots against the allocations as they are now"""
+    global _baseline
+    if not tracemalloc.is_tracing():
+        start_tracing()
+        return
+    snapshot = _take_snapshot()
+    with _lock:
+        _baseline = snapshot
+
+
+def _take_snapshot():
+    snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+    with _lock:
+        _stats["snapshots"] += 1
+    return snapshot
+
+
+def _frame_label(frame):
+    path = frame.filename
+    if path.startswith(REPO_ROOT):
+        path = os.path.relpath(path, REPO_ROOT)
+    else:
+        path = os.path.join(*path.split(os.sep)[-2:])
+    return f"{path}:{frame.lineno}"
+
+
+def _site(traceback):
+    """Where an allocation happened, plus the innermost portal frame that led to it when that is elsewhere"""
+    site = _frame_label(traceback[-1])
+    for frame in reversed(traceback):
+        if frame.filename.startswith(REPO_ROOT):
+            portal_frame = _frame_label(frame)
+            return site if portal_frame == site else f"{site} (via {portal_frame})"
+    return site
+
+
+def top_growth(snapshot, baseline, limit=None):
+    """Allocation sites that grew most between two snapshots"""
+    sites = defaultdict(lambda: {"size_bytes": 0, "growth_bytes": 0, "count": 0, "count_growth": 0})
+    for diff in snapshot.compare_to(baseline, "traceback"):
+        site = sites[_site(diff.traceback)]
+        site["size_bytes"] += diff.size
+        site["growth_bytes"] += diff.size_diff
+        site["count"] += diff.count
+        site["count_growth"] += diff.count_diff
+    ordered = sorted(sites.items(), key=lambda item: -item[1]["growth_bytes"])
+    return [{"site": site, **figures} for site, figures in ordered[:limit or config.MEMORY_REPORT_TOP_N]]
+
+
+def _estimate_bytes(value):
+    """Approximate size of a cached value; FAISS vectorstores are sized by their index and documents"""
+    index = getattr(value, "index", None)
+    if index is not None and hasattr(index, "ntotal") and hasattr(index, "d"):
+        size = index.ntotal * index.d * 4  # float32 vectors
+        documents = getattr(getattr(value, "docstore", None), "_dict", {})
+        size += sum(len(getattr(document, "page_content", "")) for document in documents.values())
+        return size
+    return session_memory.measure(value)
+
+
+def _streamlit_resource_caches():
+    """Entries and estimated size of each @st.cache_resource function"""
+    from streamlit.runtime.caching import cache_resource_api
+
+    caches = []
+    resource_caches = cache_resource_api._resource_caches
+    with resource_caches._caches_lock:
+        function_caches = [cache for by_key in resource_caches._function_caches.values() for cache in by_key.values()]
+    for cache in function_caches:
+        with cache._mem_cache_lock:
+            entries = list(cache._mem_cache.values())
+        if entries:
+            caches.append({
+                "cache": f"st.cache_resource {cache.display_name}",
+                "entries": len(entries),
+                "bytes": sum(_estimate_bytes(getattr(entry, "value", entry)) for entry in entries),
+            })
+    return caches
+
+
+def _streamlit_data_caches():
+    """Entries and pickled size of each @st.cache_data function"""
+    from streamlit.runtime.caching import cache_data_api
+
+    sizes = defaultdict(lambda: {"entries": 0, "bytes": 0})
+    for family in cache_data_api._data_caches.get_stats().values():
+        for stat in family:
+            sizes[stat.cache_name]["entries"] += 1
+            sizes[stat.cache_name]["bytes"] += stat.byte_length
+    return [{"cache": f"st.cache_data {name}", **figures} for name, figures in sizes.items()]
+
+
+def _lru_caches():
+    """
+    Entries of the portal's functools.lru_cache functions. Caches of functions that take no
+    arguments (the chatbots' FAISS indexes) are also sized, since they hold a single value.
+    """
+    caches = []
+    for name, module in list(sys.modules.items()):
+        if not (getattr(module, "__file__", None) or "").startswith(REPO_ROOT):
+            continue
+        for attribute, fn in list(vars(module).items()):
+            if not (callable(fn) and hasattr(fn, "cache_info") and getattr(fn, "__module__", None) == name):
+                continue
+            entries = fn.cache_info().currsize
+            if not entries:
+                continue
+            size = None
+            if not inspect.signature(fn.__wrapped__).parameters:
+                size = _estimate_bytes(fn())
+            caches.append({"cache": f"lru_cache {name}.{attribute}", "entries": entries, "bytes": size})
+    return caches
+
+
+def cache_sizes():
+    """Entries and approximate bytes held by the Streamlit caches, the portal's lru_caches and the LLM response cache"""
+    caches = []
+    for collect in (_streamlit_resource_caches, _streamlit_data_caches, _lru_caches):
+        try:
+            caches.extend(collect())
+        except Exception as e:
+            logger.error(f"Error measuring caches with {collect.__name__}: {str(e)}")
+
+    llm_cache = sys.modules.get("llm_cache")
+    if llm_cache is not None:
+        caches.append({"cache": "llm_cache memory tier", "entries": len(llm_cache.cache._memory), "bytes": llm_cache.cache._memory_size})
+    return sorted(caches, key=lambda cache: -(cache["bytes"] or 0))
+
+
+def session_sizes(limit=None):
+    """Memory of the tracked sessions, largest first, and their total"""
+    report = session_memory.stats()
+    largest = sorted(report["per_session"].items(), key=lambda item: -item[1]["total_bytes"])
+    return {
+        "sessions": report["sessions"],
+        "total_bytes": report["total_bytes"],
+        "spilled_bytes": report["spilled_bytes"],
+        "largest": [
+            {"session": session_id[:8], "bytes": session["total_bytes"], "largest_keys": session["largest_keys"]}
+            for session_id, session in largest[:limit or config.MEMORY_REPORT_TOP_N]
+        ],
+    }
+
+
+def report(limit=None):
+    """
+    Capture the process's memory: RSS, the allocation sites that grew most since the baseline
+    and since the previous report (when tracing), and the sizes of the caches and sessions.
+    """
+    global _previous, _last_report
+    result = {"time": time.time(), "rss_mb": rss_mb(), "tracing": tracemalloc.is_tracing()}
+
+    if result["tracing"]:
+        snapshot = _take_snapshot()
+        traced, peak = tracemalloc.get_traced_memory()
+        result.update(traced_mb=traced / (1024 * 1024), traced_peak_mb=peak / (1024 * 1024))
+        with _lock:
+            baseline, previous, _previous = _baseline, _previous, snapshot
+        result["since_baseline"] = top_growth(snapshot, baseline, limit) if baseline else []
+        result["since_previous"] = top_growth(snapshot, previous, limit) if previous else []
+
+    result["caches"] = cache_sizes()
+    result["session_state"] = session_sizes(limit)
+    with _lock:
+        _trend.append((result["time"], result["rss_mb"]))
+        _last_report = result
+    return result
+
+
+def rss_trend():
+    """RSS growth per hour over the recent reports, or None until they span MIN_TREND_SECONDS"""
+    with _lock:
+        samples = [(at, rss) for at, rss in _trend if rss is not None]
+    if len(samples) < 2 or samples[-1][0] - samples[0][0] < MIN_TREND_SECONDS:
+        return None
+    (first_at, first_rss), (last_at, last_rss) = samples[0], samples[-1]
+    return (last_rss - first_rss) / ((last_at - first_at) / 3600)
+
+
+def _log_report():
+    result = report(limit=5)
+    trend = rss_trend()
+    message = f"Memory: RSS {result['rss_mb']:.0f} MB"
+    if trend is not None:
+        message += f" ({trend:+.1f} MB/hour over the last {len(_trend)} reports)"
+    if result["tracing"]:
+        message += f", traced {result['traced_mb']:.0f} MB"
+    caches = ", ".join(f"{cache['cache']} {(cache['bytes'] or 0) / (1024 * 1024):.1f} MB" for cache in result["caches"][:5])
+    message += f"; caches: {caches or 'empty'}; session state {result['session_state']['total_bytes'] / (1024 * 1024):.1f} MB"
+    message += f" in {result['session_state']['sessions']} sessions"
+    logger.info(message)
+    for site in result.get("since_previous", []):
+        logger.info(f"Memory growth since the last report: {site['growth_bytes'] / 1024:+.0f} KB at {site['site']}")
+    with _lock:
+        _stats["reports_logged"] += 1
+
+
+def _report_periodically():
+    while True:
+        time.sleep(config.MEMORY_REPORT_INTERVAL_MINUTES * 60)
+        try:
+            _log_report()
+        except Exception as e:
+            logger.error(f"Error logging memory report: {str(e)}")
+
+
+def start():
+    """Start tracing at startup and the periodic report, as configured (once per process)"""
+    global _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+    if config.MEMORY_TRACE_AT_STARTUP:
+        start_tracing()
+    if config.MEMORY_REPORT_INTERVAL_MINUTES > 0:
+        threading.Thread(target=_report_periodically, name="memory-report", daemon=True).start()
+        logger.info(f"Logging a memory report every {config.MEMORY_REPORT_INTERVAL_MINUTES} minutes")
+
+
+def _megabytes(size):
+    return None if size is None else round(size / (1024 * 1024), 2)
+
+
+def render_admin_panel():
+    """Sidebar controls for admins to trace allocations, take snapshots and see the latest report"""
+    import streamlit as st
+
+    with st.sidebar.expander("🧠 Memory"):
+        tracing = tracemalloc.is_tracing()
+        col1, col2 = st.columns(2)
+        if col1.button("Take snapshot", key="memory_snapshot"):
+            with st.spinner("Measuring memory..."):
+                report()
+        if tracing:
+            if col2.button("Set baseline", key="memory_baseline"):
+                set_baseline()
+            if st.button("Stop tracing", key="memory_stop_tracing"):
+                stop_tracing()
+        elif col2.button("Start tracing", key="memory_start_tracing"):
+            start_tracing()
+
+        with _lock:
+            latest = _last_report
+        if latest is None:
+            st.caption("No snapshot taken yet.")
+            return
+
+        caption = f"{time.strftime('%H:%M:%S', time.localtime(latest['time']))}: RSS {latest['rss_mb']:.0f} MB"
+        if latest["tracing"]:
+            caption += f", traced {latest['traced_mb']:.0f} MB (peak {latest['traced_peak_mb']:.0f} MB)"
+        trend = rss_trend()
+        if trend is not None:
+            caption += f", {trend:+.1f} MB/hour"
+        st.caption(caption)
+
+        if latest.get("since_baseline"):
+            st.markdown("**Growth since the baseline**")
+            st.dataframe(
+                [{"site": site["site"], "growth MB": _megabytes(site["growth_bytes"]), "MB": _megabytes(site["size_bytes"]),
+                  "blocks": site["count_growth"]} for site in latest["since_baseline"]],
+                hide_index=True,
+            )
+        elif not latest["tracing"]:
+            st.caption("Start tracing to see which code allocated the memory.")
+
+        st.markdown("**Caches**")
+        st.dataframe(
+            [{"cache": cache["cache"], "entries": cache["entries"], "MB": _megabytes(cache["bytes"])} for cache in latest["caches"]],
+            hide_index=True,
+        )
+        sessions = latest["session_state"]
+        st.markdown(f"**Session state**: {_megabytes(sessions['total_bytes'])} MB in {sessions['sessions']} sessions")
+        st.dataframe(
+            [{"session": session["session"], "MB": _megabytes(session["bytes"]), "largest keys": ", ".join(session["largest_keys"])}
+             for session in sessions["largest"]],
+            hide_index=True,
+        )
+
+
+def stats():
+    """Current RSS and traced memory, and the snapshots and reports taken"""
+    traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+    with _lock:
+        return {**_stats, "rss_mb": rss_mb(), "traced_mb": traced / (1024 * 1024), "tracing": tracemalloc.is_tracing()}
+
+
+metrics.register_stats("memory", stats)
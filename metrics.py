@@ -0,0 +1,276 @@
+import os
+import re
+import time
+import logging
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency buckets, in seconds: from a cached widget render to a long document summary
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+# Other modules' stats() functions, exported as gauges when metrics are collected
+_stats_sources = []
+
+_server = None
+_server_lock = threading.Lock()
+_file_writer = None
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key):
+    if not key:
+        return ""
+    escaped = []
+    for name, value in key:
+        value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A count that only goes up, per set of labels"""
+
+    type = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """Observations counted into cumulative buckets per set of labels, for p95s and the like in Prometheus"""
+
+    type = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts["buckets"][index] += 1
+            counts["sum"] += value
+            counts["count"] += 1
+
+    @contextmanager
+    def time(self, labels=None, **extra_labels):
+        """
+        Observe how long the block takes, labelled with its outcome: "ok", "error" for an
+        exception, or "interrupted" for anything else ending it (st.rerun(), st.stop()).
+        labels is read when the block ends, so it can be filled in inside the block.
+        """
+        labels = labels if labels is not None else {}
+        labels.update(extra_labels)
+        start = time.perf_counter()
+        outcome = "interrupted"
+        try:
+            yield labels
+            outcome = "ok"
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            self.observe(time.perf_counter() - start, outcome=outcome, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, counts in self._values.items():
+                for bound, count in zip(self.buckets, counts["buckets"]):
+                    samples.append((f"{self.name}_bucket", key + (("le", _format_value(float(bound))),), count))
+                samples.append((f"{self.name}_bucket", key + (("le", "+Inf"),), counts["count"]))
+                samples.append((f"{self.name}_sum", key, counts["sum"]))
+                samples.append((f"{self.name}_count", key, counts["count"]))
+        return samples
+
+
+def _get_or_create(cls, name, help, **kwargs):
+    # Streamlit re-executes app.py on every rerun, so the same metric is asked for many times
+    with _metrics_lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = cls(name, help, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Metric {name} is already registered as a {metric.type}")
+        return metric
+
+
+def counter(name, help):
+    """Return the process-wide counter called name"""
+    return _get_or_create(Counter, name, help)
+
+
+def histogram(name, help, buckets=DEFAULT_BUCKETS):
+    """Return the process-wide histogram called name"""
+    return _get_or_create(Histogram, name, help, buckets=buckets)
+
+
+def timed(histogram_name, help, **labels):
+    """Decorator observing each call of a function into a histogram"""
+    def decorator(fn):
+        metric = histogram(histogram_name, help)
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with metric.time(**labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def register_stats(prefix, stats_fn, labels=()):
+    """
+    Export what a module's stats() function returns as gauges named portal_<prefix>_<key>.
+
+    labels names the levels of nested dicts above the numeric values, e.g. ("deployment",)
+    for {"gpt4o": {"calls": 3}}. Values that are not numbers are skipped.
+    """
+    _stats_sources.append((prefix, stats_fn, tuple(labels)))
+
+
+def _flatten(value, labels, depth=0, key=()):
+    if depth < len(labels):
+        for label_value, nested in (value or {}).items():
+            if isinstance(nested, dict):
+                yield from _flatten(nested, labels, depth + 1, key + ((labels[depth], str(label_value)),))
+        return
+    for name, number in value.items():
+        if isinstance(number, bool):
+            number = int(number)
+        if isinstance(number, (int, float)):
+            yield name, key, number
+
+
+def _stats_lines():
+    lines = []
+    for prefix, stats_fn, labels in list(_stats_sources):
+        try:
+            samples = list(_flatten(stats_fn(), labels))
+        except Exception as e:
+            logger.error(f"Error collecting {prefix} stats: {str(e)}")
+            continue
+        seen = set()
+        for name, key, number in sorted(samples, key=lambda sample: sample[0]):
+            metric_name = re.sub(r"[^a-zA-Z0-9_:]", "_", f"portal_{prefix}_{name}")
+            if metric_name not in seen:
+                lines.append(f"# TYPE {metric_name} gauge")
+                seen.add(metric_name)
+            lines.append(f"{metric_name}{_format_labels(tuple(sorted(key)))} {_format_value(number)}")
+    return lines
+
+
+def render():
+    """Every metric in the Prometheus text exposition format"""
+    with _metrics_lock:
+        metrics = sorted(_metrics.values(), key=lambda metric: metric.name)
+
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, key, value in metric.samples():
+            lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+    lines.extend(_stats_lines())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves render() on /metrics for Prometheus to scrape"""
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # One line per scrape would drown the portal's own log
+        pass
+
+
+def write_file(path=None):
+    """Write render() to a file atomically, e.g. for node_exporter's textfile collector"""
+    path = path or config.METRICS_FILE
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(render())
+    os.replace(temp_path, path)
+
+
+def _write_periodically():
+    while True:
+        time.sleep(config.METRICS_FILE_INTERVAL_SECONDS)
+        try:
+            write_file()
+        except Exception as e:
+            logger.error(f"Error writing metrics to {config.METRICS_FILE}: {str(e)}")
+
+
+def start(port=None):
+    """Start serving metrics on METRICS_PORT and/or writing them to METRICS_FILE (once per process)"""
+    global _server, _file_writer
+    port = port or config.METRICS_PORT
+
+    with _server_lock:
+        if port and _server is None:
+            try:
+                _server = ThreadingHTTPServer(("0.0.0.0", int(port)), MetricsHandler)
+            except OSError as e:
+                # Another Streamlit process on this host already serves its metrics there
+                logger.error(f"Could not start metrics server on port {port}: {str(e)}")
+            else:
+                threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+                logger.info(f"Serving metrics on port {port}/metrics")
+
+        if config.METRICS_FILE and _file_writer is None:
+            _file_writer = threading.Thread(target=_write_periodically, name="metrics-file-writer", daemon=True)
+            _file_writer.start()
+            logger.info(f"Writing metrics to {config.METRICS_FILE} every {config.METRICS_FILE_INTERVAL_SECONDS}s")
+    return _server
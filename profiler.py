@@ -0,0 +1,230 @@
+import os
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+
+import streamlit as st
+
+import config
+import metrics
+from login_ui import is_admin
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Query parameter that turns profiling on for an admin's runs: ?profile=1 (cProfile) or ?profile=sampling
+QUERY_PARAM = "profile"
+
+# Only one deterministic profiler can be active per process; other runs fall back to sampling
+_cprofile_lock = threading.Lock()
+
+# The run being profiled on this script thread, if any
+_current_run = contextvars.ContextVar("profiled_run", default=None)
+
+_stats_lock = threading.Lock()
+_stats = {"profiles": 0, "cprofile": 0, "sampling": 0, "last_path": None}
+
+
+def _frame_label(path, name, line):
+    """Readable "function (path:line)", relative to the repository when inside it"""
+    if path.startswith(os.getcwd()):
+        path = os.path.relpath(path)
+    else:
+        path = os.path.join(*path.split(os.sep)[-2:])
+    return f"{name} ({path}:{line})"
+
+
+class StackSampler:
+    """
+    Samples one thread's stack every interval and counts the collapsed stacks.
+
+    The counts are written in the "folded" format read by flamegraph.pl, speedscope and
+    inferno, one "root;caller;callee count" line per distinct stack.
+    """
+
+    def __init__(self, thread_id, interval_ms):
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(_frame_label(code.co_filename, code.co_name, code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def save(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def top(self, limit):
+        """Hottest functions by samples at the top of the stack, with their inclusive time"""
+        interval_ms = self.interval * 1000
+        own, inclusive = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for function in set(frames):
+                inclusive[function] += count
+        return [
+            {"function": function, "calls": None, "self_ms": samples * interval_ms, "cumulative_ms": inclusive[function] * interval_ms}
+            for function, samples in own.most_common(limit)
+        ]
+
+
+class DeterministicProfiler:
+    """cProfile around the run, saved as a .prof file (flameprof turns it into a flamegraph, snakeviz browses it)"""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def save(self, path):
+        self.profile.dump_stats(path)
+
+    def top(self, limit):
+        """Hottest functions by their own time"""
+        rows = []
+        for (filename, line, name), (_, calls, own, cumulative, _) in pstats.Stats(self.profile).stats.items():
+            label = name if filename == "~" else _frame_label(filename, name, line)
+            rows.append({"function": label, "calls": calls, "self_ms": own * 1000, "cumulative_ms": cumulative * 1000})
+        rows.sort(key=lambda row: -row["self_ms"])
+        return rows[:limit]
+
+
+def requested_mode():
+    """The profiler the current run asked for ("cprofile" or "sampling"), or None when not profiling"""
+    value = st.query_params.get(QUERY_PARAM)
+    if not value or value.lower() in ("0", "false", "off") or not is_admin():
+        return None
+    return "sampling" if value.lower() == "sampling" else "cprofile"
+
+
+def tag(app_id):
+    """Label the profile of the current run with the app it launched"""
+    run = _current_run.get()
+    if run is not None:
+        run["app_id"] = app_id
+
+
+def _purge_old_profiles():
+    cutoff = time.time() - config.PROFILE_RETENTION_DAYS * 86400
+    for name in os.listdir(config.PROFILE_DIR):
+        path = os.path.join(config.PROFILE_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def _save(run, profiler, mode):
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    session_id = str(st.session_state.get("session_id", "anonymous"))[:8]
+    extension = "prof" if mode == "cprofile" else "folded"
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}_{run['app_id']}_{session_id}.{extension}"
+    path = os.path.join(config.PROFILE_DIR, name)
+    profiler.save(path)
+    _purge_old_profiles()
+
+    with _stats_lock:
+        _stats["profiles"] += 1
+        _stats[mode] += 1
+        _stats["last_path"] = path
+    logger.info(f"Saved {mode} profile of {run['app_id']} ({run['elapsed_ms']:.0f}ms) to {path}")
+    return path
+
+
+def _render(run, profiler, mode, path):
+    with st.sidebar.expander(f"⏱ Profile: {run['app_id']} ({run['elapsed_ms']:.0f}ms)", expanded=True):
+        st.caption(f"{mode}, saved to {path}")
+        st.dataframe(
+            [
+                {
+                    "function": row["function"],
+                    "calls": row["calls"],
+                    "self ms": round(row["self_ms"], 1),
+                    "cumulative ms": round(row["cumulative_ms"], 1),
+                }
+                for row in profiler.top(config.PROFILE_TOP_N)
+            ],
+            hide_index=True,
+        )
+        with open(path, "rb") as f:
+            st.download_button("Download profile", f.read(), file_name=os.path.basename(path), key="profile_download")
+
+
+@contextmanager
+def profile_run():
+    """
+    Profile this script run when an admin asked for it with the profile query parameter.
+
+    The profile is saved to PROFILE_DIR tagged with the app and session, and the hottest
+    functions are listed in the sidebar. Runs ended by st.rerun() or st.stop() are saved
+    without the sidebar listing. Only the script thread is profiled, not job or fan-out threads.
+    """
+    mode = requested_mode()
+    if mode is None:
+        yield
+        return
+
+    if mode == "cprofile" and not _cprofile_lock.acquire(blocking=False):
+        mode = "sampling"
+    profiler = DeterministicProfiler() if mode == "cprofile" else StackSampler(threading.get_ident(), config.PROFILE_SAMPLE_INTERVAL_MS)
+
+    run = {"app_id": "gallery"}
+    token = _current_run.set(run)
+    start = time.perf_counter()
+    completed = False
+    profiler.start()
+    try:
+        yield
+        completed = True
+    finally:
+        profiler.stop()
+        run["elapsed_ms"] = (time.perf_counter() - start) * 1000
+        _current_run.reset(token)
+        if mode == "cprofile":
+            _cprofile_lock.release()
+        try:
+            path = _save(run, profiler, mode)
+            if completed:
+                _render(run, profiler, mode, path)
+        except Exception as e:
+            logger.error(f"Error saving profile: {str(e)}")
+
+
+def stats():
+    """Profiles saved by this process"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+metrics.register_stats("profiler", stats)
@@ -0,0 +1,346 @@
+import os
+import sys
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from io import BytesIO
+from dataclasses import dataclass, fields, is_dataclass
+
+import config
+import metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Session-state keys holding chat or generation histories. They are the only keys trimmed to
+# enforce the caps, oldest entries first; everything else is measured and reported.
+HISTORY_KEYS = ("chat_messages", "chat_history", "messages", "generation_history")
+
+# A trimmed history keeps at least this many of its latest entries
+MIN_HISTORY_ITEMS = 2
+
+# Containers nested deeper than this are counted by their own size only
+MAX_MEASURE_DEPTH = 8
+
+# How often idle sessions' blobs are looked for
+SWEEP_INTERVAL_SECONDS = 300
+
+
+@dataclass(frozen=True)
+class BlobHandle:
+    """Reference to bytes or text kept on disk instead of in session state"""
+    blob_id: str
+    session_id: str
+    size: int
+    kind: str = "bytes"
+
+
+class BlobStore:
+    """
+    Directory of spilled session blobs, one sub-directory per session.
+
+    Blobs are named by the hash of their content, so storing the same upload again on every
+    rerun writes it only once.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _session_dir(self, session_id):
+        return os.path.join(self.directory, session_id)
+
+    def _path(self, handle):
+        return os.path.join(self._session_dir(handle.session_id), f"{handle.blob_id}.bin")
+
+    def put(self, session_id, data, kind="bytes"):
+        """Write data for a session and return its handle"""
+        handle = BlobHandle(hashlib.sha256(data).hexdigest(), session_id, len(data), kind)
+        path = self._path(handle)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        return handle
+
+    def get(self, handle):
+        """The data of a handle, or None if it has been evicted"""
+        try:
+            with open(self._path(handle), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def blobs(self, session_id):
+        """blob_id -> size of every blob a session has on disk"""
+        try:
+            entries = os.scandir(self._session_dir(session_id))
+        except FileNotFoundError:
+            return {}
+        with entries:
+            return {
+                entry.name[:-4]: entry.stat().st_size
+                for entry in entries if entry.name.endswith(".bin")
+            }
+
+    def delete(self, session_id, blob_id):
+        try:
+            os.remove(os.path.join(self._session_dir(session_id), f"{blob_id}.bin"))
+        except FileNotFoundError:
+            pass
+
+    def drop_session(self, session_id):
+        shutil.rmtree(self._session_dir(session_id), ignore_errors=True)
+
+    def sessions(self):
+        """session_id -> last modification time of every session with blobs on disk"""
+        try:
+            entries = os.scandir(self.directory)
+        except FileNotFoundError:
+            return {}
+        with entries:
+            return {entry.name: entry.stat().st_mtime for entry in entries if entry.is_dir()}
+
+
+store = BlobStore(config.SESSION_BLOB_DIR)
+
+# session_id -> {"last_seen", "keys", "total_bytes", "spilled_bytes", "trimmed_items", "over_cap"}
+_sessions = {}
+_evicted_sessions = 0
+_last_sweep = 0.0
+_lock = threading.Lock()
+
+
+def _current_session_id():
+    import streamlit as st
+    return st.session_state.get("session_id") or "anonymous"
+
+
+def measure(value, handles=None, _seen=None, _depth=0):
+    """
+    Approximate bytes a value holds in memory, counting nested containers once each.
+
+    Spilled blobs count only their handle; the handles found are added to the handles set.
+    Other objects (clients, widgets) count their own size only, not what they reference.
+    """
+    if _seen is None:
+        _seen = set()
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+
+    if isinstance(value, BlobHandle):
+        if handles is not None:
+            handles.add(value)
+        return sys.getsizeof(value)
+    if isinstance(value, (str, bytes, bytearray, int, float, bool)) or value is None:
+        return sys.getsizeof(value)
+    if isinstance(value, BytesIO):
+        try:
+            return sys.getsizeof(value) + value.getbuffer().nbytes
+        except ValueError:  # closed
+            return sys.getsizeof(value)
+    if hasattr(value, "memory_usage") and hasattr(value, "columns"):  # pandas DataFrame
+        try:
+            return int(value.memory_usage(deep=True).sum())
+        except Exception:
+            pass
+    if isinstance(getattr(value, "nbytes", None), int):  # numpy arrays
+        return sys.getsizeof(value) + value.nbytes
+
+    size = sys.getsizeof(value)
+    if _depth >= MAX_MEASURE_DEPTH:
+        return size
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += measure(key, handles, _seen, _depth + 1) + measure(item, handles, _seen, _depth + 1)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            size += measure(item, handles, _seen, _depth + 1)
+    elif is_dataclass(value) and not isinstance(value, type):
+        for field in fields(value):
+            size += measure(getattr(value, field.name), handles, _seen, _depth + 1)
+    return size
+
+
+def spill(data, session_id=None):
+    """
+    Keep bytes or text larger than SESSION_SPILL_KB on disk and return a handle to store in
+    session state instead. Smaller values are returned unchanged.
+    """
+    if not config.SESSION_MEMORY_ENABLED or data is None or len(data) < config.SESSION_SPILL_KB * 1024:
+        return data
+    session_id = session_id or _current_session_id()
+    try:
+        if isinstance(data, str):
+            return store.put(session_id, data.encode("utf-8"), kind="text")
+        return store.put(session_id, bytes(data))
+    except OSError as e:
+        logger.error(f"Error spilling session blob to disk: {str(e)}")
+        return data
+
+
+def load(value):
+    """The bytes or text behind a handle (None if it was evicted); other values as they are"""
+    if not isinstance(value, BlobHandle):
+        return value
+    data = store.get(value)
+    if data is None:
+        # Another replica may have spilled it, or it was evicted here while still in the session store
+        import session_store
+        data = session_store.fetch_blob(value)
+    if data is None:
+        logger.warning(f"Session blob {value.blob_id} of {value.session_id} has been evicted")
+        return None
+    return data.decode("utf-8") if value.kind == "text" else data
+
+
+def _trim(history, cap_bytes, max_items):
+    """Drop the oldest entries of a history list in place until it is within both caps"""
+    removed = max(0, len(history) - max(max_items, MIN_HISTORY_ITEMS))
+    del history[:removed]
+    sizes = [measure(item) for item in history]
+    total = sum(sizes)
+    dropped = 0
+    while total > cap_bytes and len(sizes) - dropped > MIN_HISTORY_ITEMS:
+        total -= sizes[dropped]
+        dropped += 1
+    del history[:dropped]
+    return removed + dropped
+
+
+def track(session_state=None, session_id=None):
+    """
+    Measure a session's state, enforce the caps, and delete blobs it no longer references.
+
+    Called once per script run before any app code. Histories over SESSION_HISTORY_MAX_ITEMS
+    or SESSION_KEY_CAP_MB lose their oldest entries; a session over SESSION_CAP_MB has its
+    largest histories trimmed further. Other keys over a cap are logged and counted.
+    """
+    if not config.SESSION_MEMORY_ENABLED:
+        return None
+    if session_state is None:
+        import streamlit as st
+        session_state = st.session_state
+    session_id = session_id or session_state.get("session_id") or "anonymous"
+    key_cap = config.SESSION_KEY_CAP_MB * 1024 * 1024
+    session_cap = config.SESSION_CAP_MB * 1024 * 1024
+
+    trimmed = 0
+    for key in HISTORY_KEYS:
+        history = session_state.get(key)
+        if isinstance(history, list):
+            trimmed += _trim(history, key_cap, config.SESSION_HISTORY_MAX_ITEMS)
+
+    handles = set()
+    sizes = {}
+    for key in list(session_state.keys()):
+        try:
+            sizes[str(key)] = measure(session_state[key], handles)
+        except Exception as e:
+            logger.error(f"Error measuring session key {key}: {str(e)}")
+    total = sum(sizes.values())
+
+    if total > session_cap:
+        # Trim the largest histories to half their size until the session fits
+        for key in sorted((key for key in HISTORY_KEYS if isinstance(session_state.get(key), list)), key=lambda key: -sizes[key]):
+            if total <= session_cap:
+                break
+            removed = _trim(session_state[key], sizes[key] // 2, config.SESSION_HISTORY_MAX_ITEMS)
+            if removed:
+                trimmed += removed
+                new_size = measure(session_state[key])
+                total -= sizes[key] - new_size
+                sizes[key] = new_size
+
+    over_cap = [key for key, size in sizes.items() if size > key_cap]
+    if total > session_cap:
+        over_cap.append("(session)")
+    if over_cap:
+        logger.warning(f"Session {session_id} is over its memory caps: {', '.join(over_cap)} ({total / 1048576:.1f} MB)")
+    if trimmed:
+        logger.info(f"Trimmed {trimmed} history entries from session {session_id}")
+
+    # Blobs of earlier uploads and discarded images are no longer referenced by anything
+    referenced = {handle.blob_id for handle in handles if handle.session_id == session_id}
+    spilled = 0
+    for blob_id, size in store.blobs(session_id).items():
+        if blob_id in referenced:
+            spilled += size
+        else:
+            store.delete(session_id, blob_id)
+
+    now = time.time()
+    with _lock:
+        previous = _sessions.get(session_id, {})
+        _sessions[session_id] = {
+            "last_seen": now,
+            "keys": sizes,
+            "total_bytes": total,
+            "spilled_bytes": spilled,
+            "trimmed_items": previous.get("trimmed_items", 0) + trimmed,
+            "over_cap": previous.get("over_cap", 0) + (1 if over_cap else 0),
+        }
+        sweep_due = now - _last_sweep >= SWEEP_INTERVAL_SECONDS
+    if sweep_due:
+        evict_idle()
+    return total
+
+
+def evict_idle(idle_seconds=None):
+    """Delete the spilled blobs of every session not seen for SESSION_IDLE_MINUTES"""
+    global _evicted_sessions, _last_sweep
+    idle_seconds = config.SESSION_IDLE_MINUTES * 60 if idle_seconds is None else idle_seconds
+    now = time.time()
+    with _lock:
+        _last_sweep = now
+        last_seen = {session_id: session["last_seen"] for session_id, session in _sessions.items()}
+
+    evicted = []
+    # Sessions left on disk by an earlier server process are judged by their directory's age
+    for session_id, modified_at in store.sessions().items():
+        if now - last_seen.get(session_id, modified_at) >= idle_seconds:
+            store.drop_session(session_id)
+            evicted.append(session_id)
+    for session_id, seen_at in last_seen.items():
+        if now - seen_at >= idle_seconds and session_id not in evicted:
+            evicted.append(session_id)
+
+    with _lock:
+        for session_id in evicted:
+            _sessions.pop(session_id, None)
+        _evicted_sessions += len(evicted)
+    if evicted:
+        logger.info(f"Evicted the session blobs of {len(evicted)} idle sessions")
+    return len(evicted)
+
+
+def stats(top_keys=5):
+    """Memory held by each tracked session and its largest keys, plus totals"""
+    now = time.time()
+    with _lock:
+        sessions = {}
+        for session_id, session in _sessions.items():
+            largest = sorted(session["keys"].items(), key=lambda item: -item[1])[:top_keys]
+            sessions[session_id] = {
+                "total_bytes": session["total_bytes"],
+                "spilled_bytes": session["spilled_bytes"],
+                "largest_keys": dict(largest),
+                "idle_seconds": now - session["last_seen"],
+                "trimmed_items": session["trimmed_items"],
+                "over_cap": session["over_cap"],
+            }
+        return {
+            "sessions": len(sessions),
+            "total_bytes": sum(session["total_bytes"] for session in sessions.values()),
+            "spilled_bytes": sum(session["spilled_bytes"] for session in sessions.values()),
+            "evicted_sessions": _evicted_sessions,
+            "per_session": sessions,
+        }
+
+
+metrics.register_stats("session_memory", lambda: stats(top_keys=0))
@@ -0,0 +1,590 @@
+import os
+import ssl
+import hmac
+import time
+import zlib
+import pickle
+import socket
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+from urllib.parse import unquote, urlparse
+
+import config
+import metrics
+import session_memory
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Session-state keys never written to the store: login details come from signing in again,
+# and clients and registry metadata are rebuilt by the app
+EXCLUDED_KEYS = {
+    "authenticated", "display_name", "user_email", "user_department", "auth_code",
+    "session_id", "client", "APP_METADATA",
+}
+
+# Values serialised to more than this many bytes are compressed
+COMPRESS_MIN_BYTES = 1024
+
+# A session whose state has not changed still has its expiry refreshed this often
+REFRESH_SECONDS = 60
+
+# Query parameter holding the tab's session id, so a reconnecting tab continues its own session
+QUERY_PARAM = "session"
+
+# Format markers at the start of a stored value
+_RAW = b"p"
+_COMPRESSED = b"z"
+# A signed value: the marker, an HMAC-SHA256 of the rest, then a raw or compressed value
+_SIGNED = b"s"
+_SIGNATURE_BYTES = 32
+
+CREATE_TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS session_meta (
+    session_id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS session_meta_owner ON session_meta (owner, updated_at);
+CREATE TABLE IF NOT EXISTS session_values (
+    session_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (session_id, key)
+);
+"""
+
+
+def _signature(data):
+    return hmac.new(config.SESSION_STORE_SECRET.encode("utf-8"), data, hashlib.sha256).digest()
+
+
+def dumps(value):
+    """
+    Compact serialisation of a session-state value: pickle, compressed when it is large, and
+    signed when SESSION_STORE_SECRET is set
+    """
+    payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    data = _RAW + payload
+    if len(payload) > COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(payload, 6)
+        if len(compressed) < len(payload):
+            data = _COMPRESSED + compressed
+    if config.SESSION_STORE_SECRET:
+        return _SIGNED + _signature(data) + data
+    return data
+
+
+def loads(data):
+    """
+    The value dumps() serialised. With SESSION_STORE_SECRET set, values without a valid
+    signature are refused before anything is unpickled; without it the store must be trusted,
+    which is why the redis backend does not start without a secret.
+    """
+    if config.SESSION_STORE_SECRET:
+        signature, data = data[1:1 + _SIGNATURE_BYTES], data[1 + _SIGNATURE_BYTES:]
+        if not hmac.compare_digest(signature, _signature(data)):
+            raise ValueError("stored value is unsigned or its signature does not match")
+    elif data[:1] == _SIGNED:
+        data = data[1 + _SIGNATURE_BYTES:]
+    if data[:1] == _COMPRESSED:
+        return pickle.loads(zlib.decompress(data[1:]))
+    return pickle.loads(data[1:])
+
+
+class LocalBackend:
+    """
+    Sessions in a SQLite database and spilled blobs as files, both under one directory.
+
+    Replicas share state when the directory is on a shared volume.
+    """
+
+    def __init__(self, directory, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self.blob_directory = os.path.join(directory, "blobs")
+        os.makedirs(self.blob_directory, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, "sessions.db"), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(CREATE_TABLES_SQL)
+
+    def save(self, session_id, owner, changed, removed):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO session_meta (session_id, owner, updated_at) VALUES (?, ?, ?)",
+                (session_id, owner, time.time()),
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO session_values (session_id, key, value) VALUES (?, ?, ?)",
+                [(session_id, key, value) for key, value in changed.items()],
+            )
+            self._conn.executemany(
+                "DELETE FROM session_values WHERE session_id = ? AND key = ?",
+                [(session_id, key) for key in removed],
+            )
+
+    def latest_session(self, owner):
+        """The owner's most recently saved session as (session_id, updated_at), or (None, None)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT session_id, updated_at FROM session_meta WHERE owner = ? AND updated_at > ? ORDER BY updated_at DESC LIMIT 1",
+                (owner, time.time() - self.ttl_seconds),
+            ).fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    def owner(self, session_id):
+        with self._lock:
+            row = self._conn.execute("SELECT owner FROM session_meta WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def keys(self, session_id):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT key FROM session_values WHERE session_id = ?", (session_id,))]
+
+    def get(self, session_id, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM session_values WHERE session_id = ? AND key = ?", (session_id, key)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_blob(self, blob_id, data):
+        path = os.path.join(self.blob_directory, f"{blob_id}.bin")
+        if not os.path.exists(path):
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+
+    def get_blob(self, blob_id):
+        try:
+            with open(os.path.join(self.blob_directory, f"{blob_id}.bin"), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def purge(self):
+        """Delete sessions not saved within the TTL, and blobs not written within it"""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM session_values WHERE session_id IN (SELECT session_id FROM session_meta WHERE updated_at < ?)",
+                (cutoff,),
+            )
+            self._conn.execute("DELETE FROM session_meta WHERE updated_at < ?", (cutoff,))
+        with os.scandir(self.blob_directory) as entries:
+            for entry in entries:
+                if entry.stat().st_mtime < cutoff:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+
+
+class RedisError(RuntimeError):
+    """An error reply from the Redis server"""
+
+
+class RedisConnection:
+    """
+    Minimal client for the Redis protocol (RESP): one connection shared under a lock, reconnected
+    once when it drops. Supports redis:// and rediss:// (TLS) URLs with a password and database.
+    """
+
+    def __init__(self, url, timeout=5.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.strip("/") or 0)
+        self.use_tls = parsed.scheme == "rediss"
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        if self.use_tls:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=self.host)
+        self._sock = sock
+        self._reader = sock.makefile("rb")
+        if self.password:
+            self._call(("AUTH", self.password))
+        if self.db:
+            self._call(("SELECT", self.db))
+
+    def _close(self):
+        try:
+            if self._sock is not None:
+                self._sock.close()
+        except OSError:
+            pass
+        self._sock = None
+        self._reader = None
+
+    @staticmethod
+    def _encode(args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode("utf-8")
+        if kind == b"-":
+            raise RedisError(rest.decode("utf-8"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise ConnectionError(f"Unexpected Redis reply: {line[:20]!r}")
+
+    def _call(self, args):
+        self._sock.sendall(self._encode(args))
+        return self._read_reply()
+
+    def pipeline(self, commands):
+        """Send several commands in one round trip and return their replies"""
+        with self._lock:
+            for attempt in (1, 2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    self._sock.sendall(b"".join(self._encode(args) for args in commands))
+                    replies, error = [], None
+                    for _ in commands:
+                        try:
+                            replies.append(self._read_reply())
+                        except RedisError as e:
+                            error = error or e
+                            replies.append(None)
+                    if error:
+                        raise error
+                    return replies
+                except (OSError, ConnectionError):
+                    self._close()
+                    if attempt == 2:
+                        raise
+
+    def command(self, *args):
+        return self.pipeline([args])[0]
+
+
+class RedisBackend:
+    """
+    Sessions in Redis (or anything speaking its protocol): one hash of serialised values per
+    session, plus its owner, each user's latest session, and spilled blobs, all expiring after
+    the TTL.
+    """
+
+    def __init__(self, url, ttl_seconds, prefix="aiportal"):
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.redis = RedisConnection(url)
+
+    def _key(self, *parts):
+        return ":".join((self.prefix,) + parts)
+
+    def save(self, session_id, owner, changed, removed):
+        values_key = self._key("session", session_id)
+        commands = [
+            ("SET", self._key("owner", session_id), owner, "EX", self.ttl_seconds),
+            ("SET", self._key("user", owner), f"{session_id} {time.time()}", "EX", self.ttl_seconds),
+        ]
+        if changed:
+            commands.append(("HSET", values_key, *[item for pair in changed.items() for item in pair]))
+        if removed:
+            commands.append(("HDEL", values_key, *removed))
+        commands.append(("EXPIRE", values_key, self.ttl_seconds))
+        self.redis.pipeline(commands)
+
+    def latest_session(self, owner):
+        latest = self.redis.command("GET", self._key("user", owner))
+        if not latest:
+            return None, None
+        session_id, _, updated_at = latest.decode("utf-8").partition(" ")
+        return session_id, float(updated_at or 0)
+
+    def owner(self, session_id):
+        owner = self.redis.command("GET", self._key("owner", session_id))
+        return owner.decode("utf-8") if owner else None
+
+    def keys(self, session_id):
+        return [key.decode("utf-8") for key in self.redis.command("HKEYS", self._key("session", session_id)) or []]
+
+    def get(self, session_id, key):
+        return self.redis.command("HGET", self._key("session", session_id), key)
+
+    def put_blob(self, blob_id, data):
+        # Blobs are named by their content, so an existing one only needs its expiry extended
+        self.redis.command("SET", self._key("blob", blob_id), data, "EX", self.ttl_seconds)
+
+    def get_blob(self, blob_id):
+        return self.redis.command("GET", self._key("blob", blob_id))
+
+    def purge(self):
+        pass  # Redis expires keys itself
+
+
+_backend = None
+_backend_lock = threading.Lock()
+# The redis backend was refused for want of a secret (logged once)
+_refused = False
+
+# session_id -> {key: digest of the stored value}, to write only what changed
+_saved = defaultdict(dict)
+# session_id -> when it was last written
+_saved_at = {}
+# blob ids already copied to the backend
+_saved_blobs = set()
+# keys whose values could not be serialised, logged once each
+_unserialisable = set()
+_stats = {"saves": 0, "keys_written": 0, "bytes_written": 0, "keys_removed": 0,
+          "restores": 0, "keys_restored": 0, "blobs_written": 0, "blobs_fetched": 0, "errors": 0}
+_stats_lock = threading.Lock()
+_last_purge = 0.0
+
+
+def get_backend():
+    """The configured backend, or None when the session store is off (or redis has no SESSION_STORE_SECRET)"""
+    global _backend, _refused
+    if not config.SESSION_STORE_BACKEND:
+        return None
+    with _backend_lock:
+        if _backend is None:
+            ttl_seconds = config.SESSION_STORE_TTL_HOURS * 3600
+            if config.SESSION_STORE_BACKEND == "redis":
+                # Unsigned values from a shared service would be unpickled as they are
+                if not config.SESSION_STORE_SECRET:
+                    if not _refused:
+                        logger.error("Error starting the redis session store: SESSION_STORE_SECRET is not set")
+                        _refused = True
+                    return None
+                _backend = RedisBackend(config.SESSION_STORE_REDIS_URL, ttl_seconds)
+            else:
+                _backend = LocalBackend(config.SESSION_STORE_PATH, ttl_seconds)
+        return _backend
+
+
+def _count(**counts):
+    with _stats_lock:
+        for name, value in counts.items():
+            _stats[name] += value
+
+
+def _widget_keys():
+    """User keys bound to widgets; Streamlit does not allow setting those, so they are not stored"""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        return set(get_script_run_ctx(suppress_warning=True).session_state._state._key_id_mapper.id_key_mapping.values())
+    except Exception:
+        return set()
+
+
+def _persisted_keys(session_state):
+    widget_keys = _widget_keys()
+    return [
+        key for key in session_state.keys()
+        if key not in EXCLUDED_KEYS and key not in widget_keys and not str(key).startswith("_")
+    ]
+
+
+def save(session_state=None):
+    """
+    Write the current session's changed keys to the store, with any blobs they reference.
+
+    Called at the start and end of every script run, so the state after an st.rerun() is saved
+    too. Does nothing until the user has signed in.
+    """
+    backend = get_backend()
+    if backend is None:
+        return
+    if session_state is None:
+        import streamlit as st
+        session_state = st.session_state
+    owner = session_state.get("user_email")
+    session_id = session_state.get("session_id")
+    if not owner or not session_id:
+        return
+
+    try:
+        saved = _saved[session_id]
+        changed, handles = {}, set()
+        keys = _persisted_keys(session_state)
+        for key in keys:
+            value = session_state[key]
+            try:
+                payload = dumps(value)
+            except Exception as e:
+                if key not in _unserialisable:
+                    _unserialisable.add(key)
+                    logger.warning(f"Session key {key} cannot be stored and is kept in memory only: {str(e)}")
+                continue
+            digest = hashlib.blake2b(payload, digest_size=16).digest()
+            if saved.get(key) != digest:
+                changed[key] = payload
+                saved[key] = digest
+                session_memory.measure(value, handles)
+        removed = [key for key in saved if key not in keys]
+        for key in removed:
+            del saved[key]
+
+        blobs_written = 0
+        for handle in handles:
+            if handle.blob_id not in _saved_blobs:
+                data = session_memory.store.get(handle)
+                if data is not None:
+                    backend.put_blob(handle.blob_id, data)
+                    blobs_written += 1
+                _saved_blobs.add(handle.blob_id)
+
+        now = time.time()
+        if not changed and not removed and now - _saved_at.get(session_id, 0) < REFRESH_SECONDS:
+            return
+        backend.save(session_id, owner, changed, removed)
+        _saved_at[session_id] = now
+        _count(saves=1, keys_written=len(changed), bytes_written=sum(len(value) for value in changed.values()),
+               keys_removed=len(removed), blobs_written=blobs_written)
+    except Exception as e:
+        _count(errors=1)
+        _saved.pop(session_id, None)
+        logger.error(f"Error saving session {session_id}: {str(e)}")
+
+    _maybe_purge(backend)
+
+
+def _takeover_candidate(backend, owner, requested):
+    """
+    The stored session this new Streamlit session should continue: the one named in its URL if
+    the user owns it, otherwise the user's latest session once it has been idle for
+    SESSION_STORE_TAKEOVER_IDLE_MINUTES (so a second tab next to a live one gets its own).
+    """
+    if requested and backend.owner(requested) == owner:
+        return requested
+    session_id, updated_at = backend.latest_session(owner)
+    if not session_id or time.time() - updated_at < config.SESSION_STORE_TAKEOVER_IDLE_MINUTES * 60:
+        return None
+    return session_id if backend.owner(session_id) == owner else None
+
+
+def restore(session_state=None, requested=None):
+    """
+    Continue a signed-in user's stored session in this new Streamlit session.
+
+    Runs once per Streamlit session. The session named by the ?session= query parameter (the
+    tab reconnecting, e.g. to another replica) is continued, or else the user's latest session
+    if it has gone idle. The stored session's id is adopted, so it keeps being saved under the
+    same id, and its keys are read one at a time; spilled blobs are only fetched when the app
+    loads them. Keys already set in this session are left as they are.
+    """
+    backend = get_backend()
+    if backend is None:
+        return False
+    if session_state is None:
+        import streamlit as st
+        session_state = st.session_state
+        requested = st.query_params.get(QUERY_PARAM)
+    owner = session_state.get("user_email")
+    if not owner or session_state.get("_session_restored"):
+        return False
+    session_state["_session_restored"] = True
+
+    try:
+        session_id = _takeover_candidate(backend, owner, requested)
+        if not session_id or session_id == session_state.get("session_id"):
+            return False
+        saved = _saved[session_id]
+        restored = 0
+        for key in backend.keys(session_id):
+            payload = backend.get(session_id, key)
+            if payload is None:
+                continue
+            saved[key] = hashlib.blake2b(payload, digest_size=16).digest()
+            if key in session_state:
+                continue
+            try:
+                session_state[key] = loads(payload)
+                restored += 1
+            except Exception as e:
+                logger.error(f"Error restoring session key {key}: {str(e)}")
+        session_state["session_id"] = session_id
+        _count(restores=1, keys_restored=restored)
+        logger.info(f"Restored {restored} keys of session {session_id} for {owner}")
+        return True
+    except Exception as e:
+        _count(errors=1)
+        logger.error(f"Error restoring the session of {owner}: {str(e)}")
+        return False
+
+
+def remember_in_url():
+    """Put this tab's session id in its URL, so the tab continues its own session when it reconnects"""
+    if get_backend() is None:
+        return
+    import streamlit as st
+    session_id = st.session_state.get("session_id")
+    if session_id and st.query_params.get(QUERY_PARAM) != session_id:
+        st.query_params[QUERY_PARAM] = session_id
+
+
+def fetch_blob(handle):
+    """A spilled blob from the store, copied back to the local blob store; None if it is gone"""
+    backend = get_backend()
+    if backend is None:
+        return None
+    try:
+        data = backend.get_blob(handle.blob_id)
+    except Exception as e:
+        logger.error(f"Error fetching session blob {handle.blob_id}: {str(e)}")
+        return None
+    if data is None:
+        return None
+    session_memory.store.put(handle.session_id, data, handle.kind)
+    _saved_blobs.add(handle.blob_id)
+    _count(blobs_fetched=1)
+    return data
+
+
+def _maybe_purge(backend):
+    global _last_purge
+    now = time.time()
+    if now - _last_purge < 3600:
+        return
+    _last_purge = now
+    # Forget what was written for sessions that have gone quiet; a later save rewrites them in full
+    for session_id, saved_at in list(_saved_at.items()):
+        if now - saved_at > config.SESSION_IDLE_MINUTES * 60:
+            _saved_at.pop(session_id, None)
+            _saved.pop(session_id, None)
+    try:
+        backend.purge()
+    except Exception as e:
+        logger.error(f"Error purging expired sessions: {str(e)}")
+
+
+def stats():
+    """Saves, restores and bytes written by the session store"""
+    with _stats_lock:
+        return {"backend": config.SESSION_STORE_BACKEND or None, "tracked_sessions": len(_saved), **_stats}
+
+
+metrics.register_stats("session_store", stats)
@@ -48,6 +48,54 @@ BEGIN
     CREATE INDEX idx_usage_session_id ON ai_portal_usage(session_id);
 END
 
+-- Create LLM call telemetry table (one row per model call, written in batches by llm_telemetry.py)
+IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'ai_portal_llm_calls')
+BEGIN
+    CREATE TABLE ai_portal_llm_calls (
+        id BIGINT IDENTITY(1,1) PRIMARY KEY,
+        session_id NVARCHAR(255),
+        app_id NVARCHAR(255),
+        call_type NVARCHAR(50),          -- chat, image, stt
+        deployment NVARCHAR(255),
+        prompt_tokens INT,
+        completion_tokens INT,
+        total_tokens INT,
+        latency_ms INT,
+        ttft_ms INT,                     -- time to first token, streamed calls only
+        streamed BIT,
+        error_class NVARCHAR(255),
+        call_time DATETIME,
+        reporting_period NVARCHAR(6)     -- YYYYMM format
+    );
+    
+    -- Add indexes for efficient querying
+    CREATE INDEX idx_llm_calls_session_id ON ai_portal_llm_calls(session_id);
+    CREATE INDEX idx_llm_calls_app_deployment ON ai_portal_llm_calls(app_id, deployment);
+    CREATE INDEX idx_llm_calls_reporting_period ON ai_portal_llm_calls(reporting_period);
+END
+
+-- Create view for LLM cost and latency per app and deployment
+IF NOT EXISTS (SELECT * FROM sys.views WHERE name = 'vw_llm_call_stats')
+BEGIN
+    EXEC('CREATE VIEW vw_llm_call_stats AS
+    SELECT 
+        app_id,
+        deployment,
+        call_type,
+        COUNT(*) AS call_count,
+        SUM(CASE WHEN error_class IS NULL THEN 0 ELSE 1 END) AS error_count,
+        SUM(prompt_tokens) AS prompt_tokens,
+        SUM(completion_tokens) AS completion_tokens,
+        AVG(latency_ms) AS avg_latency_ms,
+        MAX(latency_ms) AS max_latency_ms,
+        AVG(ttft_ms) AS avg_ttft_ms,
+        reporting_period
+    FROM 
+        ai_portal_llm_calls
+    GROUP BY 
+        app_id, deployment, call_type, reporting_period;');
+END
+
 -- Create view for user statistics
 IF NOT EXISTS (SELECT * FROM sys.views WHERE name = 'vw_user_stats')
 BEGIN
@@ -0,0 +1,240 @@
+import os
+import gzip
+import shutil
+import hashlib
+import logging
+import argparse
+import threading
+from functools import lru_cache
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+# Content-hashed copies of the assets live here and are what the browser actually requests
+BUILD_DIR_NAME = "dist"
+BUILD_DIR = os.path.join(STATIC_DIR, BUILD_DIR_NAME)
+
+# A gzip copy is only kept when it is meaningfully smaller (GIF/PNG/JPG are already compressed)
+MIN_COMPRESSION_SAVING = 0.10
+
+# Gallery card thumbnails (the card column is ~300px wide; 480 keeps them sharp on high-DPI screens)
+THUMBNAIL_DIR_NAME = "thumbnails"
+THUMBNAIL_WIDTH = 480
+THUMBNAIL_QUALITY = 80
+
+# Hashed file names never change content, so they can be cached for a year
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def content_hash(path):
+    """Return a short sha256 digest of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def hashed_name(name, digest):
+    """Insert the content hash before the extension, e.g. images/chatgpt.<hash>.jpg"""
+    stem, suffix = os.path.splitext(name)
+    return f"{stem}.{digest}{suffix}"
+
+
+def precompress(path):
+    """Write path.gz next to an asset if gzip saves enough to be worth serving"""
+    with open(path, "rb") as f:
+        data = f.read()
+    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(compressed) <= len(data) * (1 - MIN_COMPRESSION_SAVING):
+        with open(path + ".gz", "wb") as f:
+            f.write(compressed)
+        return True
+    return False
+
+
+@lru_cache(maxsize=1)
+def build_manifest():
+    """
+    Copy every file under static/ to static/dist/ under a content-hashed name.
+
+    Runs once per process and returns {"images/chatgpt.jpg": "images/chatgpt.<hash>.jpg", ...}.
+    Files that are already built are left alone, so restarts only hash the sources.
+    """
+    manifest = {}
+    for root, dirs, files in os.walk(STATIC_DIR):
+        # Never hash the build output itself
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != BUILD_DIR]
+        for file_name in files:
+            source = os.path.join(root, file_name)
+            name = os.path.relpath(source, STATIC_DIR).replace(os.sep, "/")
+            try:
+                target_name = hashed_name(name, content_hash(source))
+                target = os.path.join(BUILD_DIR, target_name)
+                if not os.path.exists(target):
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    shutil.copyfile(source, target)
+                    precompress(target)
+                manifest[name] = target_name
+            except Exception as e:
+                logger.error(f"Error building static asset {name}: {str(e)}")
+    return manifest
+
+
+def static_serving_enabled():
+    """Check whether Streamlit serves static/ under app/static/ (.streamlit/config.toml)"""
+    try:
+        import streamlit as st
+        return bool(st.get_option("server.enableStaticServing"))
+    except Exception:
+        return False
+
+
+@lru_cache(maxsize=1)
+def _check_static_route():
+    if not config.STATIC_ASSET_BASE_URL and not static_serving_enabled():
+        logger.error("server.enableStaticServing is off and STATIC_ASSET_BASE_URL is not set, static assets will not load")
+
+
+def _built_url(built_name):
+    """Return the browser URL of a file under static/dist"""
+    if config.STATIC_ASSET_BASE_URL:
+        return f"{config.STATIC_ASSET_BASE_URL.rstrip('/')}/{built_name}"
+    _check_static_route()
+    return f"app/static/{BUILD_DIR_NAME}/{built_name}"
+
+
+def asset_url(name):
+    """
+    Return the content-hashed URL of a file under static/, e.g. asset_url("main_background.gif").
+
+    Assets are served from STATIC_ASSET_BASE_URL when it is set (a CDN, an ingress path or
+    the server started by start_server()), otherwise through Streamlit's app/static route.
+    """
+    hashed = build_manifest().get(name)
+    if hashed is None:
+        logger.error(f"Static asset not found: {name}")
+        return ""
+
+    return _built_url(hashed)
+
+
+def thumbnail_url(name, width=THUMBNAIL_WIDTH):
+    """
+    Return the URL of a downsized WebP copy of a static image, generating it on first use.
+
+    Thumbnails are named after the source's content hash, so they are only regenerated
+    when the source image changes.
+    """
+    from PIL import Image
+
+    hashed = build_manifest().get(name)
+    if hashed is None:
+        logger.error(f"Static asset not found: {name}")
+        return ""
+
+    stem = os.path.splitext(hashed)[0]
+    thumbnail_name = f"{THUMBNAIL_DIR_NAME}/{stem}.w{width}.webp"
+    target = os.path.join(BUILD_DIR, thumbnail_name)
+    if not os.path.exists(target):
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with Image.open(os.path.join(STATIC_DIR, name)) as image:
+                image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+                image.thumbnail((width, width * 4))
+                # Write to a temporary file so a concurrent session never serves half a thumbnail
+                image.save(target + ".tmp", "WEBP", quality=THUMBNAIL_QUALITY)
+            os.replace(target + ".tmp", target)
+        except Exception as e:
+            logger.error(f"Error generating thumbnail for {name}: {str(e)}")
+            return asset_url(name)
+
+    return _built_url(thumbnail_name)
+
+
+def image_html(name, width=None, alt=""):
+    """Return an <img> tag for a static image, for use with st.markdown(unsafe_allow_html=True)"""
+    style = f" style='width: {width}px;'" if width else " style='width: 100%;'"
+    return f"<img src='{asset_url(name)}' alt='{alt}'{style}>"
+
+
+class StaticAssetHandler(SimpleHTTPRequestHandler):
+    """Serves static/dist with long-lived cache headers and precompressed gzip variants"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=BUILD_DIR, **kwargs)
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if (
+            "gzip" in self.headers.get("Accept-Encoding", "")
+            and os.path.isfile(path)
+            and os.path.isfile(path + ".gz")
+        ):
+            try:
+                f = open(path + ".gz", "rb")
+            except OSError:
+                return super().send_head()
+            self.send_response(200)
+            self.send_header("Content-Type", self.guess_type(path))
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            return f
+        return super().send_head()
+
+    def end_headers(self):
+        self.send_header("Cache-Control", CACHE_CONTROL)
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_server(port=None):
+    """Start the static asset server on a background thread (once per process)"""
+    global _server
+    port = port or config.STATIC_ASSET_PORT
+    if not port:
+        return None
+
+    with _server_lock:
+        if _server is None:
+            build_manifest()
+            try:
+                _server = ThreadingHTTPServer(("0.0.0.0", int(port)), StaticAssetHandler)
+            except OSError as e:
+                # Another Streamlit process on this host already serves the assets
+                logger.error(f"Could not start static asset server on port {port}: {str(e)}")
+                return None
+            threading.Thread(target=_server.serve_forever, name="static-assets", daemon=True).start()
+            logger.info(f"Serving static assets from {BUILD_DIR} on port {port}")
+    return _server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build content-hashed static assets and optionally serve them")
+    parser.add_argument("--serve", type=int, default=None, help="Port to serve static/dist on")
+    args = parser.parse_args()
+
+    for source_name, built_name in sorted(build_manifest().items()):
+        print(f"{source_name} -> {built_name}")
+        if source_name.startswith("images/"):
+            print(f"{source_name} -> {thumbnail_url(source_name)}")
+
+    if args.serve:
+        server = ThreadingHTTPServer(("0.0.0.0", args.serve), StaticAssetHandler)
+        logger.info(f"Serving static assets from {BUILD_DIR} on port {args.serve}")
+        server.serve_forever()